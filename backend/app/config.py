@@ -24,9 +24,90 @@ class Settings(BaseSettings):
     PDF_DIR: str = "/app/data/pdfs"
     INDEX_DIR: str = "/app/data/index"
 
+    # 检索向量模型与维度（text-embedding-v3 支持 1024/768/512/256/128/64，0 表示模型默认 1024）
+    # 构建与查询使用同一配置，记录在 manifest.json 中，不一致时加载索引会报错
+    EMBED_MODEL: str = "text-embedding-v3"
+    EMBED_DIM: int = 0
+    # 构建索引时的 embedding 请求：每批条数（text-embedding-v3 单次最多 10 条，被拒绝时自动减半）、
+    # 同时在途的请求数、每秒最多发起的请求数（0 不限）、失败重试次数与指数退避的基数/上限（秒）
+    EMBED_BATCH_SIZE: int = 10
+    EMBED_CONCURRENCY: int = 4
+    EMBED_RATE_LIMIT: float = 0
+    EMBED_MAX_RETRIES: int = 5
+    EMBED_RETRY_BASE: float = 1.0
+    EMBED_RETRY_MAX: float = 30.0
+
     TOP_K: int = 6
     CHUNK_SIZE: int = 700
     CHUNK_OVERLAP: int = 120
+    # PDF 文本抽取的进程数：0 表示 CPU 核数，1 表示在构建进程内顺序抽取
+    INGEST_WORKERS: int = 0
+    # PDF 逐页文本缓存（DATA_DIR/cache/extract）：按文件内容哈希复用，全局与用户目录共享
+    EXTRACT_CACHE: bool = True
+    # 构建索引时每批切分、embed 并落盘的分块数；内存占用与批大小而不是语料规模相关，每批写一次断点
+    BUILD_BATCH_CHUNKS: int = 512
+
+    # 用户私有索引缓存的内存预算（字节），超出后按 LRU 淘汰
+    USER_INDEX_CACHE_MAX_BYTES: int = 1024 * 1024 * 1024
+    # 同时缓存的索引个数上限，与字节预算同时生效：每个条目还占用打开的文件与内存映射，不计入字节估算
+    # （mmap 加载时常驻字节几乎只有元数据，字节预算很难触发淘汰，映射数由这里约束在 vm.max_map_count 之内）
+    USER_INDEX_CACHE_MAX_ENTRIES: int = 256
+    # 以只读 mmap 方式加载 faiss.index / embeddings.npy，同机多个 uvicorn worker 共享一份物理内存
+    INDEX_MMAP: bool = True
+    # 列式元数据中的分块文本是否逐条 zlib 压缩（省磁盘与页缓存，读取时多一次解压）
+    META_COMPRESS: bool = False
+    # BM25 分词器：char（逐字）/ bigram（中文二元 + 停用字过滤）/ jieba（需安装 jieba）
+    BM25_TOKENIZER: str = "bigram"
+    # 并行检索多个索引（全局 + 用户）的线程数
+    SEARCH_THREADS: int = 4
+
+    # 查询向量缓存：进程内 LRU + DATA_DIR/cache/query_embeddings.db
+    QUERY_EMBED_CACHE: bool = True
+    QUERY_EMBED_CACHE_MEMORY_ENTRIES: int = 2048
+    QUERY_EMBED_CACHE_MAX_ENTRIES: int = 200000
+    QUERY_EMBED_CACHE_TTL: int = 30 * 24 * 3600  # 秒
+    # 分块向量缓存（DATA_DIR/cache/chunk_embeddings.db）：按分块文本哈希 + 模型 + 维度复用已 embed 的向量
+    CHUNK_EMBED_CACHE: bool = True
+
+    # 检索结果缓存条目数（键含索引版本号，重建后自动失效），0 表示关闭
+    RESULT_CACHE_ENTRIES: int = 10000
+
+    # FAISS 索引类型：flat / ivf / hnsw / ivfpq，构建参数写入索引目录的 manifest.json
+    FAISS_INDEX_TYPE: str = "flat"
+    FAISS_NLIST: int = 0  # IVF 簇数，0 表示按 4*sqrt(n) 自动选择
+    FAISS_NPROBE: int = 16
+    FAISS_HNSW_M: int = 32
+    FAISS_HNSW_EF_CONSTRUCTION: int = 200
+    FAISS_HNSW_EF_SEARCH: int = 64
+    FAISS_PQ_M: int = 0  # PQ 子空间数，0 表示 dim/16
+    FAISS_PQ_NBITS: int = 8
+    # 向量存储精度：none（float32）/ fp16 / int8 / binary；量化后取 top_k*RESCORE_FACTOR 个候选用全精度向量重排
+    VECTOR_QUANT: str = "none"
+    RESCORE_FACTOR: int = 4
+
+    # 增量更新：墓碑（已删除文档的分块）占比超过该值时压实索引，用已存的向量重建，不调用 embedding 接口
+    INDEX_COMPACT_RATIO: float = 0.3
+    # 保留的索引版本数（含当前版本），旧版本供仍在使用它的进程读取
+    INDEX_KEEP_VERSIONS: int = 2
+    # 已加载的检索器每隔多少秒检查一次是否发布了新版本，有则在后台加载后切换
+    INDEX_RELOAD_INTERVAL: float = 1.0
+
+    # 上传 PDF 的大小上限（字节）、页数上限（0 不限）与流式写入临时文件时每次读取的字节数
+    UPLOAD_MAX_BYTES: int = 100 * 1024 * 1024
+    UPLOAD_MAX_PAGES: int = 0
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024
+
+    # 索引构建任务队列（DATA_DIR/index_jobs.db）：所有进程合计同时运行的构建数
+    INDEX_BUILD_CONCURRENCY: int = 1
+    # 是否在 Web 进程内运行构建线程；改用 scripts/index_worker.py 单独运行时设为 False
+    INDEX_WORKER_IN_PROCESS: bool = True
+    # 运行中的任务超过该秒数没有心跳视为进程已退出，重新排队
+    INDEX_JOB_LEASE: int = 120
+    # 空闲时检查队列的间隔（秒）；同一进程内入队会立即唤醒
+    INDEX_QUEUE_POLL: float = 2.0
+    # SSE 进度推送（/api/index-progress/stream）：同一进程内的构建写入进度后立即推送；
+    # 构建在其他进程（scripts/index_worker.py）中运行时，每隔这么久（秒）读取一次任务状态
+    INDEX_PROGRESS_INTERVAL: float = 2.0
 
     class Config:
         env_file = ".env"
@@ -1,14 +1,22 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
 
 from .models import Base, engine
 from .config import settings
+from .rag.registry import user_retriever_cache
+from .rag.embed_cache import get_query_embedding_cache
+from .rag.chunk_cache import get_chunk_embedding_cache
+from .rag.result_cache import result_cache
+from .rag.build_queue import get_index_queue, start_index_worker
+from .rag.doc_store import upload_stats, too_large_message, UploadTooLarge
 from .routers.auth_api import router as auth_router
 from .routers.user_api import router as user_router
 from .routers.chat_api import router as chat_router
 from .routers.quiz_api import router as quiz_router
-from .routers.upload_api import router as upload_router
+from .routers.upload_api import router as upload_router, build_index_for_user
 
 # 确保数据目录存在
 os.makedirs(settings.DATA_DIR, exist_ok=True)
@@ -18,7 +26,77 @@ os.makedirs(settings.INDEX_DIR, exist_ok=True)
 # 初始化数据库
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="RAG Tutor Web", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 每个 Web 进程启动构建线程；全局并发由队列限制。也可以关闭后用 scripts/index_worker.py 单独运行
+    worker = start_index_worker(build_index_for_user) if settings.INDEX_WORKER_IN_PROCESS else None
+    yield
+    if worker is not None:
+        worker.stop()
+
+class UploadSizeLimit:
+    """
+    限制上传接口的请求体大小。FastAPI 在调用处理函数之前就把整个 multipart 请求体写入临时文件，
+    处理函数中的检查来不及，因此在接收请求体时计数：声明的 Content-Length 超过上限时直接返回 413，
+    分块传输的请求在累计字节数超过上限时中断，剩余部分不再读取。
+    """
+
+    # 上限之外留给 multipart 的边界与表单字段
+    SLACK = 64 * 1024
+
+    def __init__(self, app, path: str):
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            await self.app(scope, receive, send)
+            return
+        limit = settings.UPLOAD_MAX_BYTES + self.SLACK
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > limit:
+            await self._reject(send)
+            return
+
+        received = 0
+        too_large = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, too_large
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    too_large = True
+                    raise UploadTooLarge(too_large_message())
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            # 超限后应用对解析失败的响应（400 等）丢弃，统一返回 413
+            if too_large:
+                return
+            started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not too_large:
+                raise
+        if too_large and not started:
+            await self._reject(send)
+
+    async def _reject(self, send):
+        upload_stats.reject(too_large=True)
+        response = JSONResponse(status_code=413, content={"detail": too_large_message()})
+        await response({"type": "http"}, None, send)
+
+app = FastAPI(title="RAG Tutor Web", version="1.0.0", lifespan=lifespan)
+
+# 在 CORS 之内：413 响应同样带跨域头
+app.add_middleware(UploadSizeLimit, path="/api/upload-pdf")
 
 # CORS 配置，允许前端跨域访问
 app.add_middleware(
@@ -33,6 +111,38 @@ app.add_middleware(
 def health():
     return {"status":"ok","service":"rag-tutor-web"}
 
+@app.get("/api/health/retriever-cache")
+def retriever_cache_stats():
+    """用户索引缓存的命中/未命中/淘汰次数与常驻内存"""
+    return user_retriever_cache.stats()
+
+@app.get("/api/health/embedding-cache")
+def embedding_cache_stats():
+    """查询向量缓存的命中率与条目数"""
+    cache = get_query_embedding_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+@app.get("/api/health/chunk-embedding-cache")
+def chunk_embedding_cache_stats():
+    """分块向量缓存的条目数、占用空间与构建时的命中率"""
+    cache = get_chunk_embedding_cache()
+    return cache.stats() if cache is not None else {"enabled": False}
+
+@app.get("/api/health/index-queue")
+def index_queue_stats():
+    """索引构建队列中各状态的任务数"""
+    return get_index_queue().stats()
+
+@app.get("/api/health/uploads")
+def upload_stats_endpoint():
+    """上传的次数、字节数与吞吐，以及因过大或不是有效 PDF 被拒绝的次数"""
+    return upload_stats.stats()
+
+@app.get("/api/health/result-cache")
+def result_cache_stats():
+    """检索结果缓存的命中率与条目数"""
+    return result_cache.stats()
+
 app.include_router(auth_router)
 app.include_router(user_router)
 app.include_router(chat_router)
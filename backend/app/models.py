@@ -1,4 +1,4 @@
-from sqlalchemy import String, Integer, ForeignKey, Text
+from sqlalchemy import String, Integer, ForeignKey, Text, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 from typing import Optional
 import uuid
@@ -46,4 +46,42 @@ class QuizQuestion(Base):
     difficulty: Mapped[Optional[str]] = mapped_column(String(20), nullable=True)  # 难度：easy/medium/hard
     source_question: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # 生成该题的原始用户提问
     message_index: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 对应 session chat 中的消息索引
-    created_at: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: int(__import__('time').time()))
\ No newline at end of file
+    created_at: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: int(__import__('time').time()))
+
+
+class Document(Base):
+    """
+    共享文档库的目录（按内容哈希，每个文档一行）：上传时登记大小与页数，构建分片后记录分块数与索引版本。
+    /api/pdfs 由它与 user_document 联表列出，构建任务只为状态不是 ready 的文档建分片。
+
+    全局文档（PDF_DIR，由 scripts/build_index.py 建全局索引）也登记在这里，global_name 为其文件名；
+    status 等字段仍只描述文档库中的分片，用户上传了同一文件时照常排队构建。
+    """
+    __tablename__ = "document"
+
+    PENDING, INDEXING, READY, FAILED = "pending", "indexing", "ready", "failed"
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    pages: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    chunks: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)  # 建好分片后填写；没有文本的 PDF 为 0
+    index_version: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # 分片 manifest 中的版本号
+    status: Mapped[str] = mapped_column(String(20), nullable=False, default=PENDING, index=True)
+    error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
+    global_name: Mapped[Optional[str]] = mapped_column(String(255), nullable=True, index=True)  # 全局文档的文件名
+    global_version: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)  # 包含它的全局索引版本
+    created_at: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: int(__import__('time').time()))
+    updated_at: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: int(__import__('time').time()), onupdate=lambda: int(__import__('time').time()))
+
+
+class UserDocument(Base):
+    """用户上传的文档：按内容哈希引用共享文档库中的 PDF 与索引分片，同一文件只存一份、只建一次索引"""
+    __tablename__ = "user_document"
+    __table_args__ = (UniqueConstraint("user_id", "filename"),)
+
+    id: Mapped[str] = mapped_column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id: Mapped[str] = mapped_column(String(36), ForeignKey("user.id"), nullable=False, index=True)
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)  # 用户上传时的文件名，检索结果中显示
+    sha256: Mapped[str] = mapped_column(String(64), nullable=False, index=True)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)
+    created_at: Mapped[int] = mapped_column(Integer, nullable=False, default=lambda: int(__import__('time').time()))
@@ -0,0 +1,323 @@
+"""
+索引构建任务队列：SQLite 持久化（DATA_DIR/index_jobs.db），多个 uvicorn worker 与独立的构建进程共享。
+
+- 同一用户排队中的任务只保留一个，构建开始前的多次上传、删除合并为一次更新
+- 同一用户同时最多一个任务在运行，所有进程合计运行中的任务不超过 INDEX_BUILD_CONCURRENCY
+- 运行中的任务定期写心跳；进程崩溃或重启后，超过 INDEX_JOB_LEASE 没有心跳的任务记为失败并重新排队，
+  全量构建从断点继续
+- 构建进度（阶段、页数与分块数、吞吐、预计剩余时间）随进度汇报写入任务行，各进程的进度接口与 SSE 推送都从这里读取；
+  同一进程内的 SSE 连接由 ProgressNotifier 在写入后立即唤醒
+"""
+import os, json, time, socket, sqlite3, asyncio, threading
+from contextlib import contextmanager
+from ..config import settings
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+# 已结束的任务保留多久（秒），之后清理
+_KEEP_FINISHED = 7 * 24 * 3600
+
+
+class ProgressNotifier:
+    """
+    进程内的任务状态变化通知：构建线程写入进度后 notify(user_id)，等待该用户的协程立即被唤醒。
+
+    每个用户有一个递增的版本号，等待方先记下 version() 再读取任务行，wait() 时版本号已变化则立即返回，
+    读取与等待之间的通知不会丢失。其他进程（scripts/index_worker.py）的进度通知不到这里，由等待超时兜底。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._broadcasts = 0  # 通知所有用户的次数，计入每个用户的版本号
+        self._versions = {}   # user_id -> 单独通知该用户的次数
+        self._waiters = {}    # user_id -> {(事件循环, asyncio.Event)}
+
+    def version(self, user_id: str) -> int:
+        with self._lock:
+            return self._broadcasts + self._versions.get(user_id, 0)
+
+    def notify(self, user_id: str = None):
+        """user_id 为 None 时通知所有用户（任务开始或结束，其他用户的排队位置随之变化）"""
+        with self._lock:
+            if user_id is None:
+                self._broadcasts += 1
+                waiters = [w for entries in self._waiters.values() for w in entries]
+            else:
+                self._versions[user_id] = self._versions.get(user_id, 0) + 1
+                waiters = list(self._waiters.get(user_id, ()))
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                pass  # 事件循环已关闭
+
+    async def wait(self, user_id: str, seen: int, timeout: float) -> bool:
+        """等到版本号不再是 seen 或超时，返回是否有新通知"""
+        entry = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            if self._broadcasts + self._versions.get(user_id, 0) != seen:
+                return True
+            self._waiters.setdefault(user_id, set()).add(entry)
+        try:
+            await asyncio.wait_for(entry[1].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                waiters = self._waiters.get(user_id)
+                waiters.discard(entry)
+                if not waiters:
+                    del self._waiters[user_id]
+
+
+class IndexJobQueue:
+    def __init__(self, db_path: str, concurrency: int, lease: float):
+        self.concurrency = max(1, concurrency)
+        self.lease = lease
+        self.updates = ProgressNotifier()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_job ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, status TEXT NOT NULL,"
+            " step TEXT NOT NULL DEFAULT '', percent INTEGER NOT NULL DEFAULT 0, error TEXT,"
+            " requests INTEGER NOT NULL DEFAULT 1, worker TEXT, created_at REAL NOT NULL,"
+            " started_at REAL, heartbeat_at REAL, finished_at REAL, detail TEXT)"
+        )
+        # 早期创建的表没有 detail 列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(index_job)")}
+        if "detail" not in columns:
+            self._conn.execute("ALTER TABLE index_job ADD COLUMN detail TEXT")
+        # 每个用户最多一个排队中的任务，多个进程同时入队也能合并
+        self._conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS index_job_queued ON index_job (user_id) WHERE status = 'queued'"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS index_job_status ON index_job (status, id)")
+
+    @contextmanager
+    def _transaction(self):
+        """BEGIN IMMEDIATE 取得写锁，读取与更新之间不会被其他进程插入"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def enqueue(self, user_id: str) -> int:
+        """请求重建用户索引，返回任务 id；已有排队中的任务时合并进去"""
+        with self._transaction() as conn:
+            row = conn.execute("SELECT id FROM index_job WHERE user_id = ? AND status = ?", (user_id, QUEUED)).fetchone()
+            if row is not None:
+                conn.execute("UPDATE index_job SET requests = requests + 1 WHERE id = ?", (row[0],))
+                job_id = row[0]
+            else:
+                job_id = conn.execute(
+                    "INSERT INTO index_job (user_id, status, step, created_at) VALUES (?, ?, '排队中', ?)",
+                    (user_id, QUEUED, time.time()),
+                ).lastrowid
+        self.notify()
+        self.updates.notify(user_id)
+        return job_id
+
+    def _recover(self, conn, now: float):
+        """心跳超时的任务记为失败并为其用户重新排队；顺带清理过期的已结束任务"""
+        lost = conn.execute(
+            "SELECT id, user_id FROM index_job WHERE status = ? AND heartbeat_at < ?", (RUNNING, now - self.lease)
+        ).fetchall()
+        for job_id, user_id in lost:
+            print(f"索引构建任务 {job_id}（用户 {user_id}）心跳超时，重新排队")
+            conn.execute(
+                "UPDATE index_job SET status = ?, error = '构建进程中断', finished_at = ? WHERE id = ?",
+                (FAILED, now, job_id),
+            )
+            conn.execute(
+                "INSERT OR IGNORE INTO index_job (user_id, status, step, created_at) VALUES (?, ?, '排队中', ?)",
+                (user_id, QUEUED, now),
+            )
+        conn.execute(
+            "DELETE FROM index_job WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, now - _KEEP_FINISHED)
+        )
+
+    def claim(self, worker: str):
+        """领取最早排队、且该用户没有任务在运行的任务，返回 (任务 id, 用户 id)；达到并发上限或无任务时返回 None"""
+        now = time.time()
+        with self._transaction() as conn:
+            self._recover(conn, now)
+            running = conn.execute("SELECT COUNT(*) FROM index_job WHERE status = ?", (RUNNING,)).fetchone()[0]
+            if running >= self.concurrency:
+                return None
+            row = conn.execute(
+                "SELECT id, user_id FROM index_job q WHERE status = ? AND NOT EXISTS"
+                " (SELECT 1 FROM index_job r WHERE r.user_id = q.user_id AND r.status = ?) ORDER BY id LIMIT 1",
+                (QUEUED, RUNNING),
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE index_job SET status = ?, worker = ?, step = '开始处理', percent = 0, detail = NULL,"
+                " started_at = ?, heartbeat_at = ? WHERE id = ?",
+                (RUNNING, worker, now, now, row[0]),
+            )
+        self.updates.notify()
+        return row
+
+    def progress(self, job_id: int, step: str, percent: int, detail: dict = None, user_id: str = None):
+        """detail 为构建函数汇报的页数、分块数、吞吐与预计剩余时间（见 progress.py）；传入 user_id 时通知等待该用户进度的连接"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE index_job SET step = ?, percent = ?, detail = ?, heartbeat_at = ? WHERE id = ?",
+                (step, percent, json.dumps(detail) if detail else None, time.time(), job_id),
+            )
+        if user_id is not None:
+            self.updates.notify(user_id)
+
+    def heartbeat(self, job_ids):
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE index_job SET heartbeat_at = ? WHERE status = ? AND id IN ({','.join('?' * len(job_ids))})",
+                [time.time(), RUNNING, *job_ids],
+            )
+
+    def finish(self, job_id: int, error: str = None):
+        with self._lock:
+            if error is None:
+                self._conn.execute(
+                    "UPDATE index_job SET status = ?, step = '完成', percent = 100, finished_at = ? WHERE id = ?",
+                    (DONE, time.time(), job_id),
+                )
+            else:
+                self._conn.execute(
+                    "UPDATE index_job SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                    (FAILED, error, time.time(), job_id),
+                )
+        # 并发名额空出，或该用户下一个排队的任务可以开始了
+        self.notify()
+        self.updates.notify()
+
+    def status(self, user_id: str):
+        """
+        用户当前的任务：优先运行中的，其次排队中的，否则最近结束的一个；没有任务返回 None。
+        构建汇报的 detail 字段（页数、分块数、吞吐等）合并在返回的字典中，已结束的任务不含 eta_seconds。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, step, percent, error, requests, created_at, started_at, finished_at, detail"
+                " FROM index_job WHERE user_id = ?"
+                " ORDER BY CASE status WHEN 'running' THEN 0 WHEN 'queued' THEN 1 ELSE 2 END, id DESC LIMIT 1",
+                (user_id,),
+            ).fetchone()
+            if row is None:
+                return None
+            job = dict(zip(("job_id", "status", "step", "percent", "error", "requests",
+                            "created_at", "started_at", "finished_at"), row))
+            if row[-1]:
+                job.update(json.loads(row[-1]))
+                if job["status"] != RUNNING:
+                    job.pop("eta_seconds", None)
+            if job["status"] == QUEUED:
+                job["position"] = self._conn.execute(
+                    "SELECT COUNT(*) FROM index_job WHERE status = ? AND id <= ?", (QUEUED, job["job_id"])
+                ).fetchone()[0]
+        return job
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM index_job GROUP BY status").fetchall()
+        return dict({QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}, **dict(rows), concurrency=self.concurrency)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def wait(self, timeout: float):
+        """等待入队或任务结束的通知（其他进程的变化靠超时后轮询发现）"""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+
+class IndexBuildWorker:
+    """
+    在当前进程中运行构建线程：从队列领取任务，调用 run(user_id, progress) 执行，progress(step, percent, detail=None)。
+
+    线程数取 INDEX_BUILD_CONCURRENCY（全局上限由队列保证）；另有一个线程为运行中的任务写心跳，
+    单批 embedding 耗时较长、两次进度汇报间隔超过租期时任务也不会被误判为中断。
+    """
+
+    def __init__(self, queue: IndexJobQueue, run, threads: int = 1, poll: float = 2.0):
+        self.queue = queue
+        self.run = run
+        self.threads = max(1, threads)
+        self.poll = poll
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._running = set()
+        self._running_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def start(self):
+        for i in range(self.threads):
+            threading.Thread(target=self._loop, name=f"index-build-{i}", daemon=True).start()
+        threading.Thread(target=self._heartbeat_loop, name="index-heartbeat", daemon=True).start()
+
+    def stop(self):
+        """不再领取新任务；正在运行的构建不会被打断，进程退出后由心跳超时重新排队"""
+        self._stop.set()
+        self.queue.notify()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            job = self.queue.claim(f"{self.name}:{threading.current_thread().name}")
+            if job is None:
+                self.queue.wait(self.poll)
+                continue
+            job_id, user_id = job
+            with self._running_lock:
+                self._running.add(job_id)
+            try:
+                self.run(user_id, lambda step, percent, detail=None: self.queue.progress(
+                    job_id, step, percent, detail, user_id))
+            except Exception as e:
+                print(f"用户 {user_id} 的索引构建失败: {e}")
+                self.queue.finish(job_id, error=str(e))
+            else:
+                self.queue.finish(job_id)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job_id)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.queue.lease / 3):
+            with self._running_lock:
+                job_ids = list(self._running)
+            if job_ids:
+                try:
+                    self.queue.heartbeat(job_ids)
+                except sqlite3.Error as e:
+                    print(f"索引构建心跳写入失败: {e}")
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_index_queue() -> IndexJobQueue:
+    """进程内单例"""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = IndexJobQueue(os.path.join(settings.DATA_DIR, "index_jobs.db"),
+                                       settings.INDEX_BUILD_CONCURRENCY, settings.INDEX_JOB_LEASE)
+    return _queue
+
+
+def start_index_worker(run) -> IndexBuildWorker:
+    worker = IndexBuildWorker(get_index_queue(), run, settings.INDEX_BUILD_CONCURRENCY, settings.INDEX_QUEUE_POLL)
+    worker.start()
+    return worker
@@ -0,0 +1,151 @@
+"""
+分块向量缓存：按内容寻址的持久化 SQLite，跨用户、跨重建共享。
+
+很多学生上传同一本教材，重建索引时相同的分块文本会被反复 embed。以
+(分块文本的 sha256, embedding 模型, 维度) 为键保存向量，构建索引时先批量查询，
+只有缓存中没有的文本才调用 DashScope。
+
+条目记录最近一次被使用的时间；gc() 删除不再被任何索引引用、且超过宽限期未使用的条目，
+宽限期避免误删正在构建中的索引刚写入的向量。
+"""
+import os, time, hashlib, sqlite3, threading
+import numpy as np
+from ..config import settings
+
+# SQLite 单条语句的参数个数有上限，批量查询按此分段
+_SQL_BATCH = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class ChunkEmbeddingCache:
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embedding ("
+            " text_hash TEXT NOT NULL, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL,"
+            " PRIMARY KEY (text_hash, model, dim))"
+        )
+
+    def get_many(self, model: str, dim: int, texts) -> list:
+        """按顺序返回每条文本的 float32 向量，未命中的位置为 None；命中的条目刷新使用时间"""
+        hashes = [text_hash(t) for t in texts]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique = list(dict.fromkeys(hashes))
+            for i in range(0, len(unique), _SQL_BATCH):
+                part = unique[i:i + _SQL_BATCH]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM chunk_embedding"
+                    f" WHERE model = ? AND dim = ? AND text_hash IN ({marks})",
+                    [model, dim, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    found[h] = np.frombuffer(blob, dtype="float32")
+                if rows:
+                    hit = [h for h, _ in rows]
+                    self._conn.execute(
+                        f"UPDATE chunk_embedding SET used_at = ?"
+                        f" WHERE model = ? AND dim = ? AND text_hash IN ({','.join('?' * len(hit))})",
+                        [now, model, dim, *hit],
+                    )
+            result = [found.get(h) for h in hashes]
+            hits = sum(v is not None for v in result)
+            self.hits += hits
+            self.misses += len(result) - hits
+        return result
+
+    def put_many(self, model: str, dim: int, texts, vectors):
+        now = time.time()
+        rows = [
+            (text_hash(t), model, dim, np.asarray(v, dtype="float32").tobytes(), now, now)
+            for t, v in zip(texts, vectors)
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO chunk_embedding (text_hash, model, dim, vector, created_at, used_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def gc(self, referenced_hashes, grace_seconds: int = 24 * 3600) -> dict:
+        """
+        删除不在 referenced_hashes 中、且超过 grace_seconds 未被使用的条目，返回删除的条数与字节数。
+
+        referenced_hashes 是当前所有索引中分块文本的哈希；只对当前 EMBED_MODEL / EMBED_DIM
+        的条目生效，换模型或维度后旧向量在宽限期后清理。
+        """
+        cutoff = time.time() - grace_seconds
+        with self._lock:
+            self._conn.execute("CREATE TEMP TABLE IF NOT EXISTS gc_keep (text_hash TEXT PRIMARY KEY)")
+            self._conn.execute("DELETE FROM gc_keep")
+            self._conn.execute("BEGIN")
+            self._conn.executemany("INSERT OR IGNORE INTO gc_keep VALUES (?)", ((h,) for h in referenced_hashes))
+            self._conn.execute("COMMIT")
+
+            # 当前模型与维度的向量只要被引用就保留；其他模型/维度的向量一律视为未引用
+            where = "used_at < ? AND NOT (text_hash IN (SELECT text_hash FROM gc_keep) AND model = ? AND dim = ?)"
+            params = (cutoff, settings.EMBED_MODEL, settings.EMBED_DIM)
+            count, nbytes = self._conn.execute(
+                f"SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM chunk_embedding WHERE {where}", params
+            ).fetchone()
+            self._conn.execute(f"DELETE FROM chunk_embedding WHERE {where}", params)
+            self._conn.execute("DELETE FROM gc_keep")
+        return {"deleted": count, "freed_bytes": nbytes}
+
+    def vacuum(self):
+        """gc 后回收数据库文件空间"""
+        with self._lock:
+            self._conn.execute("VACUUM")
+
+    def stats(self) -> dict:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT model, dim, COUNT(*), COALESCE(SUM(LENGTH(vector)), 0)"
+                " FROM chunk_embedding GROUP BY model, dim"
+            ).fetchall()
+            page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+            page_size = self._conn.execute("PRAGMA page_size").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": sum(r[2] for r in rows),
+                "vector_bytes": sum(r[3] for r in rows),
+                "file_bytes": page_count * page_size,
+                "by_model": [{"model": m, "dim": d, "entries": n, "vector_bytes": b} for m, d, n, b in rows],
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_chunk_embedding_cache():
+    """进程内单例；CHUNK_EMBED_CACHE 关闭时返回 None"""
+    global _cache
+    if not settings.CHUNK_EMBED_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ChunkEmbeddingCache(os.path.join(settings.DATA_DIR, "cache", "chunk_embeddings.db"))
+    return _cache
@@ -0,0 +1,222 @@
+"""
+按内容寻址的共享文档库：很多学生上传同一本教材时，文件只存一份，索引只建一次。
+
+布局：DATA_DIR/documents/<sha256>/
+  <sha256>.pdf   PDF 原文件
+  index/         只含这一个文档的索引分片（版本化目录，见 versions.py）
+
+用户与文档的关系（上传时的文件名 -> 哈希）记录在 user_document 表中；检索时用户的检索器由
+全局索引加上自己引用的各分片组成。删除只去掉引用，不再被引用的文档由 scripts/gc_documents.py 清理。
+"""
+import os, fcntl, hashlib, shutil, threading, time, uuid
+from contextlib import contextmanager
+import fitz  # PyMuPDF
+from fastapi.concurrency import run_in_threadpool
+from ..config import settings
+from .indexer import build_index
+from .versions import index_exists
+
+
+def store_root() -> str:
+    return os.path.join(settings.DATA_DIR, "documents")
+
+
+def document_dir(sha256: str) -> str:
+    return os.path.join(store_root(), sha256)
+
+
+def document_pdf(sha256: str) -> str:
+    return os.path.join(document_dir(sha256), sha256 + ".pdf")
+
+
+def shard_dir(sha256: str) -> str:
+    return os.path.join(document_dir(sha256), "index")
+
+
+def new_upload_path() -> str:
+    """上传的临时文件路径：与文档库在同一文件系统，入库时可以直接改名"""
+    tmp_dir = os.path.join(store_root(), "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    return os.path.join(tmp_dir, uuid.uuid4().hex + ".pdf.tmp")
+
+
+class UploadTooLarge(ValueError):
+    pass
+
+
+def format_size(size: int) -> str:
+    """提示信息中的文件大小：100 MB、1.5 MB、512 KB"""
+    for unit, scale in (("MB", 1 << 20), ("KB", 1 << 10)):
+        if size >= scale:
+            return f"{size / scale:.1f}".removesuffix(".0") + f" {unit}"
+    return f"{size} 字节"
+
+
+def too_large_message() -> str:
+    return f"文件超过 {format_size(settings.UPLOAD_MAX_BYTES)} 上限"
+
+
+class InvalidPdf(ValueError):
+    pass
+
+
+class UploadStats:
+    """上传的字节数、耗时与拒绝次数，用于观察上传吞吐"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.uploads = 0
+        self.bytes = 0
+        self.seconds = 0.0
+        self.too_large = 0
+        self.invalid = 0
+
+    def record(self, size: int, seconds: float):
+        with self._lock:
+            self.uploads += 1
+            self.bytes += size
+            self.seconds += seconds
+
+    def reject(self, too_large: bool):
+        with self._lock:
+            if too_large:
+                self.too_large += 1
+            else:
+                self.invalid += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "uploads": self.uploads,
+                "bytes": self.bytes,
+                "seconds": round(self.seconds, 3),
+                "mb_per_second": self.bytes / self.seconds / (1 << 20) if self.seconds else 0.0,
+                "rejected_too_large": self.too_large,
+                "rejected_invalid": self.invalid,
+            }
+
+
+upload_stats = UploadStats()
+
+# PDF 规范允许文件头 %PDF- 出现在前 1024 字节内
+_PDF_HEADER_WINDOW = 1024
+
+
+def _write_block(f, h, block: bytes):
+    h.update(block)
+    f.write(block)
+
+
+def _finish_upload(f):
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+
+
+def _count_pages(path: str) -> int:
+    """打开 PDF 检查能否解析，返回页数"""
+    try:
+        with fitz.open(path) as doc:
+            if doc.needs_pass:
+                raise InvalidPdf("PDF已加密，无法提取文本")
+            return doc.page_count
+    except InvalidPdf:
+        raise
+    except Exception:
+        raise InvalidPdf("PDF文件已损坏或无法解析")
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+async def save_upload(upload) -> tuple:
+    """
+    分块读取上传的文件写入临时文件，边写边计算哈希，返回 (临时文件路径, sha256, 字节数, 页数)。
+
+    写文件、计算哈希与解析 PDF 都在线程池中进行，不阻塞事件循环；超过 UPLOAD_MAX_BYTES 抛出 UploadTooLarge，
+    文件头不是 %PDF-、无法解析、没有页面或超过 UPLOAD_MAX_PAGES 抛出 InvalidPdf，失败时临时文件已删除。
+    """
+    start = time.perf_counter()
+    path = new_upload_path()
+    h = hashlib.sha256()
+    size, head = 0, b""
+    f = await run_in_threadpool(open, path, "wb")
+    try:
+        while True:
+            block = await upload.read(settings.UPLOAD_CHUNK_BYTES)
+            if not block:
+                break
+            size += len(block)
+            if size > settings.UPLOAD_MAX_BYTES:
+                raise UploadTooLarge(too_large_message())
+            if len(head) < _PDF_HEADER_WINDOW:
+                head += block[:_PDF_HEADER_WINDOW - len(head)]
+                # 读满文件头窗口就检查，不是 PDF 的文件不必读完
+                if len(head) == _PDF_HEADER_WINDOW and b"%PDF-" not in head:
+                    raise InvalidPdf("文件内容不是PDF")
+            await run_in_threadpool(_write_block, f, h, block)
+        await run_in_threadpool(_finish_upload, f)
+        if b"%PDF-" not in head:
+            raise InvalidPdf("文件内容不是PDF")
+        pages = await run_in_threadpool(_count_pages, path)
+        if pages == 0:
+            raise InvalidPdf("PDF没有页面")
+        if settings.UPLOAD_MAX_PAGES and pages > settings.UPLOAD_MAX_PAGES:
+            raise InvalidPdf(f"PDF超过 {settings.UPLOAD_MAX_PAGES} 页上限")
+    except BaseException as e:
+        f.close()
+        await run_in_threadpool(_remove, path)
+        if isinstance(e, (UploadTooLarge, InvalidPdf)):
+            upload_stats.reject(isinstance(e, UploadTooLarge))
+        raise
+    upload_stats.record(size, time.perf_counter() - start)
+    return path, h.hexdigest(), size, pages
+
+
+def store_file(tmp_path: str, sha256: str) -> bool:
+    """
+    把已算好哈希的临时文件放入文档库，返回是否为新文档；已有相同内容时丢弃临时文件。
+
+    临时文件与文档库在同一文件系统，os.replace 原子地放到位：读者要么看不到文件，要么看到完整的文件。
+    """
+    dest = document_pdf(sha256)
+    if os.path.exists(dest):
+        os.remove(tmp_path)
+        os.utime(dest)  # 刷新修改时间，gc_documents.py 的宽限期从最近一次上传算起
+        return False
+    os.makedirs(document_dir(sha256), exist_ok=True)
+    os.replace(tmp_path, dest)
+    return True
+
+
+def import_file(path: str, sha256: str):
+    """把已有的 PDF（旧版用户目录中的文件）复制进文档库"""
+    if not os.path.exists(document_pdf(sha256)):
+        tmp_path = new_upload_path()
+        shutil.copyfile(path, tmp_path)
+        store_file(tmp_path, sha256)
+
+
+@contextmanager
+def _document_lock(sha256: str):
+    """同一文档的分片在所有进程中只构建一次：并发的构建任务在文件锁上排队，拿到锁后分片已经存在"""
+    os.makedirs(document_dir(sha256), exist_ok=True)
+    with open(os.path.join(document_dir(sha256), ".lock"), "w") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_shard(sha256: str, progress=None) -> bool:
+    """构建文档的索引分片，返回是否实际构建（已存在时跳过）"""
+    with _document_lock(sha256):
+        if index_exists(shard_dir(sha256)):
+            return False
+        if not os.path.exists(document_pdf(sha256)):
+            raise RuntimeError(f"文档库中没有 {sha256}")
+        build_index(document_dir(sha256), shard_dir(sha256), progress)
+        return True
@@ -0,0 +1,176 @@
+"""
+查询向量缓存：进程内 LRU + 持久化 SQLite 两级。
+
+同一批学生会反复问相同的考研题，查询文本规范化后（NFKC、去首尾空白、合并空白、小写）
+与 embedding 模型一起作为键，命中时直接跳过 DashScope 请求。SQLite 使用 WAL 模式，
+同机多个 worker 共享同一个缓存文件。
+
+异步检索路径使用 aget / aput：内存层在事件循环中直接查询，SQLite 的读取放到线程池，
+写入交给后台写线程且不等待完成，事件循环上不做任何 SQLite 操作。
+"""
+import os, time, asyncio, hashlib, sqlite3, threading, unicodedata, re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from ..config import settings
+
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return _SPACE_RE.sub(" ", text).strip().lower()
+
+
+class QueryEmbeddingCache:
+    # 每写入这么多条检查一次过期与容量，避免每次写入都扫表
+    PRUNE_EVERY = 256
+
+    def __init__(self, db_path: str, memory_entries: int, max_entries: int, ttl_seconds: int):
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()
+        # 内存层与 SQLite 分别加锁：内存命中不必等待其他线程的磁盘读写
+        self._memory_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        # 异步路径的 SQLite 写入按提交顺序在这个线程中执行
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="query-embed-cache")
+        self._puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_embedding ("
+            " key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_query_embedding_accessed ON query_embedding(accessed_at)")
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\n{normalize_query(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, model: str, text: str):
+        """返回 float32 向量，未命中或已过期返回 None"""
+        key = self.make_key(model, text)
+        now = time.time()
+        vec = self._get_memory(key, now)
+        return vec if vec is not None else self._get_disk(key, now)
+
+    async def aget(self, model: str, text: str):
+        """get 的异步版本：内存未命中时在线程池中查询 SQLite"""
+        key = self.make_key(model, text)
+        now = time.time()
+        vec = self._get_memory(key, now)
+        return vec if vec is not None else await asyncio.to_thread(self._get_disk, key, now)
+
+    def put(self, model: str, text: str, vec):
+        key = self.make_key(model, text)
+        vec = np.asarray(vec, dtype="float32").ravel()
+        now = time.time()
+        self._remember(key, vec, now)
+        self._store(key, model, vec, now)
+
+    def aput(self, model: str, text: str, vec):
+        """异步路径使用：写入内存层后把 SQLite 写入交给后台写线程，不等待完成"""
+        key = self.make_key(model, text)
+        vec = np.asarray(vec, dtype="float32").ravel()
+        now = time.time()
+        self._remember(key, vec, now)
+        self._writer.submit(self._store_quietly, key, model, vec, now)
+
+    def _get_memory(self, key: str, now: float):
+        with self._memory_lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[1] < self.ttl_seconds:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return entry[0]
+        return None
+
+    def _get_disk(self, key: str, now: float):
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT vector, created_at FROM query_embedding WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] >= self.ttl_seconds:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE query_embedding SET accessed_at = ? WHERE key = ?", (now, key))
+            self.disk_hits += 1
+        vec = np.frombuffer(row[0], dtype="float32")
+        self._remember(key, vec, row[1])
+        return vec
+
+    def _store(self, key: str, model: str, vec, now: float):
+        with self._db_lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_embedding (key, model, dim, vector, created_at, accessed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, len(vec), vec.tobytes(), now, now),
+            )
+            self._puts += 1
+            if self._puts % self.PRUNE_EVERY == 0:
+                self._prune(now)
+
+    def _store_quietly(self, key: str, model: str, vec, now: float):
+        try:
+            self._store(key, model, vec, now)
+        except sqlite3.Error as e:
+            print(f"查询向量缓存写入失败: {e}")
+
+    def _remember(self, key, vec, created_at):
+        with self._memory_lock:
+            self._memory[key] = (vec, created_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _prune(self, now: float):
+        """删除过期条目，并按最近访问时间只保留 max_entries 条"""
+        self._conn.execute("DELETE FROM query_embedding WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute(
+            "DELETE FROM query_embedding WHERE key IN ("
+            " SELECT key FROM query_embedding ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def stats(self) -> dict:
+        with self._db_lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM query_embedding").fetchone()[0]
+        with self._memory_lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache():
+    """进程内单例；QUERY_EMBED_CACHE 关闭时返回 None"""
+    global _cache
+    if not settings.QUERY_EMBED_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = QueryEmbeddingCache(
+                    os.path.join(settings.DATA_DIR, "cache", "query_embeddings.db"),
+                    memory_entries=settings.QUERY_EMBED_CACHE_MEMORY_ENTRIES,
+                    max_entries=settings.QUERY_EMBED_CACHE_MAX_ENTRIES,
+                    ttl_seconds=settings.QUERY_EMBED_CACHE_TTL,
+                )
+    return _cache
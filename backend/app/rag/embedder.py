@@ -0,0 +1,128 @@
+"""
+构建索引用的并发 embedding 流水线。
+
+- 批大小从 EMBED_BATCH_SIZE（接口允许的最大值）开始，接口以 400 拒绝某一批时对半拆分重试，
+  并把后续批次的大小降到拆分后的大小
+- 最多 EMBED_CONCURRENCY 个请求同时在途，EMBED_RATE_LIMIT 限制每秒发起的请求数
+- 连接错误、超时、408/429 与 5xx 按指数退避 + 随机抖动重试，429 带 Retry-After 时按其等待
+- 结果按输入顺序返回；on_batch 回调在调用线程中按完成顺序执行（写缓存、汇报进度）
+"""
+import time, random, threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from openai import APIConnectionError
+from ..config import settings
+
+
+def _status(e):
+    return getattr(e, "status_code", None)
+
+
+def _is_retryable(e) -> bool:
+    """连接错误（含超时）、请求超时、限流与服务端错误可以重试"""
+    status = _status(e)
+    return isinstance(e, APIConnectionError) or status in (408, 429) or (status is not None and status >= 500)
+
+
+class RateLimiter:
+    """按固定间隔发放请求许可；rate <= 0 表示不限速"""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+def _retry_after(e) -> float | None:
+    response = getattr(e, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+class BatchEmbedder:
+    def __init__(self, embed_fn, batch_size: int, concurrency: int, rate: float = 0.0,
+                 max_retries: int = 5, backoff_base: float = 1.0, backoff_max: float = 30.0):
+        self.embed_fn = embed_fn  # texts -> 向量列表
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.limiter = RateLimiter(rate)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+
+    def embed(self, texts, on_batch=None) -> list:
+        """返回与 texts 一一对应的向量列表；任一批最终失败时取消其余请求并抛出异常"""
+        texts = list(texts)
+        results = [None] * len(texts)
+        pos = 0
+        pending = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            try:
+                while pos < len(texts) or pending:
+                    # 按当前批大小提交，保证在途请求不超过并发上限
+                    while pos < len(texts) and len(pending) < self.concurrency:
+                        batch = texts[pos:pos + self.batch_size]
+                        pending[pool.submit(self._embed_batch, batch)] = pos
+                        pos += len(batch)
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        start = pending.pop(future)
+                        vectors = future.result()
+                        results[start:start + len(vectors)] = vectors
+                        if on_batch is not None:
+                            on_batch(texts[start:start + len(vectors)], vectors)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+        return results
+
+    def _embed_batch(self, batch) -> list:
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                vectors = self.embed_fn(batch)
+            except Exception as e:
+                if _status(e) not in (400, 413) or len(batch) == 1:
+                    if not _is_retryable(e) or attempt == self.max_retries:
+                        raise
+                    delay = _retry_after(e) if _status(e) == 429 else None
+                    if delay is None:
+                        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                    print(f"embedding 请求失败，{delay:.1f}s 后重试（第 {attempt + 1} 次）: {e}")
+                    time.sleep(delay)
+                    continue
+                # 批次过大（条数或总 token 超限）：对半拆分，之后的批次也按拆分后的大小提交
+                half = len(batch) // 2
+                with self._lock:
+                    self.batch_size = min(self.batch_size, half)
+                return self._embed_batch(batch[:half]) + self._embed_batch(batch[half:])
+            if len(vectors) != len(batch):
+                raise RuntimeError(f"embedding 接口返回 {len(vectors)} 条向量，期望 {len(batch)} 条")
+            return vectors
+
+
+def batch_embedder(embed_fn) -> BatchEmbedder:
+    """按 Settings 创建流水线"""
+    return BatchEmbedder(
+        embed_fn,
+        batch_size=settings.EMBED_BATCH_SIZE,
+        concurrency=settings.EMBED_CONCURRENCY,
+        rate=settings.EMBED_RATE_LIMIT,
+        max_retries=settings.EMBED_MAX_RETRIES,
+        backoff_base=settings.EMBED_RETRY_BASE,
+        backoff_max=settings.EMBED_RETRY_MAX,
+    )
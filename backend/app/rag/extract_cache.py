@@ -0,0 +1,88 @@
+"""
+PDF 文本抽取缓存：按文件内容的 sha256 保存逐页文本，全局 PDF_DIR 与各用户目录共享。
+
+重建索引时未变化（或与别人上传的完全相同）的 PDF 只需计算一次哈希，不再打开解析。
+缓存的是切块前的逐页文本，修改 CHUNK_SIZE / CHUNK_OVERLAP 不会使缓存失效；
+抽取器（PyMuPDF 版本与抽取方式）变化时旧条目视为未命中。
+
+布局：DATA_DIR/cache/extract/<哈希前两位>/<哈希>.json.gz
+"""
+import os, json, gzip, hashlib, threading
+import fitz  # PyMuPDF
+from ..config import settings
+
+# 抽取方式或 PyMuPDF 版本变化时输出可能不同，写入条目用于校验
+EXTRACTOR = f"pymupdf-{fitz.VersionBind}-text"
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class ExtractionCache:
+    def __init__(self, root: str):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest + ".json.gz")
+
+    def get(self, digest: str):
+        """返回逐页文本列表（第 i 项为第 i+1 页），未命中返回 None"""
+        try:
+            with gzip.open(self._path(digest), "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        if entry.get("extractor") != EXTRACTOR:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry["pages"]
+
+    def put(self, digest: str, pages):
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 并发构建可能同时写同一个条目：各写各的临时文件，替换是原子的
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=3) as f:
+            json.dump({"extractor": EXTRACTOR, "pages": list(pages)}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> dict:
+        files, nbytes = 0, 0
+        for dirpath, _, filenames in os.walk(self.root):
+            for fn in filenames:
+                if fn.endswith(".json.gz"):
+                    files += 1
+                    nbytes += os.path.getsize(os.path.join(dirpath, fn))
+        lookups = self.hits + self.misses
+        return {
+            "files": files,
+            "bytes": nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_extraction_cache():
+    """进程内单例；EXTRACT_CACHE 关闭时返回 None"""
+    global _cache
+    if not settings.EXTRACT_CACHE:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ExtractionCache(os.path.join(settings.DATA_DIR, "cache", "extract"))
+    return _cache
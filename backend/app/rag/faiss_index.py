@@ -0,0 +1,219 @@
+"""
+FAISS 索引的构建与查询参数。
+
+索引类型由 Settings.FAISS_INDEX_TYPE 选择，构建时实际使用的参数写入 manifest.json 的
+"faiss" 字段，Retriever.load 按清单设置查询参数（nprobe / efSearch），与当前配置无关。
+
+  flat   精确内积暴力扫描（默认），查询代价随语料线性增长
+  ivf    倒排聚类 IVF{nlist},Flat，查询只扫描 nprobe 个簇
+  hnsw   图索引 HNSW{M},Flat，efSearch 越大召回越高、越慢
+  ivfpq  IVF{nlist},PQ{m}x{nbits}，向量压缩为 PQ 码，内存最小、召回最低
+
+Settings.VECTOR_QUANT 控制 flat / ivf / hnsw 中向量的存储精度：
+  none    float32
+  fp16    半精度标量量化（SQfp16），内存减半
+  int8    8 bit 标量量化（SQ8），内存降为 1/4
+  binary  按符号位二值化的 IndexBinaryFlat（汉明距离），内存降为 1/32，忽略索引类型
+量化或 PQ 索引先取 top_k * RESCORE_FACTOR 个候选，再用 mmap 的全精度 embeddings.npy
+重新计算内积排序，召回与 flat 基本一致。
+
+向量的标签是分块行号（与 meta 存储、embeddings.npy 的行一一对应）：IVF 自带 id，
+其余类型外包一层 IDMap，增量更新时按行号 add_with_ids / remove_ids。
+HNSW 不支持 remove_ids，删除的向量留在图中（清单里记为 stale），查询时按有效行过滤。
+"""
+import math
+import numpy as np
+import faiss
+
+INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+QUANT_TYPES = ("none", "fp16", "int8", "binary")
+
+_SQ_STORAGE = {"none": "Flat", "fp16": "SQfp16", "int8": "SQ8"}
+
+# 每次 add 的向量数，避免 mmap 的大矩阵整体复制或二值化
+_ADD_BATCH = 65536
+
+# IVF 每个簇至少需要的训练样本数，语料太小时退回 flat
+_MIN_POINTS_PER_CENTROID = 39
+
+
+# 较新版本的 faiss 支持把索引的向量区直接 mmap 到只读页（零拷贝）；旧版本退化为普通读取
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", None)
+
+
+def read_faiss_index(path: str, mmap: bool, binary: bool = False):
+    """读取 FAISS 索引；mmap=True 时尽量以只读内存映射方式加载，多个 worker 共享同一份页缓存"""
+    read = faiss.read_index_binary if binary else faiss.read_index
+    if mmap and _MMAP_FLAGS is not None:
+        return read(path, _MMAP_FLAGS | faiss.IO_FLAG_READ_ONLY), True
+    return read(path), False
+
+
+def index_params_from_settings(settings) -> dict:
+    index_type = settings.FAISS_INDEX_TYPE
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"未知的 FAISS_INDEX_TYPE: {index_type}（可选: {', '.join(INDEX_TYPES)}）")
+    if settings.VECTOR_QUANT not in QUANT_TYPES:
+        raise ValueError(f"未知的 VECTOR_QUANT: {settings.VECTOR_QUANT}（可选: {', '.join(QUANT_TYPES)}）")
+    return {
+        "type": index_type,
+        "quant": settings.VECTOR_QUANT,
+        "rescore_factor": settings.RESCORE_FACTOR,
+        "nlist": settings.FAISS_NLIST,
+        "nprobe": settings.FAISS_NPROBE,
+        "hnsw_m": settings.FAISS_HNSW_M,
+        "ef_construction": settings.FAISS_HNSW_EF_CONSTRUCTION,
+        "ef_search": settings.FAISS_HNSW_EF_SEARCH,
+        "pq_m": settings.FAISS_PQ_M,
+        "pq_nbits": settings.FAISS_PQ_NBITS,
+    }
+
+
+def _resolve(params: dict, n: int, dim: int) -> dict:
+    """补全自动参数（nlist、pq_m），语料不足以训练 IVF 时退回 flat"""
+    params = dict(params)
+    params.setdefault("quant", "none")
+    if params["quant"] == "binary":
+        params["type"] = "flat"
+    if params["type"] in ("ivf", "ivfpq"):
+        nlist = params.get("nlist") or int(4 * math.sqrt(n))
+        nlist = min(nlist, n // _MIN_POINTS_PER_CENTROID)
+        if nlist < 1:
+            params["type"] = "flat"
+        else:
+            params["nlist"] = nlist
+            params["nprobe"] = min(params.get("nprobe") or 1, nlist)
+    if params["type"] == "ivfpq":
+        pq_m = params.get("pq_m") or max(1, dim // 16)
+        # PQ 子空间数必须整除维度
+        while dim % pq_m:
+            pq_m -= 1
+        params["pq_m"] = pq_m
+        # 每个 PQ 码本需要 2^nbits 个训练样本
+        if n < (1 << params["pq_nbits"]):
+            params["type"] = "ivf"
+    return params
+
+
+def factory_string(params: dict) -> str:
+    t = params["type"]
+    if params["quant"] == "binary":
+        return "BFlat"
+    storage = _SQ_STORAGE[params["quant"]]
+    if t == "ivf":
+        return f"IVF{params['nlist']},{storage}"
+    if t == "hnsw":
+        return f"HNSW{params['hnsw_m']},{storage}"
+    if t == "ivfpq":
+        return f"IVF{params['nlist']},PQ{params['pq_m']}x{params['pq_nbits']}"
+    return storage
+
+
+def is_binary(params: dict) -> bool:
+    return params.get("quant") == "binary"
+
+
+def needs_rescore(params: dict) -> bool:
+    """有损索引（量化或 PQ）需要用全精度向量重排"""
+    return params.get("quant", "none") != "none" or params.get("type") == "ivfpq"
+
+
+def binarize(x):
+    """按符号位把 float 向量压成 bit 串（每 8 维 1 字节）"""
+    return np.packbits(np.asarray(x) > 0, axis=1)
+
+
+def build_faiss_index(embs, params: dict, ids=None):
+    """按参数构建并填充索引，返回 (index, 实际使用的参数)；ids 默认为 0..n-1"""
+    n, dim = embs.shape
+    params = _resolve(params, n, dim)
+    params["factory"] = factory_string(params)
+    params["stale"] = 0
+    ids = np.arange(n, dtype="int64") if ids is None else np.asarray(ids, dtype="int64")
+    if is_binary(params):
+        if dim % 8:
+            raise ValueError(f"二值量化要求向量维度是 8 的倍数，当前为 {dim}")
+        index = faiss.IndexBinaryIDMap(faiss.IndexBinaryFlat(dim))
+        add_vectors(index, params, embs, ids)
+        return index, params
+
+    index = faiss.index_factory(dim, params["factory"], faiss.METRIC_INNER_PRODUCT)
+    if params["type"] == "hnsw":
+        index.hnsw.efConstruction = params["ef_construction"]
+    if not index.is_trained:
+        index.train(embs)
+    if params["type"] not in ("ivf", "ivfpq"):
+        index = faiss.IndexIDMap(index)
+    add_vectors(index, params, embs, ids)
+    apply_search_params(index, params)
+    return index, params
+
+
+def add_vectors(index, params: dict, embs, ids):
+    """按行号分块追加向量，embs 可以是 mmap（IVF 沿用已训练的聚类中心，压实时才重新训练）"""
+    ids = np.asarray(ids, dtype="int64")
+    for i in range(0, len(ids), _ADD_BATCH):
+        x = np.ascontiguousarray(embs[i:i + _ADD_BATCH], dtype="float32")
+        index.add_with_ids(binarize(x) if is_binary(params) else x, ids[i:i + _ADD_BATCH])
+
+
+def remove_range(index, start: int, end: int) -> bool:
+    """删除行号在 [start, end) 的向量；索引不支持删除（HNSW）时返回 False"""
+    try:
+        index.remove_ids(faiss.IDSelectorRange(start, end))
+    except RuntimeError:
+        return False
+    return True
+
+
+def write_faiss_index(index, path: str, params: dict):
+    if is_binary(params):
+        faiss.write_index_binary(index, path)
+    else:
+        faiss.write_index(index, path)
+
+
+def search_index(index, params: dict, qv, k: int, full_vectors=None, live=None):
+    """
+    检索 k 个最近邻，返回 (分数, 行号) 两个一维数组。
+
+    需要重排的索引先取 k * rescore_factor 个候选，再用 full_vectors（全精度向量，可为 mmap）
+    计算内积重新排序；没有全精度向量时直接返回第一阶段结果。
+    live 为按行号的布尔数组时，过滤掉已删除的分块。
+    """
+    rescore = needs_rescore(params) and full_vectors is not None
+    k1 = k * max(1, params.get("rescore_factor", 1)) if rescore else k
+    if live is not None and params.get("stale"):
+        # 索引里还留着已删除的向量，按墓碑比例多取候选再过滤（墓碑比例受压实阈值限制）
+        k1 = math.ceil(k1 * index.ntotal / max(1, index.ntotal - params["stale"]))
+    if is_binary(params):
+        D, I = index.search(binarize(qv), k1)
+        # 汉明距离越小越相似，换成负数以便统一按"越大越好"处理
+        D = -D.astype("float32")
+    else:
+        D, I = index.search(qv, k1)
+    scores, ids = D[0], I[0]
+    valid = ids >= 0
+    scores, ids = scores[valid], ids[valid]
+    if live is not None:
+        keep = ids < len(live)
+        keep[keep] = live[ids[keep]]
+        scores, ids = scores[keep], ids[keep]
+
+    if rescore and len(ids):
+        # 按行号顺序读取 mmap，顺序访问对页缓存更友好
+        order = np.argsort(ids)
+        ids = ids[order]
+        scores = np.asarray(full_vectors[ids], dtype="float32") @ qv[0]
+        top = np.argsort(-scores, kind="stable")[:k]
+        return scores[top], ids[top]
+    return scores[:k], ids[:k]
+
+
+def apply_search_params(index, params: dict):
+    """按清单设置查询期参数；flat 索引没有可调参数"""
+    ps = faiss.ParameterSpace()
+    if params.get("type") in ("ivf", "ivfpq"):
+        ps.set_index_parameter(index, "nprobe", params["nprobe"])
+    elif params.get("type") == "hnsw":
+        ps.set_index_parameter(index, "efSearch", params["ef_search"])
@@ -0,0 +1,408 @@
+import os, json, time, shutil
+from itertools import islice
+import numpy as np
+from openai import OpenAI
+from ..config import settings
+from .ingest import iter_corpus_chunks, scan_pdfs, count_pages
+from .metastore import MetaStoreWriter, MetaStore
+from .rawarray import RawArrayWriter
+from .sparse import BM25Index
+from .tokenizer import get_tokenizer
+from .chunk_cache import get_chunk_embedding_cache
+from .extract_cache import get_extraction_cache
+from .embedder import batch_embedder
+from .progress import BuildProgress
+from .versions import publish, reset_staging, resolve_index_dir, stage_from_current, staging_dir
+from .manifest import MANIFEST_NAME, new_version, read_manifest, write_manifest, live_rows
+from .faiss_index import (build_faiss_index, index_params_from_settings, write_faiss_index, read_faiss_index,
+                          is_binary, add_vectors, remove_range)
+
+
+# 全量构建的断点文件：记录已落盘的批次，中断后重新构建时从这里继续
+CHECKPOINT_NAME = "build_checkpoint.json"
+
+_client = None
+
+
+def _get_client():
+    """进程内共享的客户端（连接复用）；重试由 embedder 统一处理，这里关闭 SDK 自带的重试"""
+    global _client
+    if _client is None:
+        api_key = settings.QWEN_API_KEY
+        if not api_key:
+            raise RuntimeError("Missing QWEN_API_KEY. Set it in .env file.")
+        _client = OpenAI(
+            api_key=api_key,
+            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            timeout=120.0,  # 增加超时时间
+            max_retries=0,
+        )
+    return _client
+
+
+def get_embeddings(texts, dimensions: int | None = None):
+    """
+    使用 DashScope API 获取云端嵌入向量
+
+    dimensions 为 None 时使用 Settings.EMBED_DIM（0 表示模型默认维度）
+    """
+    dim = settings.EMBED_DIM if dimensions is None else dimensions
+    kwargs = {"dimensions": dim} if dim else {}
+    response = _get_client().embeddings.create(
+        model=settings.EMBED_MODEL,
+        input=texts,
+        **kwargs
+    )
+
+    # OpenAI 兼容接口返回的嵌入向量
+    embeddings = [item.embedding for item in response.data]
+    return embeddings
+
+
+def _replace_into(path: str, write):
+    """先写 path.tmp 再原子替换：检索端可能正 mmap 着旧文件，不能原地截断"""
+    tmp_path = path + ".tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _embed_texts(texts, progress=None):
+    """
+    调用 embedding 接口（并发、自适应批大小、失败重试）。
+
+    先批量查询分块向量缓存，只 embed 缓存中没有的文本（重复文本只请求一次），
+    新向量逐批写回缓存，构建中途失败时已 embed 的部分下次不必重来。
+    progress(done) 在查完缓存后与每次 embedding 调用返回后调用，done 为 texts 中已有向量的个数。
+    """
+    cache = get_chunk_embedding_cache()
+    model, dim = settings.EMBED_MODEL, settings.EMBED_DIM
+    vectors = cache.get_many(model, dim, texts) if cache is not None else [None] * len(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    # 每个待 embed 的文本在 texts 中出现的次数，用于换算已完成的个数
+    pending = dict.fromkeys(missing, 0)
+    for t, v in zip(texts, vectors):
+        if v is None:
+            pending[t] += 1
+    done = len(texts) - sum(pending.values())
+    if progress is not None:
+        progress(done)
+
+    embedded = {}
+
+    def on_batch(batch_texts, batch_embs):
+        nonlocal done
+        if cache is not None:
+            cache.put_many(model, dim, batch_texts, batch_embs)
+        embedded.update(zip(batch_texts, batch_embs))
+        if progress is not None:
+            done += sum(pending[t] for t in batch_texts)
+            progress(done)
+
+    batch_embedder(get_embeddings).embed(missing, on_batch)
+    return np.array([v if v is not None else embedded[t] for t, v in zip(texts, vectors)], dtype="float32")
+
+
+def _batches(iterable, size: int):
+    it = iter(iterable)
+    while batch := list(islice(it, size)):
+        yield batch
+
+
+def _save_index_files(index_dir: str, index, faiss_params: dict, bm25: BM25Index):
+    """embeddings.npy.tmp 已由调用方写好，与其余文件一起替换"""
+    _replace_into(os.path.join(index_dir, "faiss.index"), lambda p: write_faiss_index(index, p, faiss_params))
+    # 全精度向量矩阵，检索端以 mmap 方式只读加载（量化索引用它重排候选）
+    os.replace(os.path.join(index_dir, "embeddings.npy.tmp"), os.path.join(index_dir, "embeddings.npy"))
+    bm25.save(index_dir)
+
+
+def _write_index_manifest(index_dir: str, documents: dict, rows: int, dim: int, faiss_params: dict) -> str:
+    """清单最后写入（新版本号出现时，其余文件都已就绪），返回版本号"""
+    chunks = sum(d["end"] - d["start"] for d in documents.values())
+    version = new_version()
+    write_manifest(index_dir, {
+        "version": version,
+        "created_at": int(time.time()),
+        "chunks": chunks,
+        "rows": rows,
+        "deleted": rows - chunks,
+        "dim": dim,
+        "embed_model": settings.EMBED_MODEL,
+        "embed_dim": settings.EMBED_DIM,
+        "bm25_tokenizer": settings.BM25_TOKENIZER,
+        "faiss": faiss_params,
+        # 构建时的索引配置（faiss 中是按语料规模调整后的实际参数），配置变化时增量更新会重建向量索引
+        "faiss_settings": index_params_from_settings(settings),
+        "documents": documents,
+    })
+    return version
+
+
+def _build_bm25(metas, live=None) -> BM25Index:
+    """从元数据存储中的文本重建 BM25（逐条分词，不把全部 token 同时放在内存）；live 为 False 的行作为墓碑"""
+    tokenize = get_tokenizer(settings.BM25_TOKENIZER)
+    tokens = (tokenize(metas.text(i)) if live is None or live[i] else None for i in range(len(metas)))
+    return BM25Index.build(tokens, tokenizer=settings.BM25_TOKENIZER)
+
+
+def _build_signature(files: dict) -> dict:
+    """决定分块内容与向量的输入；与断点记录的不一致时断点作废"""
+    return {
+        "files": files,
+        "chunk_size": settings.CHUNK_SIZE,
+        "chunk_overlap": settings.CHUNK_OVERLAP,
+        "embed_model": settings.EMBED_MODEL,
+        "embed_dim": settings.EMBED_DIM,
+        "meta_compress": settings.META_COMPRESS,
+    }
+
+
+def _read_checkpoint(index_dir: str, signature: dict):
+    try:
+        with open(os.path.join(index_dir, CHECKPOINT_NAME), "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if checkpoint.get("signature") != signature:
+        return None
+    # 断点之后的临时文件被其他构建覆盖或删除时无法续写
+    for name in ("meta_text.bin.tmp", "meta_cols.raw.tmp", "meta_offsets.raw.tmp", "embeddings.f32.tmp"):
+        if not os.path.exists(os.path.join(index_dir, name)):
+            return None
+    return checkpoint
+
+
+def _write_checkpoint(index_dir: str, checkpoint: dict):
+    def write(p):
+        with open(p, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, ensure_ascii=False)
+    _replace_into(os.path.join(index_dir, CHECKPOINT_NAME), write)
+
+
+def _clear_checkpoint(index_dir: str):
+    path = os.path.join(index_dir, CHECKPOINT_NAME)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def build_index(pdf_dir: str, index_dir: str, progress=None) -> int:
+    """
+    从 pdf_dir 构建检索索引，作为 index_dir 的新版本发布，返回分块数。
+
+    流水线按 BUILD_BATCH_CHUNKS 分批：抽取切分、embed、把文本与向量追加到磁盘上的临时文件，
+    每批落盘后写一次断点。内存中只有当前一批，构建中途失败（embedding 接口故障、进程被杀）后
+    再次构建同一目录时，若 PDF 与切分/模型配置没有变化，从断点继续，已完成的批次不再抽取与 embed。
+    构建在 staging 目录中进行，完成后才替换当前版本。
+
+    progress(step, percent, detail) 用于汇报进度（detail 含页数、分块数、吞吐与预计剩余时间，见 progress.py），
+    脚本与后台任务各自决定如何展示。
+    """
+    report = progress or (lambda step, percent, detail=None: None)
+
+    files = scan_pdfs(pdf_dir)
+    filenames = list(files)
+    position = {fn: i for i, fn in enumerate(filenames)}
+    pages = count_pages(pdf_dir, filenames)
+    tracker = BuildProgress(report, pages)
+    signature = _build_signature(files)
+
+    work_dir = staging_dir(index_dir)
+    checkpoint = _read_checkpoint(work_dir, signature)
+    if checkpoint is None:
+        work_dir = reset_staging(index_dir)
+    vectors_path = os.path.join(work_dir, "embeddings.f32.tmp")
+    if checkpoint is not None:
+        print(f"从断点继续构建 {index_dir}：已完成 {checkpoint['rows']} 个分块")
+        writer = MetaStoreWriter(work_dir, resume=checkpoint["meta"])
+        vectors = RawArrayWriter(vectors_path, "float32", (checkpoint["dim"],), rows=checkpoint["rows"])
+        documents = checkpoint["documents"]
+        file_idx, skip = checkpoint["file_idx"], checkpoint["file_rows"]
+        tracker.start(checkpoint["rows"], filenames[file_idx])
+    else:
+        writer = MetaStoreWriter(work_dir, compressed=settings.META_COMPRESS)
+        vectors = None  # 维度由第一批向量决定
+        documents = {}
+        file_idx, skip = 0, 0
+        tracker.start()
+
+    tracker.stage('构建语料', 10)
+    # 断点所在文件从头切分，跳过已写入的分块
+    chunks = islice(iter_corpus_chunks(pdf_dir, filenames[file_idx:], settings.CHUNK_SIZE, settings.CHUNK_OVERLAP,
+                                       settings.INGEST_WORKERS, get_extraction_cache()), skip, None)
+    for batch in _batches(chunks, settings.BUILD_BATCH_CHUNKS):
+        embs = _embed_texts([c[3] for c in batch], lambda done: tracker.embedded('生成嵌入', batch, done))
+        if vectors is None:
+            vectors = RawArrayWriter(vectors_path, "float32", (embs.shape[1],))
+        # 按文件名记录每个文档的行号区间（分块按文件名顺序连续写入）
+        for fn, page_no, idx, text in batch:
+            row = writer.add(fn, page_no, idx, text)
+            documents.setdefault(fn, dict(files[fn], pages=pages[fn], start=row))["end"] = row + 1
+        vectors.append(embs)
+
+        meta_state = writer.checkpoint()
+        vectors.flush()
+        last = batch[-1][0]
+        _write_checkpoint(work_dir, {
+            "signature": signature,
+            "rows": vectors.count,
+            "dim": int(embs.shape[1]),
+            "meta": meta_state,
+            "documents": documents,
+            "file_idx": position[last],
+            "file_rows": documents[last]["end"] - documents[last]["start"],
+        })
+        tracker.batch('生成嵌入', len(batch), last, batch[-1][1])
+
+    if vectors is None:
+        writer.abort()
+        shutil.rmtree(work_dir)
+        return 0
+    rows = vectors.count
+    for fn in filenames:
+        documents.setdefault(fn, dict(files[fn], pages=pages[fn], start=rows, end=rows))
+
+    tracker.stage('构建索引', 80)
+    writer.close()
+    emb_path = os.path.join(work_dir, "embeddings.npy.tmp")
+    vectors.save_npy(emb_path)
+    embs = np.load(emb_path, mmap_mode="r")
+    index, faiss_params = build_faiss_index(embs, index_params_from_settings(settings))
+
+    tracker.stage('构建BM25', 90)
+    bm25 = _build_bm25(MetaStore(work_dir))
+
+    _save_index_files(work_dir, index, faiss_params, bm25)
+    version = _write_index_manifest(work_dir, documents, rows, embs.shape[1], faiss_params)
+    _clear_checkpoint(work_dir)
+    publish(index_dir, version)
+
+    return rows
+
+
+def _can_update(index_dir: str):
+    """返回可以增量更新的清单；旧索引（没有文档表）或 embedding 配置变化时返回 None"""
+    if not os.path.exists(os.path.join(index_dir, MANIFEST_NAME)):
+        return None
+    manifest = read_manifest(index_dir)
+    if "documents" not in manifest or not os.path.exists(os.path.join(index_dir, "embeddings.npy")):
+        return None
+    if manifest.get("embed_model") != settings.EMBED_MODEL or manifest.get("embed_dim", 0) != settings.EMBED_DIM:
+        return None
+    return manifest
+
+
+def _compact(index_dir: str, documents: dict, embs) -> dict:
+    """
+    去掉墓碑行并重新编号，返回新文档表。元数据存储就地重写，
+    压实后的向量按文档区间分块复制后替换 embeddings.npy.tmp（embs 是它的 mmap）。
+    """
+    metas = MetaStore(index_dir)
+    writer = MetaStoreWriter(index_dir, compressed=settings.META_COMPRESS)
+    vectors = RawArrayWriter(os.path.join(index_dir, "embeddings.f32.tmp"), "float32", embs.shape[1:])
+    # 有效行恰好是各文档的区间，按旧行号顺序复制
+    compacted = {}
+    for fn, doc in sorted(documents.items(), key=lambda item: item[1]["start"]):
+        start = writer.count
+        for i in range(doc["start"], doc["end"]):
+            m = metas.get(i)
+            writer.add(m["book"], m["page"], m["chunk_idx"], m["text"])
+        vectors.append(embs[doc["start"]:doc["end"]])
+        compacted[fn] = dict(doc, start=start, end=writer.count)
+    writer.close()
+    # 不能原地覆盖仍被 mmap 的 embeddings.npy.tmp：另写一个文件再替换
+    emb_path = os.path.join(index_dir, "embeddings.npy.tmp")
+    vectors.save_npy(emb_path + ".compact")
+    os.replace(emb_path + ".compact", emb_path)
+    return {fn: compacted[fn] for fn in documents}
+
+
+def update_index(pdf_dir: str, index_dir: str, progress=None) -> int:
+    """
+    按文档增量更新 index_dir，返回有效分块数。
+
+    只切分、embed 新增或内容变化的 PDF，按 BUILD_BATCH_CHUNKS 分批追加到元数据存储与向量索引末尾；
+    删除的 PDF 从向量索引中 remove_ids，其分块在元数据中成为墓碑。墓碑占比超过 INDEX_COMPACT_RATIO
+    或向量索引配置变化时，用已存的全精度向量压实重建。BM25 的 IDF 依赖全体文档，每次从已存文本重建
+    （不重新解析 PDF）。没有可用的旧索引时退回全量构建。
+
+    增量更新不写断点，中途失败时已 embed 的分块由分块向量缓存复用。
+    """
+    manifest = _can_update(resolve_index_dir(index_dir))
+    if manifest is None:
+        return build_index(pdf_dir, index_dir, progress)
+    report = progress or (lambda step, percent, detail=None: None)
+
+    files = scan_pdfs(pdf_dir)
+    documents = dict(manifest["documents"])
+    removed = [fn for fn, doc in documents.items()
+               if files.get(fn) != {"size": doc["size"], "mtime_ns": doc["mtime_ns"]}]
+    added = [fn for fn in files if fn not in documents or fn in removed]
+    rebuild_faiss = manifest.get("faiss_settings") != index_params_from_settings(settings)
+    if not removed and not added and not rebuild_faiss and manifest.get("bm25_tokenizer") == settings.BM25_TOKENIZER:
+        return manifest["chunks"]
+    # 之前未完成的全量构建的 staging（含断点）随之作废
+    work_dir = stage_from_current(index_dir)
+
+    faiss_params = dict(manifest["faiss"])
+    index, _ = read_faiss_index(os.path.join(work_dir, "faiss.index"), mmap=False, binary=is_binary(faiss_params))
+    for fn in removed:
+        doc = documents.pop(fn)
+        if doc["end"] > doc["start"] and not remove_range(index, doc["start"], doc["end"]):
+            faiss_params["stale"] = faiss_params.get("stale", 0) + doc["end"] - doc["start"]
+
+    # 新分块追加在元数据与向量矩阵末尾，行号即向量标签
+    old_embs = np.load(os.path.join(work_dir, "embeddings.npy"), mmap_mode="r")
+    vectors = RawArrayWriter(os.path.join(work_dir, "embeddings.f32.tmp"), "float32", old_embs.shape[1:])
+    vectors.append(old_embs)
+    del old_embs
+    writer = MetaStoreWriter(work_dir, append=True)
+    pages = count_pages(pdf_dir, added)
+    for fn in added:
+        documents[fn] = dict(files[fn], pages=pages[fn], start=writer.count, end=writer.count)
+
+    tracker = BuildProgress(report, pages)
+    tracker.start()
+    tracker.stage('构建语料', 10)
+    try:
+        chunks = iter_corpus_chunks(pdf_dir, added, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP,
+                                    settings.INGEST_WORKERS, get_extraction_cache())
+        for batch in _batches(chunks, settings.BUILD_BATCH_CHUNKS):
+            embs = _embed_texts([c[3] for c in batch], lambda done: tracker.embedded('生成嵌入', batch, done))
+            first = writer.count
+            for fn, page_no, idx, text in batch:
+                documents[fn]["end"] = writer.add(fn, page_no, idx, text) + 1
+            vectors.append(embs)
+            add_vectors(index, faiss_params, embs, np.arange(first, writer.count))
+            tracker.batch('生成嵌入', len(batch), batch[-1][0], batch[-1][1])
+    except BaseException:
+        writer.abort()
+        vectors.abort()
+        raise
+    writer.close()
+
+    tracker.stage('构建索引', 80)
+    emb_path = os.path.join(work_dir, "embeddings.npy.tmp")
+    vectors.save_npy(emb_path)
+    embs = np.load(emb_path, mmap_mode="r")
+    rows = len(embs)
+    chunks = sum(d["end"] - d["start"] for d in documents.values())
+    if chunks == 0:
+        # 文档全部删除：移除索引目录（检索端已 mmap 的文件在取消映射前仍然有效）
+        shutil.rmtree(index_dir)
+        return 0
+    deleted = rows - chunks
+    if rebuild_faiss or deleted > rows * settings.INDEX_COMPACT_RATIO:
+        tracker.stage('压实索引', 85)
+        documents = _compact(work_dir, documents, embs)
+        embs = np.load(emb_path, mmap_mode="r")
+        rows = len(embs)
+        index, faiss_params = build_faiss_index(embs, index_params_from_settings(settings))
+
+    tracker.stage('构建BM25', 90)
+    live = live_rows(documents, rows)
+    bm25 = _build_bm25(MetaStore(work_dir), None if live.all() else live)
+
+    _save_index_files(work_dir, index, faiss_params, bm25)
+    publish(index_dir, _write_index_manifest(work_dir, documents, rows, embs.shape[1], faiss_params))
+
+    return chunks
@@ -1,5 +1,12 @@
 import os, json, math
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 import fitz  # PyMuPDF
+from .extract_cache import file_digest
+
+# 每个抽取任务处理的页数：摊薄进程间传输开销，同时让一本大书能分给多个进程
+PAGES_PER_TASK = 32
 
 def iter_pdf_pages(pdf_path: str):
     doc = fitz.open(pdf_path)
@@ -22,24 +29,87 @@ def chunk_text(text: str, chunk_size: int, overlap: int):
         start = max(0, end - overlap)
     return chunks
 
-def build_corpus(pdf_dir: str, chunk_size: int, overlap: int, out_meta_jsonl: str):
-    os.makedirs(os.path.dirname(out_meta_jsonl), exist_ok=True)
+def _extract_pages(pdf_path: str, first: int, last: int):
+    """进程池任务：抽取第 [first, last) 页（从 0 起）的文本"""
+    with fitz.open(pdf_path) as doc:
+        return [doc.load_page(i).get_text("text") or "" for i in range(first, last)]
+
+def iter_corpus_pages(pdf_dir: str, filenames, workers: int = 0, cache=None):
+    """
+    按 (文件名, 页码) 顺序逐页产出 (文件名, 页码, 文本)。
+
+    cache 为 ExtractionCache 时先按文件内容哈希查询，命中的文件不再解析，新抽取的文件整本写入缓存。
+    workers 为进程数（0 表示 CPU 核数，1 表示在当前进程顺序抽取）。多进程时按文件与页段拆分任务，
+    结果按提交顺序产出，与顺序抽取完全一致；在途任务数有上限，内存占用与语料大小无关。
+    """
+    workers = workers or os.cpu_count() or 1
+    pool = None
+    # (文件名, 需要写入缓存的哈希, 起始页, Future 或页文本列表, 是否为该文件最后一段)
+    pending = deque()
+    collected = {}  # 待写入缓存的文件已抽取的页文本
+
+    def drain():
+        fn, digest, first, result, is_last = pending.popleft()
+        texts = result.result() if isinstance(result, Future) else result
+        if digest is not None:
+            collected.setdefault(fn, []).extend(texts)
+            if is_last:
+                cache.put(digest, collected.pop(fn))
+        for i, text in enumerate(texts):
+            yield fn, first + i + 1, text  # 页码从1开始
 
-    metas = []
-    with open(out_meta_jsonl, "w", encoding="utf-8") as f:
-        for fn in sorted(os.listdir(pdf_dir)):
-            if not fn.lower().endswith(".pdf"):
-                continue
+    try:
+        for fn in filenames:
             path = os.path.join(pdf_dir, fn)
-            for page_no, page_text in iter_pdf_pages(path):
-                for idx, ch in enumerate(chunk_text(page_text, chunk_size, overlap)):
-                    meta = {
-                        "id": len(metas),
-                        "book": fn,
-                        "page": page_no,
-                        "chunk_idx": idx,
-                        "text": ch.strip()
-                    }
-                    metas.append(meta)
-                    f.write(json.dumps(meta, ensure_ascii=False) + "\n")
-    return metas
+            digest = file_digest(path) if cache is not None else None
+            pages = cache.get(digest) if cache is not None else None
+            if pages is not None:
+                pending.append((fn, None, 0, pages, True))
+            elif workers <= 1:
+                pending.append((fn, digest, 0, [text for _, text in iter_pdf_pages(path)], True))
+            else:
+                if pool is None:
+                    # spawn：后台构建运行在多线程的 Web 进程里，fork 有死锁风险
+                    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                with fitz.open(path) as doc:
+                    page_count = doc.page_count
+                if page_count == 0:
+                    pending.append((fn, digest, 0, [], True))
+                for first in range(0, page_count, PAGES_PER_TASK):
+                    last = min(page_count, first + PAGES_PER_TASK)
+                    future = pool.submit(_extract_pages, path, first, last)
+                    pending.append((fn, digest, first, future, last == page_count))
+                    while len(pending) >= workers * 2:
+                        yield from drain()
+            while len(pending) >= workers * 2:
+                yield from drain()
+        while pending:
+            yield from drain()
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+def iter_corpus_chunks(pdf_dir: str, filenames, chunk_size: int, overlap: int, workers: int = 0, cache=None):
+    """按 (文件名, 页码, 页内序号) 顺序逐块产出 (文件名, 页码, 页内序号, 文本)"""
+    for fn, page_no, page_text in iter_corpus_pages(pdf_dir, filenames, workers, cache):
+        for idx, ch in enumerate(chunk_text(page_text, chunk_size, overlap)):
+            yield fn, page_no, idx, ch.strip()
+
+def count_pages(pdf_dir: str, filenames) -> dict:
+    """{文件名: 页数}，只读取各 PDF 的页表，用于估算构建进度"""
+    counts = {}
+    for fn in filenames:
+        with fitz.open(os.path.join(pdf_dir, fn)) as doc:
+            counts[fn] = doc.page_count
+    return counts
+
+def scan_pdfs(pdf_dir: str) -> dict:
+    """列出 pdf_dir 下的 PDF 及其指纹 {文件名: {"size", "mtime_ns"}}，增量更新据此判断文档是否变化"""
+    files = {}
+    if not os.path.isdir(pdf_dir):
+        return files
+    for fn in sorted(os.listdir(pdf_dir)):
+        if fn.lower().endswith(".pdf"):
+            st = os.stat(os.path.join(pdf_dir, fn))
+            files[fn] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return files
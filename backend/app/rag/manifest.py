@@ -0,0 +1,61 @@
+"""
+索引清单 manifest.json：记录索引版本号与构建参数，由构建流程最后写入。
+
+版本号在每次构建时重新生成，检索结果缓存等以它区分同一目录下的新旧索引。
+
+"documents" 记录每个 PDF 的指纹（大小、修改时间）、页数与其分块所占的行号区间 [start, end)，
+增量更新据此判断哪些文档需要新增或删除；不在任何区间内的行是已删除的墓碑，
+"deleted" 为墓碑行数。
+"""
+import os, json, time, uuid
+import numpy as np
+
+MANIFEST_NAME = "manifest.json"
+
+
+def new_version() -> str:
+    return f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+def write_manifest(index_dir: str, manifest: dict):
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def read_manifest(index_dir: str) -> dict:
+    """读取清单；旧索引没有清单时，用 faiss.index 的修改时间与大小合成一个版本号"""
+    path = os.path.join(index_dir, MANIFEST_NAME)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    st = os.stat(os.path.join(index_dir, "faiss.index"))
+    return {"version": f"legacy-{st.st_mtime_ns}-{st.st_size}"}
+
+
+def live_rows(documents: dict, n: int):
+    """按文档区间生成有效行的布尔数组"""
+    live = np.zeros(n, dtype=bool)
+    for doc in documents.values():
+        live[doc["start"]:doc["end"]] = True
+    return live
+
+
+def _dim_label(dim: int) -> str:
+    return f"{dim} 维" if dim else "默认维度"
+
+
+def check_embedding(manifest: dict, index_dim: int, model: str, dim: int):
+    """
+    检查索引的 embedding 配置与当前配置一致，否则查询向量与索引不在同一空间。
+
+    dim 为 0 表示模型默认维度；旧索引没有记录时视为 text-embedding-v3 默认维度。
+    """
+    built_model = manifest.get("embed_model", "text-embedding-v3")
+    built_dim = manifest.get("embed_dim", 0)
+    if built_model != model or built_dim != dim or (dim and index_dim != dim):
+        raise RuntimeError(
+            f"索引的向量配置与当前配置不一致：索引为 {built_model} / {_dim_label(built_dim)}"
+            f"（实际 {index_dim} 维），当前为 {model} / {_dim_label(dim)}，请重新构建索引"
+        )
@@ -0,0 +1,219 @@
+"""
+列式元数据存储，替代逐行 JSON 的 meta.jsonl。
+
+索引目录下的文件布局：
+  meta_info.json    {"format": 1, "count": n, "compressed": bool}
+  meta_books.json   书名表，book_id -> 文件名
+  meta_cols.npy     定长结构化数组 (book_id, page, chunk_idx)，int32
+  meta_offsets.npy  uint64，长度 n+1；第 i 条文本位于 meta_text.bin 的 [offsets[i], offsets[i+1])
+  meta_text.bin     所有分块文本拼接成的 UTF-8 字节流；compressed=True 时每条单独 zlib 压缩
+
+加载时只 mmap 三个数组文件和文本区，检索时按需读取 top_k 命中的那几条文本。
+写入时先写临时文件再 os.replace，正在 mmap 旧文件的读者不受影响。
+增量更新以追加模式打开：文本直接追加到 meta_text.bin 末尾（读者只访问偏移表范围内的字节），
+定长列与偏移表仍整体重写后替换。
+"""
+import os, json, sys, mmap, zlib
+import numpy as np
+from .rawarray import RawArrayWriter
+
+META_FORMAT = 1
+META_COLS_DTYPE = np.dtype([("book_id", "<i4"), ("page", "<i4"), ("chunk_idx", "<i4")])
+
+
+class MetaStoreWriter:
+    """
+    顺序写入分块元数据。文本、定长列与偏移表都边写边落盘，close() 时才转换为 .npy 并替换，
+    内存占用与分块数无关。
+
+    append=True 在已有存储后追加；resume 为 checkpoint() 返回的状态时，续写上次中断的写入。
+    """
+
+    def __init__(self, index_dir: str, compressed: bool = False, append: bool = False, resume: dict = None):
+        self.index_dir = index_dir
+        self.compressed = compressed
+        self.append = append
+        self.books = []
+        self._book_ids = {}
+        os.makedirs(index_dir, exist_ok=True)
+
+        if resume is not None:
+            self.compressed = resume["compressed"]
+            self.books = list(resume["books"])
+            self._book_ids = {b: i for i, b in enumerate(self.books)}
+            self._text_end = resume["text_end"]
+            self._text_f = open(self._path("meta_text.bin.tmp"), "r+b")
+            self._text_f.truncate(self._text_end)
+            self._text_f.seek(0, os.SEEK_END)
+            self._cols = RawArrayWriter(self._path("meta_cols.raw.tmp"), META_COLS_DTYPE, rows=resume["count"])
+            self._offsets = RawArrayWriter(self._path("meta_offsets.raw.tmp"), "<u8", rows=resume["count"])
+            return
+
+        self._cols = RawArrayWriter(self._path("meta_cols.raw.tmp"), META_COLS_DTYPE)
+        self._offsets = RawArrayWriter(self._path("meta_offsets.raw.tmp"), "<u8")
+        if not append:
+            self._text_end = 0
+            self._text_f = open(self._path("meta_text.bin.tmp"), "wb")
+            return
+
+        with open(self._path("meta_info.json"), "r", encoding="utf-8") as f:
+            self.compressed = json.load(f).get("compressed", False)
+        with open(self._path("meta_books.json"), "r", encoding="utf-8") as f:
+            self.books = json.load(f)
+        self._book_ids = {b: i for i, b in enumerate(self.books)}
+        offsets = np.load(self._path("meta_offsets.npy"), mmap_mode="r")
+        self._cols.append(np.load(self._path("meta_cols.npy"), mmap_mode="r"))
+        self._offsets.append(offsets[:-1])
+        self._text_end = int(offsets[-1])
+        # 上次追加中途失败时末尾可能有未登记的字节，先截掉
+        self._text_f = open(self._path("meta_text.bin"), "r+b")
+        self._text_f.truncate(self._text_end)
+        self._text_f.seek(0, os.SEEK_END)
+
+    def add(self, book: str, page: int, chunk_idx: int, text: str) -> int:
+        """追加一条分块，返回其行号（即 FAISS 中的向量序号）"""
+        if book not in self._book_ids:
+            self._book_ids[book] = len(self.books)
+            self.books.append(book)
+        data = text.encode("utf-8")
+        if self.compressed:
+            data = zlib.compress(data)
+        self._text_f.write(data)
+        self._offsets.append(self._text_end)
+        self._text_end += len(data)
+        self._cols.append(np.array([(self._book_ids[book], page, chunk_idx)], dtype=META_COLS_DTYPE))
+        return self.count - 1
+
+    @property
+    def count(self) -> int:
+        return self._cols.count
+
+    def checkpoint(self) -> dict:
+        """把已写入的部分刷到磁盘，返回可用于 resume 的状态（追加模式不支持续写）"""
+        self._text_f.flush()
+        os.fsync(self._text_f.fileno())
+        self._cols.flush()
+        self._offsets.flush()
+        return {"count": self.count, "text_end": self._text_end, "books": list(self.books),
+                "compressed": self.compressed}
+
+    def close(self):
+        self._text_f.close()
+        count = self.count
+        self._offsets.append(self._text_end)
+        self._cols.save_npy(self._path("meta_cols.npy.tmp"))
+        self._offsets.save_npy(self._path("meta_offsets.npy.tmp"))
+        with open(self._path("meta_books.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(self.books, f, ensure_ascii=False)
+        names = ["meta_cols.npy", "meta_offsets.npy", "meta_books.json"]
+        if not self.append:
+            names.insert(0, "meta_text.bin")
+        for name in names:
+            os.replace(self._path(name + ".tmp"), self._path(name))
+        # meta_info.json 最后写入，存在即表示其余文件已经完整
+        with open(self._path("meta_info.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump({"format": META_FORMAT, "count": count, "compressed": self.compressed}, f)
+        os.replace(self._path("meta_info.json.tmp"), self._path("meta_info.json"))
+
+    def abort(self):
+        """放弃本次写入，删除临时文件（追加模式写入 meta_text.bin 的尾部会在下次追加时截掉）"""
+        self._text_f.close()
+        self._cols.abort()
+        self._offsets.abort()
+        if not self.append and os.path.exists(self._path("meta_text.bin.tmp")):
+            os.remove(self._path("meta_text.bin.tmp"))
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.index_dir, name)
+
+
+class MetaStore:
+    """只读的列式元数据，数组与文本区均为 mmap，常驻内存只有书名表"""
+
+    def __init__(self, index_dir: str):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, "meta_info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        self.compressed = info.get("compressed", False)
+        with open(os.path.join(index_dir, "meta_books.json"), "r", encoding="utf-8") as f:
+            self.books = json.load(f)
+        self.cols = np.load(os.path.join(index_dir, "meta_cols.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(index_dir, "meta_offsets.npy"), mmap_mode="r")
+
+        text_path = os.path.join(index_dir, "meta_text.bin")
+        self._text = None
+        if os.path.getsize(text_path) > 0:
+            with open(text_path, "rb") as f:
+                self._text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self) -> int:
+        return len(self.cols)
+
+    @property
+    def nbytes(self) -> int:
+        return sys.getsizeof(self.books) + sum(sys.getsizeof(b) for b in self.books)
+
+    def text(self, i: int) -> str:
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        if self._text is None or start == end:
+            return ""
+        data = self._text[start:end]
+        if self.compressed:
+            data = zlib.decompress(data)
+        return data.decode("utf-8")
+
+    def get(self, i: int) -> dict:
+        book_id, page, chunk_idx = self.cols[i].tolist()
+        return {
+            "id": i,
+            "book": self.books[book_id],
+            "page": page,
+            "chunk_idx": chunk_idx,
+            "text": self.text(i),
+        }
+
+
+class JsonlMetaStore:
+    """旧版 meta.jsonl 的兼容读取（全部解析进内存），接口与 MetaStore 一致"""
+
+    def __init__(self, meta_path: str):
+        self.metas = []
+        with open(meta_path, "r", encoding="utf-8") as f:
+            for line in f:
+                self.metas.append(json.loads(line))
+
+    def __len__(self) -> int:
+        return len(self.metas)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(sys.getsizeof(m) + sum(sys.getsizeof(v) for v in m.values()) for m in self.metas)
+
+    def text(self, i: int) -> str:
+        return self.metas[i]["text"]
+
+    def get(self, i: int) -> dict:
+        return self.metas[i]
+
+
+def has_meta_store(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, "meta_info.json")) or \
+        os.path.exists(os.path.join(index_dir, "meta.jsonl"))
+
+
+def open_meta_store(index_dir: str):
+    """优先打开列式存储，没有时回退到 meta.jsonl"""
+    if os.path.exists(os.path.join(index_dir, "meta_info.json")):
+        return MetaStore(index_dir)
+    return JsonlMetaStore(os.path.join(index_dir, "meta.jsonl"))
+
+
+def convert_jsonl(index_dir: str, compressed: bool = False) -> int:
+    """把已有索引目录中的 meta.jsonl 转换为列式存储，返回转换的条数"""
+    writer = MetaStoreWriter(index_dir, compressed=compressed)
+    with open(os.path.join(index_dir, "meta.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            m = json.loads(line)
+            writer.add(m["book"], m["page"], m["chunk_idx"], m["text"])
+    writer.close()
+    return writer.count
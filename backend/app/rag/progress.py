@@ -0,0 +1,78 @@
+"""
+索引构建进度：把已处理的页数、分块数换算成百分比、吞吐与预计剩余时间。
+
+构建函数的 progress 回调签名为 progress(step, percent, detail=None)，detail 是本模块产出的字典：
+  pages_done / pages_total     已抽取的页数 / 本次要处理的总页数
+  chunks_done / chunks_total   已 embed 的分块数 / 按页数比例估算的总分块数
+  pages_per_second             本次运行的抽取吞吐
+  embeddings_per_second        本次运行的分块 embed 吞吐（含命中分块向量缓存的）
+  eta_seconds                  按当前吞吐估算的剩余时间（只含抽取与 embed，之后的建索引通常很快）
+"""
+import time
+
+
+class BuildProgress:
+    def __init__(self, report, page_counts: dict, lo: int = 10, hi: int = 80):
+        """page_counts 为 {文件名: 页数}，按处理顺序排列；embed 阶段的百分比映射到 [lo, hi]"""
+        self.report = report
+        self.lo, self.hi = lo, hi
+        self._page_offset = {}  # 文件名 -> 之前各文件的页数之和
+        total = 0
+        for fn, pages in page_counts.items():
+            self._page_offset[fn] = total
+            total += pages
+        self.pages_total = total
+        self.pages_done = 0
+        self.chunks_done = 0
+        self._start = None  # (时间, 页数, 分块数)：第一批完成时的位置，断点续建时之前的部分不计入吞吐
+
+    def stage(self, step: str, percent: int):
+        self.report(step, percent, self.detail())
+
+    def start(self, chunks_done: int = 0, fn: str = None, page_no: int = 0):
+        """开始 embed 阶段；断点续建时传入已完成的分块数与最后一个分块的位置"""
+        self.chunks_done = chunks_done
+        if fn is not None:
+            self.pages_done = self._page_offset[fn] + page_no
+        self._start = (time.monotonic(), self.pages_done, self.chunks_done)
+
+    def batch(self, step: str, chunks: int, fn: str, page_no: int):
+        """一批 chunks 个分块已落盘，最后一个分块位于 fn 的第 page_no 页"""
+        self.chunks_done += chunks
+        self._advance(step, self.chunks_done, fn, page_no)
+
+    def embedded(self, step: str, batch, done: int):
+        """
+        当前批（尚未落盘）中已有 done 个分块拿到向量，每次 embedding 调用返回后汇报一次。
+        并发请求按完成顺序返回，页码取批内第 done 个分块的位置，是近似值；落盘后由 batch() 校正。
+        """
+        if done:
+            fn, page_no = batch[min(done, len(batch)) - 1][:2]
+            self._advance(step, self.chunks_done + done, fn, page_no)
+
+    def _advance(self, step: str, chunks_done: int, fn: str, page_no: int):
+        self.pages_done = self._page_offset[fn] + page_no
+        fraction = self.pages_done / self.pages_total if self.pages_total else 1.0
+        self.report(step, self.lo + int((self.hi - self.lo) * fraction), self.detail(chunks_done))
+
+    def detail(self, chunks_done: int = None) -> dict:
+        """chunks_done 默认取已落盘的分块数"""
+        chunks_done = self.chunks_done if chunks_done is None else chunks_done
+        detail = {
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "chunks_done": chunks_done,
+            "chunks_total": chunks_done,
+        }
+        if self.pages_done:
+            detail["chunks_total"] = max(chunks_done, round(chunks_done * self.pages_total / self.pages_done))
+        if self._start is None:
+            return detail
+        started, pages0, chunks0 = self._start
+        elapsed = time.monotonic() - started
+        if elapsed > 0 and self.pages_done > pages0:
+            pages_rate = (self.pages_done - pages0) / elapsed
+            detail["pages_per_second"] = round(pages_rate, 2)
+            detail["embeddings_per_second"] = round((chunks_done - chunks0) / elapsed, 2)
+            detail["eta_seconds"] = round((self.pages_total - self.pages_done) / pages_rate, 1)
+        return detail
@@ -0,0 +1,60 @@
+"""
+追加写入的定长数组文件：构建过程中逐批追加原始字节，完成后一次转换为 .npy。
+
+大语料构建时不必在内存中拼出整个数组（分块元数据列、向量矩阵），转换时按块复制。
+写入进度可以 flush 到磁盘；中断后按检查点记录的行数截断，丢掉检查点之后的部分继续追加。
+"""
+import os
+import numpy as np
+
+# 追加大数组与转换 .npy 时每次处理的行数
+_COPY_ROWS = 65536
+
+
+class RawArrayWriter:
+    def __init__(self, path: str, dtype, row_shape=(), rows: int | None = None):
+        """rows 不为 None 时续写已有文件，先截断到 rows 行"""
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.row_shape = tuple(row_shape)
+        self.row_bytes = self.dtype.itemsize * int(np.prod(self.row_shape, dtype=np.int64))
+        if rows is None:
+            self._f = open(path, "wb")
+            self.count = 0
+        else:
+            self._f = open(path, "r+b")
+            self._f.truncate(rows * self.row_bytes)
+            self._f.seek(0, os.SEEK_END)
+            self.count = rows
+
+    def append(self, arr):
+        """追加若干行；arr 可以是 mmap 的大数组，按块复制"""
+        arr = np.asarray(arr, dtype=self.dtype).reshape((-1,) + self.row_shape)
+        for i in range(0, len(arr), _COPY_ROWS):
+            self._f.write(np.ascontiguousarray(arr[i:i + _COPY_ROWS]).tobytes())
+        self.count += len(arr)
+
+    def flush(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def save_npy(self, npy_path: str):
+        """转换为 .npy 并删除原始文件"""
+        self._f.close()
+        shape = (self.count,) + self.row_shape
+        if self.count == 0:
+            with open(npy_path, "wb") as f:
+                np.save(f, np.empty(shape, dtype=self.dtype))
+        else:
+            out = np.lib.format.open_memmap(npy_path, mode="w+", dtype=self.dtype, shape=shape)
+            src = np.memmap(self.path, dtype=self.dtype, mode="r", shape=shape)
+            for i in range(0, self.count, _COPY_ROWS):
+                out[i:i + _COPY_ROWS] = src[i:i + _COPY_ROWS]
+            out.flush()
+            del out, src
+        os.remove(self.path)
+
+    def abort(self):
+        self._f.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
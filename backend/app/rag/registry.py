@@ -0,0 +1,214 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from .retriever import Retriever
+from .versions import current_version
+from ..config import settings
+
+
+class IndexUnavailable(RuntimeError):
+    """索引加载失败（如尚未构建）；失败记录在注册表中，发布新版本之前不再重复加载"""
+
+
+class _Reloader:
+    """
+    在后台线程加载索引的新版本，加载完成后由 on_loaded 替换缓存中的旧实例。
+
+    替换前后的请求各自持有自己拿到的实例，正在进行的检索不受影响，也不必等待加载；
+    同一个键同时只有一个加载在进行。
+    """
+
+    def __init__(self):
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def submit(self, key, loader, on_loaded):
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        def run():
+            try:
+                retriever = loader()
+            except Exception as e:
+                print(f"索引热加载失败，继续使用旧版本: {e}")
+            else:
+                on_loaded(retriever)
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+
+        threading.Thread(target=run, name="index-reload", daemon=True).start()
+
+
+class IndexRegistry:
+    """
+    进程级索引注册表。
+
+    每个索引目录在进程内只加载一次，之后所有用户拿到的都是同一个
+    Retriever 实例的引用。Retriever.search 只读取索引，不修改状态，
+    因此可以在多个请求之间安全共享。发布新版本后在后台加载并替换。
+
+    加载失败（例如还没有构建全局索引）时记住失败时的版本指针，之后的请求直接抛出 IndexUnavailable；
+    与 Retriever.is_stale 一样最多每 INDEX_RELOAD_INTERVAL 秒读一次指针，指针变化（发布了新版本）才重新加载。
+    """
+
+    def __init__(self, top_k: int):
+        self.top_k = top_k
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self._dir_locks = {}
+        self._reloader = _Reloader()
+        self._failures = {}  # index_dir -> [失败时的版本指针, 错误信息, 上次检查指针的时间]
+        self.reloads = 0
+
+    def _dir_lock(self, index_dir: str) -> threading.Lock:
+        with self._lock:
+            if index_dir not in self._dir_locks:
+                self._dir_locks[index_dir] = threading.Lock()
+            return self._dir_locks[index_dir]
+
+    def _load(self, index_dir: str) -> Retriever:
+        retriever = Retriever(index_dir, self.top_k)
+        retriever.load()
+        return retriever
+
+    def get(self, index_dir: str) -> Retriever:
+        """返回 index_dir 对应的共享 Retriever，首次访问时加载；已发布新版本时先返回旧版本，后台加载"""
+        index_dir = os.path.abspath(index_dir)
+        retriever = self._indexes.get(index_dir)
+        if retriever is not None:
+            if retriever.is_stale():
+                self._reloader.submit(index_dir, lambda: self._load(index_dir),
+                                      lambda new: self._replace(index_dir, retriever, new))
+            return retriever
+
+        failure = self._failures.get(index_dir)
+        if failure is not None and not self._retry_due(index_dir, failure):
+            raise IndexUnavailable(failure[1])
+
+        # 按目录加锁：并发的首次请求只会触发一次加载
+        with self._dir_lock(index_dir):
+            retriever = self._indexes.get(index_dir)
+            if retriever is None:
+                pointer = current_version(index_dir)
+                try:
+                    retriever = self._load(index_dir)
+                except Exception as e:
+                    self._failures[index_dir] = [pointer, str(e), time.monotonic()]
+                    print(f"索引 {index_dir} 加载失败: {e}")
+                    raise IndexUnavailable(str(e)) from e
+                self._failures.pop(index_dir, None)
+                self._indexes[index_dir] = retriever
+        return retriever
+
+    def _retry_due(self, index_dir: str, failure) -> bool:
+        """上次失败之后是否发布了新版本"""
+        now = time.monotonic()
+        if now - failure[2] < settings.INDEX_RELOAD_INTERVAL:
+            return False
+        failure[2] = now
+        return current_version(index_dir) != failure[0]
+
+    def _replace(self, index_dir: str, old: Retriever, new: Retriever):
+        with self._lock:
+            if self._indexes.get(index_dir) is old:
+                self._indexes[index_dir] = new
+                self.reloads += 1
+
+
+class RetrieverCache:
+    """
+    按内存预算（字节）与条目数淘汰的 LRU 缓存，用于用户私有索引。
+
+    每个条目的大小取自 Retriever.nbytes。插入后若常驻总量超过预算或条目数超过上限，
+    从最久未使用的条目开始淘汰；被淘汰的用户下次访问时重新加载。
+    刚加载的条目即使单独超出预算也会保留，避免反复加载。
+    命中的条目发布了新版本时先返回旧版本，在后台用 loader 加载后替换（loader 返回 None 表示索引已删除）。
+    """
+
+    def __init__(self, max_bytes: int, max_entries: int):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self.resident_bytes = 0
+        self._reloader = _Reloader()
+
+    def get(self, key: str, loader):
+        """命中则返回缓存对象；未命中时调用 loader() 加载（返回 None 表示不缓存）"""
+        with self._lock:
+            retriever = self._entries.get(key)
+            if retriever is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if retriever is not None:
+            if retriever.is_stale():
+                self._reloader.submit(key, loader, lambda new: self._replace(key, retriever, new))
+            return retriever
+
+        # 加载在锁外进行，避免一个用户的慢加载阻塞其他用户的命中
+        retriever = loader()
+        if retriever is None:
+            return None
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.resident_bytes -= old.nbytes
+            self._entries[key] = retriever
+            self.resident_bytes += retriever.nbytes
+            self._evict(keep=key)
+        return retriever
+
+    def _replace(self, key: str, old, new):
+        with self._lock:
+            if self._entries.get(key) is not old:
+                return  # 已被淘汰或失效，下次访问时重新加载
+            self.resident_bytes -= old.nbytes
+            if new is None:
+                del self._entries[key]
+            else:
+                self._entries[key] = new
+                self.resident_bytes += new.nbytes
+                self._evict(keep=key)
+            self.reloads += 1
+
+    def _evict(self, keep: str):
+        while (self.resident_bytes > self.max_bytes or len(self._entries) > self.max_entries) \
+                and len(self._entries) > 1:
+            key, retriever = next(iter(self._entries.items()))
+            if key == keep:
+                break
+            del self._entries[key]
+            self.resident_bytes -= retriever.nbytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self.resident_bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reloads": self.reloads,
+            }
+
+
+# 全局索引等所有用户共享的索引都从这里获取
+index_registry = IndexRegistry(settings.TOP_K)
+
+# 用户私有索引：按内存预算 LRU 淘汰
+user_retriever_cache = RetrieverCache(settings.USER_INDEX_CACHE_MAX_BYTES, settings.USER_INDEX_CACHE_MAX_ENTRIES)
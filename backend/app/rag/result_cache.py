@@ -0,0 +1,57 @@
+"""
+检索结果缓存：缓存最终排好序的命中列表。
+
+键为（规范化查询, top_k, 用户可见的各索引目录及其版本号）。索引重建后检索器热加载新版本，
+版本号改变，旧结果自然不再命中，随 LRU 淘汰。
+"""
+import threading
+from collections import OrderedDict
+from .embed_cache import normalize_query
+from ..config import settings
+
+
+class ResultCache:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(query: str, top_k: int, versions) -> tuple:
+        """versions 为 [(index_dir, version), ...]，顺序无关"""
+        return (normalize_query(query), top_k, tuple(sorted(versions)))
+
+    def get(self, key):
+        with self._lock:
+            hits = self._entries.get(key)
+            if hits is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(hits)
+
+    def put(self, key, hits):
+        """空结果不缓存：可能来自 embedding 接口的临时故障，也可能是刚上传、还没建好索引的文档"""
+        if self.max_entries <= 0 or not hits:
+            return
+        with self._lock:
+            self._entries[key] = list(hits)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+result_cache = ResultCache(settings.RESULT_CACHE_ENTRIES)
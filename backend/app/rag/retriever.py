@@ -1,64 +1,176 @@
-import os, json
+import os
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import faiss
-from rank_bm25 import BM25Okapi
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from ..config import settings
+from .metastore import has_meta_store, open_meta_store
+from .sparse import load_bm25
+from .embed_cache import get_query_embedding_cache
+from .manifest import read_manifest, check_embedding, live_rows
+from .faiss_index import apply_search_params, is_binary, read_faiss_index, search_index
+from .result_cache import result_cache
+from .versions import current_version, version_dir
+
+# 检索计算用的有界线程池：多个索引并行检索、异步接口把 CPU 计算移出事件循环（FAISS 与 NumPy 计算时会释放 GIL）
+_search_executor = ThreadPoolExecutor(max_workers=settings.SEARCH_THREADS, thread_name_prefix="search")
 
 class Retriever:
     def __init__(self, index_dir: str, top_k: int):
-        self.index_dir = index_dir
+        self.index_dir = index_dir  # 索引根目录，文件位于 CURRENT 指向的版本目录
         self.top_k = top_k
         self.client = OpenAI(
             api_key=settings.QWEN_API_KEY,
             base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
             timeout=120.0
         )
-        self.embed_model = "text-embedding-v3"
+        # 异步客户端（用于 SSE 等协程路径，embedding 请求不阻塞事件循环）
+        self.async_client = AsyncOpenAI(
+            api_key=settings.QWEN_API_KEY,
+            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+            timeout=120.0
+        )
+        self.embed_model = settings.EMBED_MODEL
+        self.embed_dim = settings.EMBED_DIM  # 0 表示模型默认维度
+        # 查询向量缓存的键：不同维度的向量不能混用
+        self.embed_key = f"{self.embed_model}@{self.embed_dim}" if self.embed_dim else self.embed_model
 
         self.faiss_index = None
-        self.metas = []
-        self.bm25 = None
-        self.bm25_corpus_tokens = []
+        self.faiss_params = {}  # manifest 中记录的索引类型与参数
+        self.faiss_mmapped = False
+        self.embeddings = None  # 全精度向量矩阵（embeddings.npy，只读 mmap）
+        self.metas = None  # MetaStore：按行号读取分块元数据
+        self.bm25 = None  # BM25Index 倒排索引
+        self.live = None  # 有已删除（墓碑）分块时为按行号的布尔数组
+        self.nbytes = 0  # 加载后估算的常驻内存占用（字节）
+        self.version = None  # manifest.json 中的索引版本号
+        self.pointer = None  # 加载时 CURRENT 的内容（平铺布局为 None）
+        self._checked_at = 0.0
 
     def load(self):
-        faiss_path = os.path.join(self.index_dir, "faiss.index")
-        meta_path = os.path.join(self.index_dir, "meta.jsonl")
-        bm25_path = os.path.join(self.index_dir, "bm25.json")
+        # 只读一次指针：之后即使发布了新版本，本次加载的文件都来自同一个版本目录
+        self.pointer = current_version(self.index_dir)
+        self._checked_at = time.monotonic()
+        path = version_dir(self.index_dir, self.pointer)
+        faiss_path = os.path.join(path, "faiss.index")
 
-        if not (os.path.exists(faiss_path) and os.path.exists(meta_path)):
+        if not (os.path.exists(faiss_path) and has_meta_store(path)):
             raise RuntimeError("索引不存在：请先运行 scripts/build_index.py")
 
-        self.faiss_index = faiss.read_index(faiss_path)
+        manifest = read_manifest(path)
+        self.version = manifest["version"]
+        self.faiss_params = manifest.get("faiss", {})
+        self.faiss_index, self.faiss_mmapped = read_faiss_index(
+            faiss_path, settings.INDEX_MMAP, binary=is_binary(self.faiss_params))
+        check_embedding(manifest, self.faiss_index.d, self.embed_model, self.embed_dim)
+        # 按构建时记录的参数设置 nprobe / efSearch（旧索引没有记录，视为 flat）
+        if not is_binary(self.faiss_params):
+            apply_search_params(self.faiss_index, self.faiss_params)
+
+        # 向量矩阵按需换页，不占用进程堆内存
+        emb_path = os.path.join(path, "embeddings.npy")
+        if os.path.exists(emb_path):
+            self.embeddings = np.load(emb_path, mmap_mode="r" if settings.INDEX_MMAP else None)
 
-        self.metas = []
-        with open(meta_path, "r", encoding="utf-8") as f:
-            for line in f:
-                self.metas.append(json.loads(line))
+        self.metas = open_meta_store(path)
+        if manifest.get("deleted"):
+            self.live = live_rows(manifest["documents"], len(self.metas))
 
         # BM25（可选增强：与向量结果做一个简单合并）
-        if os.path.exists(bm25_path):
-            with open(bm25_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            self.bm25_corpus_tokens = data["tokens"]
-            self.bm25 = BM25Okapi(self.bm25_corpus_tokens)
+        self.bm25 = load_bm25(path, mmap=settings.INDEX_MMAP)
+
+        self.nbytes = self._measure_nbytes(faiss_path)
+
+    def is_stale(self) -> bool:
+        """是否发布了新版本（或索引已删除）；最多每 INDEX_RELOAD_INTERVAL 秒读一次指针文件"""
+        now = time.monotonic()
+        if now - self._checked_at < settings.INDEX_RELOAD_INTERVAL:
+            return False
+        self._checked_at = now
+        return current_version(self.index_dir) != self.pointer
+
+    def _measure_nbytes(self, faiss_path: str) -> int:
+        """估算索引常驻内存：FAISS 按序列化文件大小，元数据与 BM25 按各自的常驻部分累加。
+        mmap 加载的部分属于可回收的共享页缓存，不计入。"""
+        total = 0 if self.faiss_mmapped else os.path.getsize(faiss_path)
+        if self.embeddings is not None and not isinstance(self.embeddings, np.memmap):
+            total += self.embeddings.nbytes
+        total += self.metas.nbytes
+        if self.bm25 is not None:
+            total += self.bm25.nbytes
+        return total
+
+    def _embed_kwargs(self) -> dict:
+        return {"dimensions": self.embed_dim} if self.embed_dim else {}
 
     def _embed(self, text: str) -> np.ndarray:
+        cache = get_query_embedding_cache()
+        if cache is not None:
+            v = cache.get(self.embed_key, text)
+            if v is not None:
+                return v[None, :]
+
         response = self.client.embeddings.create(
             model=self.embed_model,
-            input=text
+            input=text,
+            **self._embed_kwargs()
+        )
+        v = response.data[0].embedding
+        if cache is not None:
+            cache.put(self.embed_key, text, v)
+        return np.array([v], dtype="float32")
+
+    async def _aembed(self, text: str) -> np.ndarray:
+        cache = get_query_embedding_cache()
+        if cache is not None:
+            v = await cache.aget(self.embed_key, text)
+            if v is not None:
+                return v[None, :]
+
+        response = await self.async_client.embeddings.create(
+            model=self.embed_model,
+            input=text,
+            **self._embed_kwargs()
         )
         v = response.data[0].embedding
+        if cache is not None:
+            cache.aput(self.embed_key, text, v)
         return np.array([v], dtype="float32")
 
+    @property
+    def versions(self):
+        return [(self.index_dir, self.version)]
+
     def search(self, query: str):
-        qv = self._embed(query)
-        D, I = self.faiss_index.search(qv, self.top_k)
+        key = result_cache.make_key(query, self.top_k, self.versions)
+        hits = result_cache.get(key)
+        if hits is None:
+            hits = self.search_vector(query, self._embed(query))
+            result_cache.put(key, hits)
+        return hits
+
+    async def asearch(self, query: str):
+        """异步检索：embedding 走异步 HTTP，FAISS/BM25 打分放到检索线程池执行"""
+        key = result_cache.make_key(query, self.top_k, self.versions)
+        hits = result_cache.get(key)
+        if hits is None:
+            qv = await self._aembed(query)
+            loop = asyncio.get_running_loop()
+            hits = await loop.run_in_executor(_search_executor, self.search_vector, query, qv)
+            result_cache.put(key, hits)
+        return hits
+
+    def search_vector(self, query: str, qv: np.ndarray):
+        """用已算好的查询向量检索，便于多个索引共用一次 embedding"""
+        # 量化索引在这里用 mmap 的全精度向量重排候选
+        scores, ids = search_index(self.faiss_index, self.faiss_params, qv, self.top_k, self.embeddings,
+                                   self.live)
         hits = []
-        for score, idx in zip(D[0].tolist(), I[0].tolist()):
+        for score, idx in zip(scores.tolist(), ids.tolist()):
             if idx < 0 or idx >= len(self.metas):
                 continue
-            m = self.metas[idx]
+            m = self.metas.get(idx)
             hits.append({
                 "score": float(score),
                 "book": m["book"],
@@ -68,20 +180,122 @@ class Retriever:
 
         # 简单BM25融合：把BM25 top_k加进来（去重）
         if self.bm25 is not None:
-            q_tokens = list(query)
-            bm25_scores = self.bm25.get_scores(q_tokens)
-            top_idx = np.argsort(bm25_scores)[-self.top_k:][::-1].tolist()
+            top_idx, top_scores = self.bm25.search_text(query, self.top_k)
             seen = {(h["book"], h["page"], h["text"][:50]) for h in hits}
-            for idx in top_idx:
-                m = self.metas[int(idx)]
+            for idx, score in zip(top_idx.tolist(), top_scores.tolist()):
+                m = self.metas.get(idx)
                 key = (m["book"], m["page"], m["text"][:50])
                 if key in seen:
                     continue
                 hits.append({
-                    "score": float(bm25_scores[int(idx)]),
+                    "score": float(score),
                     "book": m["book"],
                     "page": m["page"],
                     "text": m["text"]
                 })
 
         return hits
+
+
+class DocumentView:
+    """
+    用户对共享文档分片的引用：检索结果中的书名换成该用户上传时的文件名。
+
+    分片的 Retriever 在所有引用它的用户之间共享；文件名参与结果缓存的键，不同用户的结果不会混用。
+    """
+
+    def __init__(self, retriever: Retriever, filename: str):
+        self.retriever = retriever
+        self.filename = filename
+
+    @property
+    def versions(self):
+        return [(f"{d}#{self.filename}", v) for d, v in self.retriever.versions]
+
+    def _embed(self, text: str) -> np.ndarray:
+        return self.retriever._embed(text)
+
+    async def _aembed(self, text: str) -> np.ndarray:
+        return await self.retriever._aembed(text)
+
+    def search_vector(self, query: str, qv: np.ndarray):
+        return [dict(h, book=self.filename) for h in self.retriever.search_vector(query, qv)]
+
+
+class CombinedRetriever:
+    """组合多个索引（全局 + 用户）：查询只 embed 一次，再把向量并行分发给各索引"""
+
+    def __init__(self, retrievers):
+        self.retrievers = retrievers
+
+    @property
+    def versions(self):
+        return [v for r in self.retrievers for v in r.versions]
+
+    def search(self, query: str):
+        key = result_cache.make_key(query, settings.TOP_K, self.versions)
+        hits = result_cache.get(key)
+        if hits is None:
+            hits = self._search(query)
+            result_cache.put(key, hits)
+        return hits
+
+    async def asearch(self, query: str):
+        key = result_cache.make_key(query, settings.TOP_K, self.versions)
+        hits = result_cache.get(key)
+        if hits is None:
+            hits = await self._asearch(query)
+            result_cache.put(key, hits)
+        return hits
+
+    def _search(self, query: str):
+        try:
+            qv = self.retrievers[0]._embed(query)
+        except Exception as e:
+            print(f"检索器错误: {e}")
+            return []
+
+        futures = [_search_executor.submit(r.search_vector, query, qv) for r in self.retrievers]
+        all_results = []
+        for future in futures:
+            try:
+                all_results.extend(future.result())
+            except Exception as e:
+                print(f"检索器错误: {e}")
+                continue
+        return self._merge(all_results)
+
+    async def _asearch(self, query: str):
+        try:
+            qv = await self.retrievers[0]._aembed(query)
+        except Exception as e:
+            print(f"检索器错误: {e}")
+            return []
+
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(_search_executor, r.search_vector, query, qv) for r in self.retrievers),
+            return_exceptions=True,
+        )
+        all_results = []
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"检索器错误: {result}")
+                continue
+            all_results.extend(result)
+        return self._merge(all_results)
+
+    def _merge(self, all_results):
+        # 按相似度排序并去重
+        all_results.sort(key=lambda x: x.get('score', 0), reverse=True)
+
+        # 去重：基于文本内容去重
+        seen_texts = set()
+        unique_results = []
+        for result in all_results:
+            text = result.get('text', '').strip()
+            if text and text not in seen_texts:
+                seen_texts.add(text)
+                unique_results.append(result)
+
+        return unique_results[:settings.TOP_K]
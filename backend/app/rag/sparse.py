@@ -0,0 +1,200 @@
+"""
+持久化的 BM25 倒排索引，替代每次加载都用 bm25.json 重建 BM25Okapi。
+
+索引目录下的文件布局：
+  bm25_info.json      {"format": 1, "num_docs", "avgdl", "k1", "b", "tokenizer"}，最后写入
+  bm25_vocab.json     词表，term_id -> 词
+  bm25_idf.npy        float32，每个词的 IDF
+  bm25_indptr.npy     int64，长度 V+1；词 t 的倒排表位于 [indptr[t], indptr[t+1])
+  bm25_docs.npy       int32，倒排表中的文档号（按文档号升序）
+  bm25_tfs.npy        int32，对应的词频
+  bm25_weights.npy    float32，预先算好的 idf * tf*(k1+1) / (tf + k1*(1-b+b*dl/avgdl))
+  bm25_doclen.npy     int32，每个文档的长度
+
+打分公式与 rank_bm25.BM25Okapi 一致（含负 IDF 用 epsilon * 平均 IDF 替代），
+但查询时只读取查询词的倒排表，用 NumPy 向量化累加，不会遍历整个语料。
+"""
+import os, json, sys
+from array import array
+from collections import Counter
+import numpy as np
+from .tokenizer import get_tokenizer
+
+BM25_FORMAT = 1
+
+
+class BM25Index:
+    def __init__(self, vocab, idf, indptr, docs, tfs, weights, doc_len, avgdl, k1=1.5, b=0.75,
+                 tokenizer: str = "char"):
+        self.vocab = vocab
+        self.term_ids = {t: i for i, t in enumerate(vocab)}
+        self.idf = idf
+        self.indptr = indptr
+        self.docs = docs
+        self.tfs = tfs
+        self.weights = weights
+        self.doc_len = doc_len
+        self.avgdl = avgdl
+        self.k1 = k1
+        self.b = b
+        self.tokenizer = tokenizer
+        self.tokenize = get_tokenizer(tokenizer)
+
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        """词表常驻内存；mmap 的数组不计入"""
+        total = sys.getsizeof(self.term_ids) + sum(sys.getsizeof(t) for t in self.vocab)
+        for arr in (self.idf, self.indptr, self.docs, self.tfs, self.weights, self.doc_len):
+            if not isinstance(arr, np.memmap):
+                total += arr.nbytes
+        return total
+
+    @classmethod
+    def build(cls, corpus_tokens, tokenizer: str = "char", k1: float = 1.5, b: float = 0.75, epsilon: float = 0.25):
+        """
+        从每个文档的 token 列表构建倒排索引；tokenizer 记录这些 token 由哪种分词器产生。
+
+        token 列表为 None 的文档是已删除的墓碑：保留文档号，但没有倒排项，也不计入文档数与平均长度。
+        """
+        term_ids = {}
+        # 紧凑的 int32 数组累积倒排项，corpus_tokens 可以是生成器，不必把所有文档的 token 同时放在内存
+        post_terms, post_docs, post_tfs, doc_len = array("i"), array("i"), array("i"), array("i")
+        n = 0
+        for doc_id, tokens in enumerate(corpus_tokens):
+            if tokens is None:
+                doc_len.append(0)
+                continue
+            n += 1
+            doc_len.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                tid = term_ids.setdefault(term, len(term_ids))
+                post_terms.append(tid)
+                post_docs.append(doc_id)
+                post_tfs.append(tf)
+        doc_len = np.frombuffer(doc_len, dtype="int32")
+
+        vocab = [None] * len(term_ids)
+        for term, tid in term_ids.items():
+            vocab[tid] = term
+
+        post_terms = np.frombuffer(post_terms, dtype="int32").astype("int64")
+        # 稳定排序保证同一个词的倒排表内文档号升序
+        order = np.argsort(post_terms, kind="stable")
+        docs = np.frombuffer(post_docs, dtype="int32")[order]
+        tfs = np.frombuffer(post_tfs, dtype="int32")[order]
+        df = np.bincount(post_terms, minlength=len(vocab))
+        indptr = np.zeros(len(vocab) + 1, dtype="int64")
+        np.cumsum(df, out=indptr[1:])
+
+        avgdl = float(doc_len.sum()) / n if n else 0.0
+        idf = np.log(n - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            idf[idf < 0] = epsilon * idf.mean()
+        idf = idf.astype("float32")
+
+        term_of_posting = np.repeat(np.arange(len(vocab)), df)
+        dl = doc_len[docs].astype("float32")
+        norm = k1 * (1 - b + b * dl / avgdl) if avgdl else np.full(len(docs), k1, dtype="float32")
+        weights = (idf[term_of_posting] * tfs * (k1 + 1) / (tfs + norm)).astype("float32")
+
+        return cls(vocab, idf, indptr, docs, tfs, weights, doc_len, avgdl, k1, b, tokenizer)
+
+    def save(self, index_dir: str):
+        """写临时文件后 os.replace，bm25_info.json 最后落盘"""
+        def path(name):
+            return os.path.join(index_dir, name)
+
+        os.makedirs(index_dir, exist_ok=True)
+        arrays = {
+            "bm25_idf.npy": self.idf,
+            "bm25_indptr.npy": self.indptr,
+            "bm25_docs.npy": self.docs,
+            "bm25_tfs.npy": self.tfs,
+            "bm25_weights.npy": self.weights,
+            "bm25_doclen.npy": self.doc_len,
+        }
+        for name, arr in arrays.items():
+            with open(path(name + ".tmp"), "wb") as f:
+                np.save(f, np.asarray(arr))
+        with open(path("bm25_vocab.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        for name in list(arrays) + ["bm25_vocab.json"]:
+            os.replace(path(name + ".tmp"), path(name))
+
+        info = {"format": BM25_FORMAT, "num_docs": self.num_docs, "avgdl": self.avgdl, "k1": self.k1, "b": self.b,
+                "tokenizer": self.tokenizer}
+        with open(path("bm25_info.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        os.replace(path("bm25_info.json.tmp"), path("bm25_info.json"))
+
+    @classmethod
+    def load(cls, index_dir: str, mmap: bool = True):
+        def path(name):
+            return os.path.join(index_dir, name)
+
+        with open(path("bm25_info.json"), "r", encoding="utf-8") as f:
+            info = json.load(f)
+        with open(path("bm25_vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        mode = "r" if mmap else None
+        return cls(
+            vocab,
+            np.load(path("bm25_idf.npy"), mmap_mode=mode),
+            np.load(path("bm25_indptr.npy"), mmap_mode=mode),
+            np.load(path("bm25_docs.npy"), mmap_mode=mode),
+            np.load(path("bm25_tfs.npy"), mmap_mode=mode),
+            np.load(path("bm25_weights.npy"), mmap_mode=mode),
+            np.load(path("bm25_doclen.npy"), mmap_mode=mode),
+            info["avgdl"], info["k1"], info["b"],
+            info.get("tokenizer", "char"),
+        )
+
+    def search_text(self, query: str, top_k: int):
+        """用构建索引时的同一种分词器切分查询后检索"""
+        return self.search(self.tokenize(query), top_k)
+
+    def search(self, q_tokens, top_k: int):
+        """返回 (文档号数组, 分数数组)，按分数降序；只对包含查询词的文档打分"""
+        slices, qweights = [], []
+        for term, count in Counter(q_tokens).items():
+            tid = self.term_ids.get(term)
+            if tid is None:
+                continue
+            start, end = int(self.indptr[tid]), int(self.indptr[tid + 1])
+            slices.append((start, end))
+            qweights.append(count)  # 查询中重复出现的词按次数累加，与 BM25Okapi 一致
+
+        if not slices:
+            return np.empty(0, dtype="int64"), np.empty(0, dtype="float32")
+
+        docs = np.concatenate([self.docs[s:e] for s, e in slices])
+        weights = np.concatenate([self.weights[s:e] * c for (s, e), c in zip(slices, qweights)])
+        cand, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        if len(cand) > top_k:
+            part = np.argpartition(-scores, top_k - 1)[:top_k]
+        else:
+            part = np.arange(len(cand))
+        order = part[np.argsort(-scores[part], kind="stable")]
+        return cand[order].astype("int64"), scores[order]
+
+
+def has_bm25_index(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(index_dir, "bm25_info.json"))
+
+
+def load_bm25(index_dir: str, mmap: bool = True):
+    """加载倒排索引；旧索引只有 bm25.json 时在内存中从 token 列表构建，都没有返回 None"""
+    if has_bm25_index(index_dir):
+        return BM25Index.load(index_dir, mmap=mmap)
+    legacy_path = os.path.join(index_dir, "bm25.json")
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return BM25Index.build(data["tokens"], tokenizer="char")
+    return None
@@ -0,0 +1,87 @@
+"""
+稀疏检索（BM25）用的分词器。
+
+构建索引与查询必须使用同一种分词方式，分词器名称会记录在 bm25_info.json 中，
+Retriever 查询时按索引记录的名称取分词器，而不是读当前配置。
+
+  char    逐字切分（旧行为），"的"、"数" 这类高频字的倒排表极长
+  bigram  中文按相邻两字切分、英文数字按单词切分，并去掉停用字/停用词
+  jieba   词典分词（需要额外安装 jieba）
+"""
+import re
+
+# 中文连续片段 / 英文数字单词
+_TOKEN_RE = re.compile(r"[\u3400-\u9fff]+|[A-Za-z0-9]+(?:[._-][A-Za-z0-9]+)*[+#]*")
+
+# 高频虚字：在中文片段中作为分隔符，不参与组成二元词。
+# 只收录几乎不构成专业术语的字（"向"、"过"、"对" 会出现在 向量/过程/对象 中，不能收）
+CJK_STOP_CHARS = set("的了是和与或也而")
+
+ASCII_STOPWORDS = {
+    "a", "an", "the", "of", "to", "in", "on", "for", "and", "or", "is", "are",
+    "be", "by", "as", "at", "it", "this", "that", "with", "from",
+}
+
+
+def char_tokenize(text: str) -> list:
+    return list(text)
+
+
+def _cjk_segments(run: str):
+    """按停用字切开中文片段"""
+    seg = []
+    for ch in run:
+        if ch in CJK_STOP_CHARS:
+            if seg:
+                yield "".join(seg)
+                seg = []
+        else:
+            seg.append(ch)
+    if seg:
+        yield "".join(seg)
+
+
+def bigram_tokenize(text: str) -> list:
+    tokens = []
+    for m in _TOKEN_RE.finditer(text):
+        run = m.group()
+        if run[0].isascii():
+            word = run.lower()
+            if word not in ASCII_STOPWORDS:
+                tokens.append(word)
+            continue
+        for seg in _cjk_segments(run):
+            if len(seg) == 1:
+                tokens.append(seg)
+            else:
+                tokens.extend(seg[i:i + 2] for i in range(len(seg) - 1))
+    return tokens
+
+
+def jieba_tokenize(text: str) -> list:
+    try:
+        import jieba
+    except ImportError:
+        raise RuntimeError("BM25_TOKENIZER=jieba 需要先安装 jieba：pip install jieba")
+    tokens = []
+    for w in jieba.lcut_for_search(text):
+        w = w.strip().lower()
+        if not w or not _TOKEN_RE.fullmatch(w):
+            continue
+        if w in ASCII_STOPWORDS or (len(w) == 1 and w in CJK_STOP_CHARS):
+            continue
+        tokens.append(w)
+    return tokens
+
+
+TOKENIZERS = {
+    "char": char_tokenize,
+    "bigram": bigram_tokenize,
+    "jieba": jieba_tokenize,
+}
+
+
+def get_tokenizer(name: str):
+    if name not in TOKENIZERS:
+        raise ValueError(f"未知的分词器: {name}（可选: {', '.join(TOKENIZERS)}）")
+    return TOKENIZERS[name]
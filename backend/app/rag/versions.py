@@ -0,0 +1,104 @@
+"""
+版本化的索引目录：每次构建写入新目录，原子替换指针文件发布。
+
+布局（index_dir 为全局 INDEX_DIR 或用户的 DATA_DIR/<uid>/index）：
+  CURRENT                当前版本名（即 manifest.json 中的 version），写临时文件后 os.replace
+  versions/<version>/    一个完整版本的全部索引文件，发布后不再修改
+  staging/               构建中的版本；全量构建的断点也在这里，发布时整个目录改名为 versions/<version>
+
+读者先读 CURRENT 再打开对应目录，不会看到写了一半的索引；各进程缓存的检索器按 CURRENT 判断是否有新版本。
+增量更新把当前版本的文件硬链接到 staging 后修改：除 meta_text.bin 只在末尾追加（旧版本只读偏移表
+范围内的字节）外，其余文件都是写新文件后替换，不影响已发布的版本。
+旧版本保留 INDEX_KEEP_VERSIONS 个，仍在 mmap 旧文件的读者在删除后照常读取。
+
+没有 CURRENT 的目录是旧的平铺布局，文件直接位于 index_dir 下，首次发布新版本时清理。
+"""
+import os, shutil
+from ..config import settings
+
+CURRENT_NAME = "CURRENT"
+VERSIONS_DIR = "versions"
+STAGING_DIR = "staging"
+
+
+def current_version(index_dir: str):
+    """当前发布的版本名；平铺布局或索引不存在时返回 None"""
+    try:
+        with open(os.path.join(index_dir, CURRENT_NAME), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(index_dir: str, version) -> str:
+    """版本的文件所在目录；version 为 None 时是平铺布局的 index_dir 本身"""
+    return os.path.join(index_dir, VERSIONS_DIR, version) if version else index_dir
+
+
+def resolve_index_dir(index_dir: str) -> str:
+    """当前版本的文件所在目录"""
+    return version_dir(index_dir, current_version(index_dir))
+
+
+def index_exists(index_dir: str) -> bool:
+    return os.path.exists(os.path.join(resolve_index_dir(index_dir), "faiss.index"))
+
+
+def staging_dir(index_dir: str) -> str:
+    return os.path.join(index_dir, STAGING_DIR)
+
+
+def reset_staging(index_dir: str) -> str:
+    """清空并返回 staging 目录"""
+    path = staging_dir(index_dir)
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def stage_from_current(index_dir: str) -> str:
+    """把当前版本的文件硬链接（不支持时复制）到新的 staging 目录，增量更新在其中修改"""
+    src = resolve_index_dir(index_dir)
+    path = reset_staging(index_dir)
+    for name in os.listdir(src):
+        if name in (CURRENT_NAME, VERSIONS_DIR, STAGING_DIR) or name.endswith(".tmp"):
+            continue
+        try:
+            os.link(os.path.join(src, name), os.path.join(path, name))
+        except OSError:
+            shutil.copy2(os.path.join(src, name), os.path.join(path, name))
+    return path
+
+
+def publish(index_dir: str, version: str) -> str:
+    """staging 改名为 versions/<version> 后原子替换 CURRENT，返回新版本目录"""
+    versions = os.path.join(index_dir, VERSIONS_DIR)
+    os.makedirs(versions, exist_ok=True)
+    path = os.path.join(versions, version)
+    os.rename(staging_dir(index_dir), path)
+
+    pointer = os.path.join(index_dir, CURRENT_NAME)
+    had_pointer = os.path.exists(pointer)
+    with open(pointer + ".tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer + ".tmp", pointer)
+
+    if not had_pointer:
+        # 旧的平铺布局：索引文件直接位于 index_dir 下，已被新版本取代
+        for name in os.listdir(index_dir):
+            if name != CURRENT_NAME and os.path.isfile(os.path.join(index_dir, name)):
+                os.remove(os.path.join(index_dir, name))
+    prune_versions(index_dir, settings.INDEX_KEEP_VERSIONS)
+    return path
+
+
+def prune_versions(index_dir: str, keep: int):
+    """保留当前版本与最近的若干旧版本（按目录修改时间，同一秒内发布的版本名不能区分先后）"""
+    current = current_version(index_dir)
+    versions = os.path.join(index_dir, VERSIONS_DIR)
+    old = sorted((v for v in os.listdir(versions) if v != current),
+                 key=lambda v: os.stat(os.path.join(versions, v)).st_mtime_ns, reverse=True)
+    for v in old[max(keep - 1, 0):]:
+        shutil.rmtree(os.path.join(versions, v), ignore_errors=True)
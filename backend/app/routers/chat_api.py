@@ -3,84 +3,95 @@ import json
 import os
 from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from ..db import get_db
+from ..db import get_db, SessionLocal
 from ..auth import parse_token, get_token_from_request
 from .. import models
 from ..schemas import ChatIn
-from ..rag.retriever import Retriever
+from ..rag.retriever import Retriever, CombinedRetriever, DocumentView
+from ..rag.registry import index_registry, user_retriever_cache, IndexUnavailable
+from ..rag.versions import index_exists
+from ..rag.doc_store import shard_dir
 from ..rag.prompts import SYSTEM_PROMPT, EXERCISE_SYSTEM_PROMPT, build_user_prompt, build_exercise_prompt
 from ..rag.qwen_client import QwenClient
 from ..config import settings
 
 router = APIRouter(prefix="/api", tags=["chat"])
 
-class CombinedRetriever:
-    def __init__(self, retrievers):
-        self.retrievers = retrievers
-    
-    def search(self, query: str):
-        all_results = []
-        for retriever in self.retrievers:
-            try:
-                results = retriever.search(query)
-                all_results.extend(results)
-            except Exception as e:
-                print(f"检索器错误: {e}")
-                continue
-        
-        # 按相似度排序并去重
-        all_results.sort(key=lambda x: x.get('score', 0), reverse=True)
-        
-        # 去重：基于文本内容去重
-        seen_texts = set()
-        unique_results = []
-        for result in all_results:
-            text = result.get('text', '').strip()
-            if text and text not in seen_texts:
-                seen_texts.add(text)
-                unique_results.append(result)
-        
-        return unique_results[:settings.TOP_K]
+def get_user_retriever(user_id: str):
+    """旧版的用户私有索引（DATA_DIR/<uid>/index，迁移到文档库之前），发布新版本后热加载；不存在时返回 None"""
+    user_index_dir = os.path.join(settings.DATA_DIR, str(user_id), 'index')
 
-_retrievers = {}
+    def load():
+        # 迁移到文档库后旧索引被删除：loader 返回 None，缓存中的旧实例在热加载时一并丢弃
+        if not index_exists(user_index_dir):
+            return None
+        user_retriever = Retriever(user_index_dir, settings.TOP_K)
+        user_retriever.load()
+        return user_retriever
 
-def get_retriever(user_id: int):
-    cache_key = f"user_{user_id}"
-    if cache_key not in _retrievers:
-        retrievers = []
-        
-        # 总是包含全局索引
-        try:
-            global_retriever = Retriever(settings.INDEX_DIR, settings.TOP_K)
-            global_retriever.load()
-            retrievers.append(global_retriever)
-        except Exception as e:
-            print(f"全局索引加载失败: {e}")
-        
-        # 尝试加载用户特定索引
-        user_index_dir = os.path.join(settings.DATA_DIR, str(user_id), 'index')
-        if os.path.exists(user_index_dir):
-            try:
-                user_retriever = Retriever(user_index_dir, settings.TOP_K)
-                user_retriever.load()
-                retrievers.append(user_retriever)
-            except Exception as e:
-                print(f"用户索引加载失败: {e}")
-        
-        if retrievers:
-            if len(retrievers) == 1:
-                _retrievers[cache_key] = retrievers[0]
-            else:
-                _retrievers[cache_key] = CombinedRetriever(retrievers)
-        else:
-            raise RuntimeError(
-                f"RAG 索引加载失败\n"
-                f"请运行: python scripts/build_index.py\n"
-                f"确保 {settings.PDF_DIR} 目录中有 PDF 文件"
-            )
-    return _retrievers[cache_key]
+    return user_retriever_cache.get(f"user_{user_id}", load)
+
+def get_document_retrievers(user_id: str):
+    """
+    用户引用的各文档分片。分片按内容哈希在所有用户之间共享，与用户索引共用 LRU 内存预算，
+    被淘汰或首次访问时重新加载，发布新版本后热加载；还没有建好的分片跳过。
+    """
+    with SessionLocal() as db:
+        docs = db.query(models.UserDocument.sha256, models.UserDocument.filename).filter(
+            models.UserDocument.user_id == user_id
+        ).order_by(models.UserDocument.created_at).all()
+
+    views = []
+    for sha256, filename in docs:
+        index_dir = shard_dir(sha256)
+
+        def load(index_dir=index_dir):
+            if not index_exists(index_dir):
+                return None
+            retriever = Retriever(index_dir, settings.TOP_K)
+            retriever.load()
+            return retriever
+
+        retriever = user_retriever_cache.get(f"doc_{sha256}", load)
+        if retriever is not None:
+            views.append(DocumentView(retriever, filename))
+    return views
+
+def get_retriever(user_id: str):
+    retrievers = []
+
+    # 总是包含全局索引（进程内共享同一份）
+    # 加载失败只在注册表中记录一次，发布新版本之前直接跳过
+    try:
+        retrievers.append(index_registry.get(settings.INDEX_DIR))
+    except IndexUnavailable:
+        pass
+
+    # 用户上传的文档（共享分片）与尚未迁移的旧版用户索引
+    try:
+        retrievers.extend(get_document_retrievers(user_id))
+    except Exception as e:
+        print(f"文档索引加载失败: {e}")
+    try:
+        user_retriever = get_user_retriever(user_id)
+        if user_retriever is not None:
+            retrievers.append(user_retriever)
+    except Exception as e:
+        print(f"用户索引加载失败: {e}")
+
+    if not retrievers:
+        raise RuntimeError(
+            f"RAG 索引加载失败\n"
+            f"请运行: python scripts/build_index.py\n"
+            f"确保 {settings.PDF_DIR} 目录中有 PDF 文件"
+        )
+    if len(retrievers) == 1 and isinstance(retrievers[0], Retriever):
+        return retrievers[0]
+    # 查询时再组合全局与用户索引，组合对象本身很轻量
+    return CombinedRetriever(retrievers)
 
 @router.get("/sessions")
 def get_sessions(token: str = None, request: Request = None, db: Session = Depends(get_db)):
@@ -182,8 +193,9 @@ async def chat_stream(session_id: str, token: str = None, q: str = "", difficult
     }
     chat_messages.append(user_message)
 
-    retriever = get_retriever(uid)
-    contexts = retriever.search(q.strip())
+    # 索引加载涉及磁盘 IO，放到线程池；检索本身走异步接口，不阻塞其他流式连接
+    retriever = await run_in_threadpool(get_retriever, uid)
+    contexts = await retriever.asearch(q.strip())
 
     user_prompt = build_user_prompt(q.strip(), contexts)
     client = QwenClient()
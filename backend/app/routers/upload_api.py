@@ -1,93 +1,187 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Form, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, StreamingResponse
 import os
 import shutil
 import json
-import numpy as np
-import faiss
-from openai import OpenAI
-from rank_bm25 import BM25Okapi
+import time
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
 from ..config import settings
+from ..db import get_db, SessionLocal
+from .. import models
 from ..auth import parse_token, get_token_from_request
-from ..rag.ingest import build_corpus
+from ..rag.build_queue import get_index_queue
+from ..rag.doc_store import (save_upload, store_file, import_file, build_shard, shard_dir, document_dir,
+                             UploadTooLarge, InvalidPdf)
+from ..rag.extract_cache import file_digest
+from ..rag.manifest import read_manifest
+from ..rag.versions import index_exists, resolve_index_dir
 
 router = APIRouter(prefix="/api", tags=["upload"])
 
-def get_embeddings(texts):
-    api_key = settings.QWEN_API_KEY
-    if not api_key:
-        raise RuntimeError("Missing QWEN_API_KEY")
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        timeout=120.0  # 增加超时时间
-    )
-    response = client.embeddings.create(
-        model="text-embedding-v3",
-        input=texts
-    )
-    embeddings = [item.embedding for item in response.data]
-    return embeddings
-
-def build_index_for_user(user_id: int):
-    user_dir = os.path.join(settings.DATA_DIR, str(user_id))
-    pdf_dir = os.path.join(user_dir, 'pdfs')
-    index_dir = os.path.join(user_dir, 'index')
-    progress_file = os.path.join(user_dir, 'index_progress.json')
+def set_user_document(db: Session, user_id: str, filename: str, sha256: str, size: int):
+    """记录（或替换同名文件的）用户文档引用"""
+    doc = db.query(models.UserDocument).filter(
+        models.UserDocument.user_id == user_id,
+        models.UserDocument.filename == filename
+    ).first()
+    if doc is None:
+        db.add(models.UserDocument(user_id=user_id, filename=filename, sha256=sha256, size=size))
+    else:
+        doc.sha256, doc.size, doc.created_at = sha256, size, int(time.time())
+    db.commit()
 
-    def update_progress(step: str, percent: int):
-        with open(progress_file, 'w', encoding='utf-8') as f:
-            json.dump({'step': step, 'percent': percent}, f, ensure_ascii=False)
+def legacy_index_dir(user_id: str) -> str:
+    """旧版的用户私有索引（迁移到文档库之前）"""
+    return os.path.join(settings.DATA_DIR, str(user_id), 'index')
 
-    update_progress('开始处理', 0)
+def _fill_from_shard(doc: models.Document) -> bool:
+    """分片已建好时，从其 manifest 填写分块数、页数与索引版本并记为 ready，返回分片是否存在"""
+    index_dir = shard_dir(doc.sha256)
+    if not index_exists(index_dir):
+        return False
+    manifest = read_manifest(resolve_index_dir(index_dir))
+    entry = manifest.get("documents", {}).get(doc.sha256 + ".pdf", {})
+    doc.chunks = manifest.get("chunks", 0)
+    doc.pages = entry.get("pages", doc.pages)
+    doc.index_version = manifest["version"]
+    doc.status, doc.error = models.Document.READY, None
+    return True
 
-    if not os.path.exists(pdf_dir):
-        update_progress('完成', 100)
-        return
+def register_document(db: Session, sha256: str, size: int, pages: int = None) -> models.Document:
+    """在文档目录中登记文档，已登记时返回原记录；分片已经存在（目录表出现之前建好的）时直接记为 ready"""
+    doc = db.get(models.Document, sha256)
+    if doc is not None:
+        return doc
+    doc = models.Document(sha256=sha256, size=size, pages=pages, status=models.Document.PENDING)
+    _fill_from_shard(doc)
+    db.add(doc)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同一文件被并发上传，另一个请求先登记了
+        db.rollback()
+        doc = db.get(models.Document, sha256)
+    return doc
 
-    os.makedirs(index_dir, exist_ok=True)
+def register_global_documents(index_dir: str, pdf_dir: str):
+    """
+    把全局索引中的文档登记到文档目录（global_name、global_version），/api/pdfs 据此列出全局文档；
+    scripts/build_index.py 在构建或增量更新后调用。已不在全局索引中的文档取消标记，只为全局文档建立的记录随之删除。
+    """
+    manifest = read_manifest(resolve_index_dir(index_dir)) if index_exists(index_dir) else None
+    entries = manifest["documents"] if manifest else {}
+    hashes = {fn: file_digest(os.path.join(pdf_dir, fn)) for fn in entries}
+    with SessionLocal() as db:
+        for doc in db.query(models.Document).filter(models.Document.global_name.isnot(None)):
+            if hashes.get(doc.global_name) == doc.sha256:
+                continue
+            doc.global_name = doc.global_version = None
+            if doc.sha256 not in hashes.values() and not os.path.isdir(document_dir(doc.sha256)):
+                db.delete(doc)
+        db.flush()
+        for fn, entry in entries.items():
+            doc = db.get(models.Document, hashes[fn])
+            if doc is None:
+                doc = models.Document(sha256=hashes[fn], size=entry["size"], status=models.Document.PENDING,
+                                      created_at=entry["mtime_ns"] // 10**9)
+                db.add(doc)
+            if doc.pages is None:
+                doc.pages = entry.get("pages")
+            doc.global_name, doc.global_version = fn, manifest["version"]
+        db.commit()
+    return len(entries)
 
-    update_progress('构建语料', 10)
-    meta_path = os.path.join(index_dir, "meta.jsonl")
-    metas = build_corpus(pdf_dir, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, meta_path)
-    texts = [m["text"] for m in metas]
+def mark_document(sha256: str, status: str, error: str = None):
+    """更新文档的索引状态；ready 时从分片 manifest 读取分块数与版本（没有可抽取文本的 PDF 不生成分片，分块数为 0）"""
+    with SessionLocal() as db:
+        doc = db.get(models.Document, sha256)
+        if doc is None:
+            return
+        if status != models.Document.READY:
+            doc.status, doc.error = status, error
+        elif not _fill_from_shard(doc):
+            doc.chunks, doc.index_version, doc.status, doc.error = 0, None, status, None
+        db.commit()
 
-    if not texts:
-        update_progress('完成', 100)
+def import_legacy_pdfs(user_id: str):
+    """
+    把旧版用户目录中的 PDF（DATA_DIR/<uid>/pdfs）迁移到共享文档库。
+    旧的私有索引保留到这些文档的分片全部建好，在此之前检索照常使用它，见 build_index_for_user。
+    """
+    user_dir = os.path.join(settings.DATA_DIR, str(user_id))
+    pdf_dir = os.path.join(user_dir, 'pdfs')
+    if not os.path.isdir(pdf_dir):
         return
+    with SessionLocal() as db:
+        for filename in sorted(os.listdir(pdf_dir)):
+            if filename.lower().endswith('.pdf'):
+                path = os.path.join(pdf_dir, filename)
+                sha256 = file_digest(path)
+                import_file(path, sha256)
+                register_document(db, sha256, os.path.getsize(path))
+                set_user_document(db, user_id, filename, sha256, os.path.getsize(path))
+    shutil.rmtree(pdf_dir)
 
-    update_progress('生成嵌入', 20)
-    batch_size = 5  # 减少批次大小以避免超时
-    all_embeddings = []
-    total_batches = (len(texts) + batch_size - 1) // batch_size
-    for batch_idx, i in enumerate(range(0, len(texts), batch_size)):
-        batch_texts = texts[i:i+batch_size]
-        batch_embs = get_embeddings(batch_texts)
-        all_embeddings.extend(batch_embs)
-        percent = 20 + int((batch_idx + 1) / total_batches * 60)
-        update_progress('生成嵌入', percent)
-
-    update_progress('构建索引', 80)
-    embs = np.array(all_embeddings, dtype="float32")
-    dim = embs.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embs)
-
-    faiss_path = os.path.join(index_dir, "faiss.index")
-    faiss.write_index(index, faiss_path)
-
-    update_progress('构建BM25', 90)
-    tokens = [list(t) for t in texts]
-    bm25 = BM25Okapi(tokens)
-    bm25_path = os.path.join(index_dir, "bm25.json")
-    with open(bm25_path, "w", encoding="utf-8") as f:
-        json.dump({"tokens": tokens}, f, ensure_ascii=False)
-
-    update_progress('完成', 100)
+def build_index_for_user(user_id: str, progress):
+    """
+    由索引构建队列的工作线程调用：为用户引用的、文档目录中状态不是 ready 的文档构建分片，
+    progress(step, percent, detail) 写入任务状态。
+
+    分片按内容哈希共享，别人已经上传过的文档直接复用；新分片发布后各进程的检索器自行加载。
+    用户引用的分片全部建好后才删除旧版的私有索引。某个文档构建失败时记为 failed 并继续构建其余文档，
+    最后任务整体报错，下次入队时重试失败的文档。
+    """
+    import_legacy_pdfs(user_id)
+    with SessionLocal() as db:
+        refs = db.query(models.UserDocument.sha256, models.UserDocument.size, models.Document.status).outerjoin(
+            models.Document, models.Document.sha256 == models.UserDocument.sha256
+        ).filter(models.UserDocument.user_id == user_id).all()
+        missing = []
+        for sha256, size, status in refs:
+            if status is None:
+                # 文档目录表出现之前上传的文档
+                status = register_document(db, sha256, size).status
+            if status != models.Document.READY and sha256 not in missing:
+                missing.append(sha256)
+
+    errors = []
+    for i, sha256 in enumerate(missing):
+        # 多个文档的进度按个数均分
+        lo, hi = i * 100 // len(missing), (i + 1) * 100 // len(missing)
+        mark_document(sha256, models.Document.INDEXING)
+        try:
+            build_shard(sha256, lambda step, percent, detail=None: progress(
+                step, lo + percent * (hi - lo) // 100, dict(detail or {}, documents_done=i, documents_total=len(missing))))
+        except Exception as e:
+            print(f"文档 {sha256} 的索引构建失败: {e}")
+            mark_document(sha256, models.Document.FAILED, str(e))
+            errors.append(str(e))
+        else:
+            mark_document(sha256, models.Document.READY)
+    if errors:
+        raise RuntimeError(f"{len(errors)} 个文档的索引构建失败: {errors[0]}")
+    # 检索器下次热加载时发现旧索引不存在，从缓存中丢弃
+    shutil.rmtree(legacy_index_dir(user_id), ignore_errors=True)
+
+def record_upload(user_id: str, filename: str, tmp_path: str, sha256: str, size: int, pages: int):
+    """
+    把校验过的上传文件存入文档库并登记，返回 (是否为新文档, 任务 id)；在线程池中调用，使用自己的会话。
+    文档的分片已经建好时不排队，任务 id 为 None。
+    """
+    is_new = store_file(tmp_path, sha256)
+    with SessionLocal() as db:
+        status = register_document(db, sha256, size, pages).status
+        set_user_document(db, user_id, filename, sha256, size)
+    if status == models.Document.READY:
+        return is_new, None
+    # 排队构建索引分片（短时间内多次上传合并为一次）
+    return is_new, get_index_queue().enqueue(user_id)
 
 @router.post("/upload-pdf")
-async def upload_pdf(background_tasks: BackgroundTasks, token: str = Form(...), file: UploadFile = File(...)):
+async def upload_pdf(token: str = Form(...), file: UploadFile = File(...)):
     try:
         uid = parse_token(token)
     except ValueError as e:
@@ -95,20 +189,33 @@ async def upload_pdf(background_tasks: BackgroundTasks, token: str = Form(...),
     if not file.filename.endswith('.pdf'):
         raise HTTPException(status_code=400, detail="只支持PDF文件")
 
-    # 创建用户目录
-    user_dir = os.path.join(settings.DATA_DIR, str(uid))
-    pdf_dir = os.path.join(user_dir, 'pdfs')
-    os.makedirs(pdf_dir, exist_ok=True)
+    # 流式写入临时文件并校验，再按内容哈希存入共享文档库；用户只记录引用，同一文件只存一份
+    filename = os.path.basename(file.filename)
+    try:
+        tmp_path, sha256, size, pages = await save_upload(file)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except InvalidPdf as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # 入库（改名、刷新修改时间）与登记（SQLite 提交）在线程池中进行，不阻塞事件循环
+    is_new, job_id = await run_in_threadpool(record_upload, uid, filename, tmp_path, sha256, size, pages)
 
-    # 保存PDF
-    pdf_path = os.path.join(pdf_dir, file.filename)
-    with open(pdf_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 别人已经建好分片的文档立即可以检索，不必排队
+    if job_id is None:
+        return JSONResponse(content={"message": "PDF上传成功，索引已就绪", "job_id": None,
+                                     "sha256": sha256, "pages": pages, "deduplicated": not is_new}, status_code=200)
 
-    # 后台重新生成索引
-    background_tasks.add_task(build_index_for_user, uid)
-    
-    return JSONResponse(content={"message": "PDF上传成功，正在生成索引"}, status_code=200)
+    return JSONResponse(content={"message": "PDF上传成功，正在生成索引", "job_id": job_id,
+                                 "sha256": sha256, "pages": pages, "deduplicated": not is_new}, status_code=200)
+
+def job_progress(user_id: str):
+    """最近一次构建任务的状态：queued（含排队位置）/ running / done / failed，附带页数、分块数、吞吐与预计剩余时间"""
+    job = get_index_queue().status(user_id)
+    if job is None:
+        return {"step": "未开始", "percent": 0}
+    if job["status"] == "failed":
+        job["step"], job["percent"] = "索引生成失败", 100
+    return job
 
 @router.get("/index-progress")
 async def get_index_progress(token: str = None, request: Request = None):
@@ -120,65 +227,47 @@ async def get_index_progress(token: str = None, request: Request = None):
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
 
-    user_dir = os.path.join(settings.DATA_DIR, str(uid))
-    progress_file = os.path.join(user_dir, 'index_progress.json')
+    return await run_in_threadpool(job_progress, uid)
 
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            progress = json.load(f)
-        return progress
-    else:
-        return {"step": "未开始", "percent": 0}
-    
-    user_dir = os.path.join(settings.DATA_DIR, str(uid))
-    progress_file = os.path.join(user_dir, 'index_progress.json')
-    
-    if os.path.exists(progress_file):
-        with open(progress_file, 'r', encoding='utf-8') as f:
-            progress = json.load(f)
-        return progress
-    else:
-        return {"step": "未开始", "percent": 0}
+@router.get("/index-progress/stream")
+async def stream_index_progress(token: str = None, request: Request = None):
+    """
+    以 SSE 推送构建进度：进度变化时发送一条 data 事件（内容同 /api/index-progress），任务结束后关闭连接。
+
+    本进程的构建线程写入进度后立即唤醒这里（见 build_queue.ProgressNotifier）；构建在其他进程中运行时，
+    每 INDEX_PROGRESS_INTERVAL 秒读取一次任务状态。EventSource 不能设置请求头，token 可以放在查询参数中。
+    """
     try:
-        # 支持从查询参数或 Authorization header 提取 token
         auth_header = request.headers.get("Authorization") if request else None
         token_str = get_token_from_request(token, auth_header)
         uid = parse_token(token_str)
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
-    
-    pdfs = []
-    
-    # 添加全局PDF
-    if os.path.exists(settings.PDF_DIR):
-        for filename in os.listdir(settings.PDF_DIR):
-            if filename.lower().endswith('.pdf'):
-                filepath = os.path.join(settings.PDF_DIR, filename)
-                stat = os.stat(filepath)
-                pdfs.append({
-                    "name": filename,
-                    "upload_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "source": "global"
-                })
-    
-    # 添加用户特定PDF
-    user_dir = os.path.join(settings.DATA_DIR, str(uid))
-    pdf_dir = os.path.join(user_dir, 'pdfs')
-    if os.path.exists(pdf_dir):
-        for filename in os.listdir(pdf_dir):
-            if filename.lower().endswith('.pdf'):
-                filepath = os.path.join(pdf_dir, filename)
-                stat = os.stat(filepath)
-                pdfs.append({
-                    "name": filename,
-                    "upload_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "source": "user"
-                })
 
-    return pdfs
+    updates = get_index_queue().updates
+
+    async def events():
+        last, last_sent = None, time.monotonic()
+        while not await request.is_disconnected():
+            # 先记下版本号再读取，读取之后的通知会让下面的等待立即返回
+            seen = updates.version(uid)
+            job = await run_in_threadpool(job_progress, uid)
+            if job != last:
+                yield f"data: {json.dumps(job, ensure_ascii=False)}\n\n"
+                last, last_sent = job, time.monotonic()
+                if job.get("status") in (None, "done", "failed"):
+                    return
+            elif time.monotonic() - last_sent > 15:
+                # 长时间没有新进度时发注释行，避免代理断开空闲连接
+                yield ": keep-alive\n\n"
+                last_sent = time.monotonic()
+            await updates.wait(uid, seen, settings.INDEX_PROGRESS_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @router.delete("/pdfs/{filename}")
-async def delete_pdf(filename: str, background_tasks: BackgroundTasks, token: str = None, request: Request = None):
+async def delete_pdf(filename: str, token: str = None, request: Request = None, db: Session = Depends(get_db)):
     try:
         # 支持从查询参数或 Authorization header 提取 token
         auth_header = request.headers.get("Authorization") if request else None
@@ -187,6 +276,21 @@ async def delete_pdf(filename: str, background_tasks: BackgroundTasks, token: st
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
     
+    # 只删除用户的引用：检索时不再组合该文档的分片，无需重建；文档本身由 scripts/gc_documents.py 清理
+    doc = db.query(models.UserDocument).filter(
+        models.UserDocument.user_id == uid,
+        models.UserDocument.filename == filename
+    ).first()
+    if doc is not None:
+        db.delete(doc)
+        db.commit()
+        if index_exists(legacy_index_dir(uid)):
+            # 旧版私有索引中仍有该文档，排队构建其余文档的分片后删除旧索引
+            job_id = get_index_queue().enqueue(uid)
+            return {"message": "PDF删除成功，正在更新索引", "job_id": job_id}
+        return {"message": "PDF删除成功"}
+
+    # 尚未迁移的旧版用户目录
     user_dir = os.path.join(settings.DATA_DIR, str(uid))
     pdf_dir = os.path.join(user_dir, 'pdfs')
     pdf_path = os.path.join(pdf_dir, filename)
@@ -198,13 +302,28 @@ async def delete_pdf(filename: str, background_tasks: BackgroundTasks, token: st
     # 删除PDF文件
     os.remove(pdf_path)
 
-    # 后台重新生成索引
-    background_tasks.add_task(build_index_for_user, uid)
+    # 排队更新索引
+    job_id = get_index_queue().enqueue(uid)
     
-    return {"message": "PDF删除成功，正在更新索引"}
+    return {"message": "PDF删除成功，正在更新索引", "job_id": job_id}
+
+def list_global_pdfs(db: Session):
+    """全局文档取自文档目录中由 scripts/build_index.py 登记的记录，不加载全局索引、不扫描目录"""
+    docs = db.query(models.Document).filter(
+        models.Document.global_name.isnot(None)
+    ).order_by(models.Document.global_name).all()
+    return [{
+        "name": doc.global_name,
+        "upload_time": datetime.fromtimestamp(doc.created_at).isoformat(),
+        "source": "global",
+        "size": doc.size,
+        "pages": doc.pages,
+        "status": models.Document.READY,
+        "index_version": doc.global_version
+    } for doc in docs]
 
 @router.get("/pdfs")
-async def list_pdfs(token: str = None, request: Request = None):
+def list_pdfs(token: str = None, request: Request = None, db: Session = Depends(get_db)):
     try:
         # 支持从查询参数或 Authorization header 提取 token
         auth_header = request.headers.get("Authorization") if request else None
@@ -213,21 +332,26 @@ async def list_pdfs(token: str = None, request: Request = None):
     except ValueError as e:
         raise HTTPException(status_code=401, detail=str(e))
 
-    pdfs = []
+    # 全局PDF
+    pdfs = list_global_pdfs(db)
 
-    # 添加全局PDF
-    if os.path.exists(settings.PDF_DIR):
-        for filename in os.listdir(settings.PDF_DIR):
-            if filename.lower().endswith('.pdf'):
-                filepath = os.path.join(settings.PDF_DIR, filename)
-                stat = os.stat(filepath)
-                pdfs.append({
-                    "name": filename,
-                    "upload_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "source": "global"
-                })
+    # 用户上传的文档：引用与文档目录联表，一次查询得到页数、分块数与索引状态
+    rows = db.query(models.UserDocument, models.Document).outerjoin(
+        models.Document, models.Document.sha256 == models.UserDocument.sha256
+    ).filter(models.UserDocument.user_id == uid).order_by(models.UserDocument.created_at).all()
+    for ref, doc in rows:
+        pdfs.append({
+            "name": ref.filename,
+            "upload_time": datetime.fromtimestamp(ref.created_at).isoformat(),
+            "source": "user",
+            "size": ref.size,
+            "pages": doc.pages if doc else None,
+            "chunks": doc.chunks if doc else None,
+            "status": doc.status if doc else models.Document.PENDING,
+            "index_version": doc.index_version if doc else None
+        })
 
-    # 添加用户特定PDF
+    # 尚未迁移的旧版用户目录
     user_dir = os.path.join(settings.DATA_DIR, str(uid))
     pdf_dir = os.path.join(user_dir, 'pdfs')
     if os.path.exists(pdf_dir):
@@ -238,7 +362,8 @@ async def list_pdfs(token: str = None, request: Request = None):
                 pdfs.append({
                     "name": filename,
                     "upload_time": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-                    "source": "user"
+                    "source": "user",
+                    "status": models.Document.PENDING
                 })
 
     return pdfs
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+近似最近邻索引的 recall@k / 延迟报告，以 flat 精确检索为基准。
+
+用法：
+  python scripts/bench_ann.py [index_dir] [--queries 500] [--top-k 6]
+  python scripts/bench_ann.py --synthetic 100000 --dim 1024
+
+默认读取索引目录下的 embeddings.npy；查询向量取语料中随机向量加少量噪声，
+模拟"和某段教材内容相近的提问"。不需要调用 embedding 接口。
+量化（VECTOR_QUANT）与 PQ 索引同时给出不重排和用全精度向量重排两种结果。
+"""
+import os, sys, time, argparse
+import numpy as np
+import faiss
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.versions import resolve_index_dir
+from app.rag.faiss_index import build_faiss_index, index_params_from_settings, apply_search_params, search_index
+
+def normalize(x):
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        # 在若干主题中心附近采样，比纯随机向量更接近真实语料的聚类结构
+        centers = rng.standard_normal((max(16, args.synthetic // 500), args.dim))
+        labels = rng.integers(0, len(centers), args.synthetic)
+        return normalize(centers[labels] + 0.6 * rng.standard_normal((args.synthetic, args.dim))).astype("float32")
+    return np.load(os.path.join(resolve_index_dir(args.index_dir), "embeddings.npy")).astype("float32")
+
+def make_queries(embs, n, rng):
+    picked = embs[rng.choice(len(embs), min(n, len(embs)), replace=False)]
+    return normalize(picked + 0.05 * rng.standard_normal(picked.shape)).astype("float32")
+
+def timed_search(index, params, queries, k, full_vectors=None):
+    """逐条查询（与线上每次一个问题一致），返回 (结果 id, 平均毫秒)"""
+    ids = np.full((len(queries), k), -1, dtype="int64")
+    t0 = time.perf_counter()
+    for i in range(len(queries)):
+        _, found = search_index(index, params, queries[i:i + 1], k, full_vectors)
+        ids[i, :len(found)] = found
+    return ids, (time.perf_counter() - t0) * 1000 / len(queries)
+
+def recall(ids, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids.tolist(), truth.tolist())]))
+
+def index_size_mb(index):
+    if isinstance(index, faiss.IndexBinary):
+        return faiss.serialize_index_binary(index).nbytes / 1024 / 1024
+    return faiss.serialize_index(index).nbytes / 1024 / 1024
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_dir", nargs="?", default=settings.INDEX_DIR)
+    parser.add_argument("--synthetic", type=int, default=0, help="用 N 条合成向量代替索引中的向量")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--top-k", type=int, default=settings.TOP_K)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    embs = load_vectors(args)
+    queries = make_queries(embs, args.queries, np.random.default_rng(args.seed))
+    k = args.top_k
+    print(f"向量: {embs.shape[0]} x {embs.shape[1]}，查询: {len(queries)} 条，top_k={k}")
+
+    base = dict(index_params_from_settings(settings), quant="none")
+    flat, flat_params = build_faiss_index(embs, dict(base, type="flat"))
+    truth, flat_ms = timed_search(flat, flat_params, queries, k)
+
+    print(f"{'index':<26}{'build(s)':>9}{'size(MB)':>10}{'search':>16}{'recall@k':>10}{'ms/query':>10}")
+    print(f"{'Flat':<26}{0:>9.2f}{index_size_mb(flat):>10.1f}{'-':>16}{1:>10.3f}{flat_ms:>10.3f}")
+
+    grids = {
+        "ivf": ("nprobe", [1, 4, 8, 16, 32, 64]),
+        "hnsw": ("ef_search", [16, 32, 64, 128, 256]),
+        "ivfpq": ("nprobe", [1, 4, 8, 16, 32, 64]),
+    }
+    for index_type, (knob, values) in grids.items():
+        t0 = time.perf_counter()
+        index, params = build_faiss_index(embs, dict(base, type=index_type))
+        build_s = time.perf_counter() - t0
+        if params["type"] != index_type:
+            print(f"{index_type:<26}语料太小，已退回 {params['type']}，跳过")
+            continue
+        size_mb = index_size_mb(index)
+        for value in values:
+            if knob == "nprobe" and value > params["nlist"]:
+                break
+            apply_search_params(index, dict(params, **{knob: value}))
+            ids, ms = timed_search(index, params, queries, k)
+            print(f"{params['factory']:<26}{build_s:>9.2f}{size_mb:>10.1f}{f'{knob}={value}':>16}"
+                  f"{recall(ids, truth):>10.3f}{ms:>10.3f}")
+            if index_type == "ivfpq":
+                ids, ms = timed_search(index, params, queries, k, embs)
+                print(f"{params['factory'] + ' +rescore':<26}{build_s:>9.2f}{size_mb:>10.1f}"
+                      f"{f'{knob}={value}':>16}{recall(ids, truth):>10.3f}{ms:>10.3f}")
+
+    # 标量 / 二值量化：第一阶段结果与全精度重排结果对比
+    for quant in ("fp16", "int8", "binary"):
+        t0 = time.perf_counter()
+        index, params = build_faiss_index(embs, dict(base, type="flat", quant=quant))
+        build_s = time.perf_counter() - t0
+        size_mb = index_size_mb(index)
+        for full_vectors, label in ((None, ""), (embs, " +rescore")):
+            ids, ms = timed_search(index, params, queries, k, full_vectors)
+            factor = f"x{params['rescore_factor']}" if full_vectors is not None else "-"
+            print(f"{params['factory'] + label:<26}{build_s:>9.2f}{size_mb:>10.1f}{factor:>16}"
+                  f"{recall(ids, truth):>10.3f}{ms:>10.3f}")
+
+if __name__ == "__main__":
+    main()
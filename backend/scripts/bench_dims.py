@@ -0,0 +1,98 @@
+"""
+对比不同 embedding 维度（EMBED_DIM）的索引大小、检索延迟与召回率。
+
+用法：
+  python scripts/bench_dims.py [index_dir] [--docs 2000] [--queries 100] [--dims 1024,768,512,256,128,64]
+
+从索引元数据中抽取分块作为语料，再从部分分块中截取一段文本作为查询，对每个维度分别
+调用 embedding 接口（需要 QWEN_API_KEY），报告：
+  - 接口响应大小与每批耗时
+  - flat 索引大小与每次查询耗时
+  - recall@k：以模型默认维度的 top_k 结果为基准
+  - hit@k：查询来源分块是否出现在 top_k 中
+"""
+import os, sys, time, json, random, argparse
+import numpy as np
+import faiss
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.indexer import get_embeddings
+from app.rag.metastore import open_meta_store
+from app.rag.versions import resolve_index_dir
+
+BATCH_SIZE = 5
+
+def embed_all(texts, dim):
+    """返回 (float32 向量, 响应 JSON 字节数, 平均每批毫秒)"""
+    vectors, elapsed, nbytes = [], 0.0, 0
+    for i in range(0, len(texts), BATCH_SIZE):
+        t0 = time.perf_counter()
+        batch = get_embeddings(texts[i:i + BATCH_SIZE], dimensions=dim)
+        elapsed += time.perf_counter() - t0
+        # 按 JSON 数组估算响应体积（浮点数以文本传输）
+        nbytes += len(json.dumps(batch))
+        vectors.extend(batch)
+    batches = (len(texts) + BATCH_SIZE - 1) // BATCH_SIZE
+    return np.array(vectors, dtype="float32"), nbytes, elapsed * 1000 / batches
+
+def timed_search(index, queries, k):
+    ids = np.empty((len(queries), k), dtype="int64")
+    t0 = time.perf_counter()
+    for i in range(len(queries)):
+        _, found = index.search(queries[i:i + 1], k)
+        ids[i] = found[0]
+    return ids, (time.perf_counter() - t0) * 1000 / len(queries)
+
+def recall(ids, truth):
+    k = truth.shape[1]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ids.tolist(), truth.tolist())]))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_dir", nargs="?", default=settings.INDEX_DIR)
+    parser.add_argument("--docs", type=int, default=2000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dims", default="1024,768,512,256,128,64")
+    parser.add_argument("--top-k", type=int, default=settings.TOP_K)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    metas = open_meta_store(resolve_index_dir(args.index_dir))
+    doc_ids = rng.sample(range(len(metas)), min(args.docs, len(metas)))
+    texts = [metas.text(i) for i in doc_ids]
+    sources = [i for i, t in enumerate(texts) if len(t.strip()) >= 30]
+    sources = rng.sample(sources, min(args.queries, len(sources)))
+    queries = []
+    for i in sources:
+        length = rng.randint(8, 24)
+        start = rng.randint(0, len(texts[i]) - length)
+        queries.append(texts[i][start:start + length])
+    k = args.top_k
+    print(f"模型: {settings.EMBED_MODEL}，语料: {len(texts)} 个分块，查询: {len(queries)} 条，top_k={k}")
+
+    # 0 表示模型默认维度，作为召回基准
+    dims = [0] + [int(d) for d in args.dims.split(",") if d.strip()]
+    truth = None
+    print(f"{'dim':>6}{'resp(KB)':>10}{'ms/batch':>10}{'index(MB)':>11}{'ms/query':>10}{'recall@k':>10}{'hit@k':>8}")
+    for dim in dims:
+        embs, resp_bytes, embed_ms = embed_all(texts, dim)
+        qvs, _, _ = embed_all(queries, dim)
+        index = faiss.IndexFlatIP(embs.shape[1])
+        index.add(embs)
+        ids, search_ms = timed_search(index, qvs, k)
+        if truth is None:
+            truth = ids
+        hit = float(np.mean([src in row for src, row in zip(sources, ids.tolist())]))
+        size_mb = faiss.serialize_index(index).nbytes / 1024 / 1024
+        label = str(embs.shape[1]) + ("*" if dim == 0 else "")
+        print(f"{label:>6}{resp_bytes / 1024:>10.1f}{embed_ms:>10.1f}{size_mb:>11.2f}"
+              f"{search_ms:>10.3f}{recall(ids, truth):>10.3f}{hit:>8.3f}")
+    print("* 模型默认维度（基准）")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+对比不同 BM25 分词器的检索延迟、倒排表访问量与召回率。
+
+用法：
+  python scripts/bench_tokenizer.py [index_dir] [--queries 200] [--top-k 6]
+
+从索引的元数据中随机抽取分块，截取其中一段连续文本作为查询，
+检查该分块能否出现在 BM25 的 top_k 结果中（recall@k）。
+不需要调用 embedding 接口。
+"""
+import os, sys, time, random, argparse
+import numpy as np
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.metastore import open_meta_store
+from app.rag.versions import resolve_index_dir
+from app.rag.sparse import BM25Index
+from app.rag.tokenizer import TOKENIZERS, get_tokenizer
+
+def make_queries(texts, n, rng):
+    """从随机分块中截取 8~24 字的片段作为查询，返回 [(query, 来源分块号)]"""
+    queries = []
+    candidates = [i for i, t in enumerate(texts) if len(t.strip()) >= 30]
+    for doc_id in rng.sample(candidates, min(n, len(candidates))):
+        text = texts[doc_id]
+        length = rng.randint(8, 24)
+        start = rng.randint(0, len(text) - length)
+        queries.append((text[start:start + length], doc_id))
+    return queries
+
+def bench(name, texts, queries, top_k):
+    tokenize = get_tokenizer(name)
+    t0 = time.perf_counter()
+    index = BM25Index.build([tokenize(t) for t in texts], tokenizer=name)
+    build_s = time.perf_counter() - t0
+
+    latencies, postings, hits = [], [], 0
+    for query, doc_id in queries:
+        q_tokens = tokenize(query)
+        touched = 0
+        for term in set(q_tokens):
+            tid = index.term_ids.get(term)
+            if tid is not None:
+                touched += int(index.indptr[tid + 1] - index.indptr[tid])
+        t0 = time.perf_counter()
+        top_idx, _ = index.search(q_tokens, top_k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        postings.append(touched)
+        hits += int(doc_id in top_idx.tolist())
+
+    lat = np.array(latencies)
+    return {
+        "tokenizer": name,
+        "vocab": len(index.vocab),
+        "postings": len(index.docs),
+        "build_s": build_s,
+        "avg_postings": float(np.mean(postings)),
+        "p50_ms": float(np.percentile(lat, 50)),
+        "p95_ms": float(np.percentile(lat, 95)),
+        "recall": hits / len(queries),
+    }
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("index_dir", nargs="?", default=settings.INDEX_DIR)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=settings.TOP_K)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    metas = open_meta_store(resolve_index_dir(args.index_dir))
+    texts = [metas.text(i) for i in range(len(metas))]
+    queries = make_queries(texts, args.queries, random.Random(args.seed))
+    print(f"语料: {len(texts)} 个分块，查询: {len(queries)} 条，top_k={args.top_k}")
+
+    print(f"{'tokenizer':<10}{'vocab':>9}{'postings':>11}{'build(s)':>10}"
+          f"{'postings/q':>12}{'p50(ms)':>9}{'p95(ms)':>9}{'recall@k':>10}")
+    for name in TOKENIZERS:
+        try:
+            r = bench(name, texts, queries, args.top_k)
+        except RuntimeError as e:
+            print(f"{name:<10}跳过：{e}")
+            continue
+        print(f"{r['tokenizer']:<10}{r['vocab']:>9}{r['postings']:>11}{r['build_s']:>10.2f}"
+              f"{r['avg_postings']:>12.0f}{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['recall']:>10.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,41 @@
-import os, sys, json
-import numpy as np
-import faiss
-from openai import OpenAI
-from rank_bm25 import BM25Okapi
+import os, sys, argparse
 
 # Add backend directory to path for imports
 backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, backend_dir)
 
 from app.config import settings
-from app.rag.ingest import build_corpus
-
-def get_embeddings(texts):
-    """
-    使用 DashScope API 获取云端嵌入向量
-    """
-    api_key = settings.QWEN_API_KEY
-    if not api_key:
-        raise RuntimeError("Missing QWEN_API_KEY. Set it in .env file.")
-    
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-        timeout=120.0
-    )
-    
-    # 云端模型使用 text-embedding-v3
-    response = client.embeddings.create(
-        model="text-embedding-v3",
-        input=texts
-    )
-    
-    # OpenAI 兼容接口返回的嵌入向量
-    embeddings = [item.embedding for item in response.data]
-    return embeddings
+from app.models import Base, engine
+from app.rag.indexer import build_index, update_index
+from app.routers.upload_api import register_global_documents
 
 def main():
-    os.makedirs(settings.INDEX_DIR, exist_ok=True)
-    meta_path = os.path.join(settings.INDEX_DIR, "meta.jsonl")
-
-    print("1) 构建语料与元数据...")
-    metas = build_corpus(settings.PDF_DIR, settings.CHUNK_SIZE, settings.CHUNK_OVERLAP, meta_path)
-    texts = [m["text"] for m in metas]
-
-    print("2) 调用 DashScope API 计算向量并写入FAISS...")
-    print(f"   - 总文本数: {len(texts)}")
-    print("   - 向量模型: text-embedding-v3")
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--incremental", action="store_true", help="只处理新增、修改或删除的 PDF")
+    args = parser.parse_args()
+
+    print("增量更新全局索引..." if args.incremental else "构建全局索引...")
+    print(f"   - PDF 目录: {settings.PDF_DIR}")
+    print(f"   - 索引目录: {settings.INDEX_DIR}")
+    print(f"   - 向量模型: {settings.EMBED_MODEL}（维度: {settings.EMBED_DIM or '默认'}）")
     print("   - API 端点: https://dashscope.aliyuncs.com/compatible-mode/v1")
-    
-    # 分批调用 API（避免单次请求过大）
-    batch_size = 5  # 减少批次大小以避免超时
-    all_embeddings = []
-    
-    for i in range(0, len(texts), batch_size):
-        batch_texts = texts[i:i+batch_size]
-        print(f"   处理批次 {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}...")
-        batch_embs = get_embeddings(batch_texts)
-        all_embeddings.extend(batch_embs)
-    
-    embs = np.array(all_embeddings, dtype="float32")
-
-    dim = embs.shape[1]
-    index = faiss.IndexFlatIP(dim)
-    index.add(embs)
-
-    faiss_path = os.path.join(settings.INDEX_DIR, "faiss.index")
-    faiss.write_index(index, faiss_path)
-
-    print("3) 构建BM25（可选增强）...")
-    tokens = [list(t) for t in texts]  # 简化：按字符；生产可用更好的分词
-    bm25 = BM25Okapi(tokens)
-    bm25_path = os.path.join(settings.INDEX_DIR, "bm25.json")
-    with open(bm25_path, "w", encoding="utf-8") as f:
-        json.dump({"tokens": tokens}, f, ensure_ascii=False)
 
-    print("✅ 完成：", faiss_path, meta_path, bm25_path)
+    def progress(step, percent, detail=None):
+        line = f"   [{percent:3d}%] {step}"
+        if detail and "eta_seconds" in detail:
+            line += (f"  {detail['pages_done']}/{detail['pages_total']} 页，{detail['chunks_done']} 个分块，"
+                     f"{detail['pages_per_second']} 页/秒，{detail['embeddings_per_second']} 块/秒，"
+                     f"剩余约 {detail['eta_seconds']:.0f} 秒")
+        print(line)
+
+    build = update_index if args.incremental else build_index
+    count = build(settings.PDF_DIR, settings.INDEX_DIR, progress)
+    print(f"✅ 完成：共 {count} 个分块，索引目录 {settings.INDEX_DIR}")
+
+    # /api/pdfs 从文档目录列出全局文档
+    Base.metadata.create_all(bind=engine)
+    registered = register_global_documents(settings.INDEX_DIR, settings.PDF_DIR)
+    print(f"   已登记 {registered} 个全局文档")
 
 if __name__ == "__main__":
     main()
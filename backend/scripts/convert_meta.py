@@ -0,0 +1,40 @@
+"""
+把旧索引目录中的 meta.jsonl 一次性转换为列式元数据存储。
+
+用法：
+  python scripts/convert_meta.py                 # 转换全局索引与所有用户索引
+  python scripts/convert_meta.py <index_dir> ... # 只转换指定目录
+  加 --compress 对分块文本逐条 zlib 压缩
+"""
+import os, sys
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.metastore import convert_jsonl
+from app.rag.versions import resolve_index_dir
+
+def find_index_dirs():
+    dirs = [settings.INDEX_DIR]
+    if os.path.isdir(settings.DATA_DIR):
+        for name in sorted(os.listdir(settings.DATA_DIR)):
+            user_index_dir = os.path.join(settings.DATA_DIR, name, 'index')
+            if os.path.isdir(user_index_dir):
+                dirs.append(user_index_dir)
+    return dirs
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    compressed = "--compress" in sys.argv[1:] or settings.META_COMPRESS
+
+    for index_dir in args or find_index_dirs():
+        index_dir = resolve_index_dir(index_dir)
+        if not os.path.exists(os.path.join(index_dir, "meta.jsonl")):
+            continue
+        count = convert_jsonl(index_dir, compressed=compressed)
+        print(f"✅ {index_dir}: {count} 条")
+
+if __name__ == "__main__":
+    main()
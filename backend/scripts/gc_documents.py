@@ -0,0 +1,78 @@
+"""
+清理共享文档库中不再被任何用户引用的文档（PDF 与索引分片）。
+
+用法：
+  python scripts/gc_documents.py [--grace-hours 24] [--dry-run]
+
+用户删除文档时只去掉 user_document 中的引用。这里删除没有引用、且 PDF 超过宽限期未被上传过的
+文档目录及其在 document 表中的记录（宽限期避免误删刚上传、还没写入引用的文件），以及上传中断留下的临时文件。
+同时是全局文档的记录保留（/api/pdfs 据此列出全局文档），只把分片状态重置为 pending。
+"""
+import os, sys, time, shutil, argparse
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.db import SessionLocal
+from app import models
+from app.rag.doc_store import store_root, document_dir, document_pdf
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fn in filenames:
+            total += os.path.getsize(os.path.join(dirpath, fn))
+    return total
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grace-hours", type=float, default=24)
+    parser.add_argument("--dry-run", action="store_true", help="只列出，不删除")
+    args = parser.parse_args()
+
+    root = store_root()
+    if not os.path.isdir(root):
+        print("文档库为空")
+        return
+    with SessionLocal() as db:
+        referenced = {sha256 for (sha256,) in db.query(models.UserDocument.sha256).distinct()}
+    cutoff = time.time() - args.grace_hours * 3600
+
+    removed, freed = [], 0
+    for name in sorted(os.listdir(root)):
+        if name == "tmp":
+            for fn in os.listdir(os.path.join(root, name)):
+                path = os.path.join(root, name, fn)
+                if os.path.getmtime(path) < cutoff:
+                    freed += os.path.getsize(path)
+                    if not args.dry_run:
+                        os.remove(path)
+            continue
+        if name in referenced:
+            continue
+        pdf = document_pdf(name)
+        if os.path.exists(pdf) and os.path.getmtime(pdf) > cutoff:
+            continue
+        size = dir_size(document_dir(name))
+        print(f"   {name}: {size / 1024 / 1024:.1f} MB")
+        removed.append(name)
+        freed += size
+        if not args.dry_run:
+            shutil.rmtree(document_dir(name))
+
+    if removed and not args.dry_run:
+        with SessionLocal() as db:
+            docs = db.query(models.Document).filter(models.Document.sha256.in_(removed))
+            docs.filter(models.Document.global_name.is_(None)).delete(synchronize_session=False)
+            docs.filter(models.Document.global_name.isnot(None)).update({
+                models.Document.status: models.Document.PENDING, models.Document.chunks: None,
+                models.Document.index_version: None, models.Document.error: None,
+            }, synchronize_session=False)
+            db.commit()
+
+    print(f"{'可删除' if args.dry_run else '已删除'} {len(removed)} 个文档，{freed / 1024 / 1024:.1f} MB；"
+          f"仍被引用 {len(referenced)} 个")
+
+if __name__ == "__main__":
+    main()
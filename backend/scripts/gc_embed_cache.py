@@ -0,0 +1,67 @@
+"""
+清理分块向量缓存中不再被任何索引引用的条目。
+
+用法：
+  python scripts/gc_embed_cache.py [--grace-hours 24] [--vacuum] [--dry-run]
+
+扫描全局索引与所有用户索引的有效分块（不含已删除文档的墓碑行），收集文本哈希后
+删除缓存中未被引用、且超过宽限期未使用的条目。
+"""
+import os, sys, glob, argparse
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.chunk_cache import ChunkEmbeddingCache, text_hash
+from app.rag.manifest import MANIFEST_NAME, read_manifest, live_rows
+from app.rag.metastore import has_meta_store, open_meta_store
+from app.rag.versions import resolve_index_dir
+from app.rag.doc_store import store_root
+
+def index_dirs():
+    dirs = [settings.INDEX_DIR] + sorted(glob.glob(os.path.join(settings.DATA_DIR, "*", "index")))
+    dirs += sorted(glob.glob(os.path.join(store_root(), "*", "index")))
+    dirs = [resolve_index_dir(d) for d in dirs]
+    return [d for d in dirs if has_meta_store(d)]
+
+def referenced_hashes(index_dir):
+    metas = open_meta_store(index_dir)
+    live = None
+    if os.path.exists(os.path.join(index_dir, MANIFEST_NAME)):
+        manifest = read_manifest(index_dir)
+        if manifest.get("deleted"):
+            live = live_rows(manifest["documents"], len(metas))
+    return {text_hash(metas.text(i)) for i in range(len(metas)) if live is None or live[i]}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--grace-hours", type=float, default=24)
+    parser.add_argument("--vacuum", action="store_true", help="清理后压缩数据库文件")
+    parser.add_argument("--dry-run", action="store_true", help="只统计引用，不删除")
+    args = parser.parse_args()
+
+    cache = ChunkEmbeddingCache(os.path.join(settings.DATA_DIR, "cache", "chunk_embeddings.db"))
+    before = cache.stats()
+    print(f"缓存: {before['entries']} 条，向量 {before['vector_bytes'] / 1024 / 1024:.1f} MB，"
+          f"文件 {before['file_bytes'] / 1024 / 1024:.1f} MB")
+
+    keep = set()
+    for d in index_dirs():
+        hashes = referenced_hashes(d)
+        print(f"   {d}: {len(hashes)} 个分块")
+        keep |= hashes
+    print(f"被引用的分块文本: {len(keep)}")
+    if args.dry_run:
+        return
+
+    result = cache.gc(keep, grace_seconds=int(args.grace_hours * 3600))
+    if args.vacuum:
+        cache.vacuum()
+    after = cache.stats()
+    print(f"✅ 删除 {result['deleted']} 条（{result['freed_bytes'] / 1024 / 1024:.1f} MB），"
+          f"剩余 {after['entries']} 条，文件 {after['file_bytes'] / 1024 / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main()
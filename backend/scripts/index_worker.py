@@ -0,0 +1,32 @@
+"""
+独立运行索引构建队列的工作进程，让构建不与 Web 进程争抢 CPU。
+
+用法：
+  INDEX_WORKER_IN_PROCESS=false uvicorn app.main:app ...   # Web 进程只负责入队
+  python scripts/index_worker.py
+
+可以在多台机器（共享 DATA_DIR）或同一台机器上运行多个，合计并发仍受 INDEX_BUILD_CONCURRENCY 限制。
+Ctrl-C 退出；正在进行的构建在心跳超时（INDEX_JOB_LEASE）后由其他工作进程重新排队，从断点继续。
+"""
+import os, sys, time
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.build_queue import get_index_queue, start_index_worker
+from app.routers.upload_api import build_index_for_user
+
+def main():
+    worker = start_index_worker(build_index_for_user)
+    print(f"索引构建工作进程已启动：{worker.name}，并发上限 {settings.INDEX_BUILD_CONCURRENCY}")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"   队列: {get_index_queue().stats()}")
+    except KeyboardInterrupt:
+        worker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+"""
+把旧版的用户目录（DATA_DIR/<uid>/pdfs 与私有索引）迁移到共享文档库。
+
+用法：
+  python scripts/migrate_user_docs.py
+
+为每个还有旧目录的用户排队一个索引构建任务：构建线程把 PDF 按内容哈希存入文档库、写入引用，
+删除旧的 PDF 目录，再构建缺少的分片（相同的教材只建一次，已 embed 过的分块从向量缓存读取），
+分片全部建好后删除旧的私有索引。迁移完成前检索仍使用旧的私有索引；中途失败的用户重新运行本脚本即可重试。
+"""
+import os, sys
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+from app.config import settings
+from app.rag.build_queue import get_index_queue
+
+def main():
+    users = []
+    if os.path.isdir(settings.DATA_DIR):
+        for name in sorted(os.listdir(settings.DATA_DIR)):
+            user_dir = os.path.join(settings.DATA_DIR, name)
+            if os.path.isdir(os.path.join(user_dir, 'pdfs')) or os.path.isdir(os.path.join(user_dir, 'index')):
+                users.append(name)
+    queue = get_index_queue()
+    for user_id in users:
+        queue.enqueue(user_id)
+    print(f"已为 {len(users)} 个用户排队迁移任务")
+
+if __name__ == "__main__":
+    main()
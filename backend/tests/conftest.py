@@ -0,0 +1,79 @@
+"""
+测试环境：数据目录与数据库放在临时目录，embedding 接口换成按文本哈希生成的固定向量，不访问网络。
+"""
+import os, sys, hashlib, tempfile
+
+_data_dir = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ["DATA_DIR"] = _data_dir
+os.environ["PDF_DIR"] = os.path.join(_data_dir, "pdfs")
+os.environ["INDEX_DIR"] = os.path.join(_data_dir, "index")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_data_dir, 'app.db')}"
+os.environ.setdefault("QWEN_API_KEY", "test")
+# 构建在测试进程内顺序抽取 PDF；进程池由 test_ingest 单独覆盖
+os.environ.setdefault("INGEST_WORKERS", "1")
+
+# Add backend directory to path for imports
+backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, backend_dir)
+
+import fitz  # PyMuPDF
+import numpy as np
+import pytest
+
+EMBED_DIM = 32
+
+
+def fake_embeddings(texts, dimensions=None):
+    """按文本哈希生成固定的单位向量：同一文本总是得到同一向量"""
+    vectors = []
+    for text in texts:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        v = np.random.default_rng(seed).standard_normal(EMBED_DIM)
+        vectors.append((v / np.linalg.norm(v)).tolist())
+    return vectors
+
+
+@pytest.fixture(autouse=True)
+def offline_embeddings(monkeypatch):
+    """替换 embedding 接口，返回本次测试中被 embed 的文本列表"""
+    from app.rag import indexer
+    embedded = []
+
+    def get_embeddings(texts, dimensions=None):
+        embedded.extend(texts)
+        return fake_embeddings(texts, dimensions)
+    monkeypatch.setattr(indexer, "get_embeddings", get_embeddings)
+    return embedded
+
+
+@pytest.fixture(autouse=True)
+def chunk_cache(tmp_path, monkeypatch):
+    """每个测试使用独立的分块向量缓存"""
+    from app.rag import chunk_cache as module
+    cache = module.ChunkEmbeddingCache(str(tmp_path / "cache" / "chunk_embeddings.db"))
+    monkeypatch.setattr(module, "_cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def extract_cache(tmp_path, monkeypatch):
+    """每个测试使用独立的 PDF 文本抽取缓存"""
+    from app.rag import extract_cache as module
+    cache = module.ExtractionCache(str(tmp_path / "cache" / "extract"))
+    monkeypatch.setattr(module, "_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def make_pdf():
+    """make_pdf(path, pages, tag)：生成每页若干行不同英文文本的 PDF"""
+    def make(path, pages: int = 2, tag: str = "book", lines: int = 20):
+        doc = fitz.open()
+        for i in range(pages):
+            page = doc.new_page()
+            for j in range(lines):
+                page.insert_text((72, 72 + 14 * j), f"{tag} page {i} line {j} scheduling memory {tag}-{i}-{j}")
+        doc.save(str(path))
+        doc.close()
+        return path
+    return make
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from app.rag.sparse import BM25Index, load_bm25
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+
+def make_corpus(docs: int = 200, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    # 少数高频词（文档频率过半，IDF 为负，走 epsilon 下限）加上长尾词
+    words = [f"w{i}" for i in range(300)]
+    corpus = []
+    for _ in range(docs):
+        tokens = ["the"] * int(rng.integers(1, 4))
+        tokens += [words[int(i)] for i in rng.zipf(1.3, size=int(rng.integers(3, 40))) % len(words)]
+        corpus.append(tokens)
+    return corpus
+
+
+def dense_scores(index: BM25Index, query):
+    scores = np.zeros(index.num_docs)
+    ids, values = index.search(query, index.num_docs)
+    scores[ids] = values
+    return scores
+
+
+@pytest.mark.parametrize("query", [
+    ["w1"],
+    ["w3", "w7", "w120"],
+    ["the", "w2"],
+    ["w5", "w5", "w9"],  # 重复的查询词
+    ["w2", "unknown"],
+])
+def test_scores_match_bm25okapi(query):
+    corpus = make_corpus()
+    expected = rank_bm25.BM25Okapi(corpus).get_scores(query)
+    np.testing.assert_allclose(dense_scores(BM25Index.build(corpus), query), expected, rtol=1e-5, atol=1e-5)
+
+
+def test_top_k_is_sorted_by_score():
+    corpus = make_corpus()
+    query = ["w1", "w4"]
+    expected = rank_bm25.BM25Okapi(corpus).get_scores(query)
+    ids, scores = BM25Index.build(corpus).search(query, 5)
+    assert len(ids) == 5
+    assert list(scores) == sorted(scores, reverse=True)
+    np.testing.assert_allclose(scores, np.sort(expected)[::-1][:5], rtol=1e-5)
+
+
+def test_saved_index_scores_the_same(tmp_path):
+    corpus = make_corpus()
+    index = BM25Index.build(corpus)
+    index.save(str(tmp_path))
+    loaded = load_bm25(str(tmp_path), mmap=True)
+    assert isinstance(loaded.weights, np.memmap)
+    query = ["w3", "the", "w8"]
+    np.testing.assert_array_equal(dense_scores(loaded, query), dense_scores(index, query))
+
+
+def test_unknown_terms_return_nothing():
+    ids, scores = BM25Index.build(make_corpus()).search(["nope"], 5)
+    assert len(ids) == 0 and len(scores) == 0
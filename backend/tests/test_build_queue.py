@@ -0,0 +1,165 @@
+import asyncio, sqlite3, threading, time
+from app.rag.build_queue import IndexJobQueue, IndexBuildWorker, ProgressNotifier, QUEUED, RUNNING, DONE, FAILED
+
+
+def wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_enqueue_coalesces_queued_jobs(tmp_path):
+    queue = IndexJobQueue(str(tmp_path / "jobs.db"), concurrency=1, lease=60)
+    ids = {queue.enqueue("u1") for _ in range(3)}
+    assert len(ids) == 1
+    job = queue.status("u1")
+    assert job["status"] == QUEUED
+    assert job["requests"] == 3
+    assert job["position"] == 1
+
+
+def test_running_user_gets_one_followup_job(tmp_path):
+    queue = IndexJobQueue(str(tmp_path / "jobs.db"), concurrency=4, lease=60)
+    first = queue.enqueue("u1")
+    assert queue.claim("w") == (first, "u1")
+    second = queue.enqueue("u1")
+    assert second != first
+    assert queue.enqueue("u1") == second
+    # 同一用户同时最多一个任务在运行，即使并发名额还有空余
+    assert queue.claim("w") is None
+    queue.finish(first)
+    assert queue.claim("w") == (second, "u1")
+
+
+def test_concurrency_cap_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    a = IndexJobQueue(path, concurrency=2, lease=60)
+    b = IndexJobQueue(path, concurrency=2, lease=60)
+    for user in ("u1", "u2", "u3"):
+        a.enqueue(user)
+    first = a.claim("a")
+    assert first is not None
+    assert b.claim("b") is not None
+    assert a.claim("a") is None
+    assert b.claim("b") is None
+    a.finish(first[0])
+    assert b.claim("b")[1] == "u3"
+    assert a.stats()[RUNNING] == 2
+
+
+def test_expired_lease_requeues_the_job(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    dead = IndexJobQueue(path, concurrency=1, lease=0.05)
+    dead.enqueue("u1")
+    job_id, _ = dead.claim("dead")
+    time.sleep(0.1)
+
+    alive = IndexJobQueue(path, concurrency=1, lease=0.05)
+    new_id, user = alive.claim("alive")
+    assert user == "u1" and new_id != job_id
+    row = sqlite3.connect(path).execute("SELECT status, error FROM index_job WHERE id = ?", (job_id,)).fetchone()
+    assert row == (FAILED, "构建进程中断")
+
+
+def test_worker_runs_jobs_within_the_cap(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    running, peak, lock = set(), [0], threading.Lock()
+
+    def run(user_id, progress):
+        with lock:
+            running.add(user_id)
+            peak[0] = max(peak[0], len(running))
+        progress("生成嵌入", 50, {"chunks_done": 1})
+        time.sleep(0.1)
+        with lock:
+            running.discard(user_id)
+        if user_id == "bad":
+            raise RuntimeError("bad pdf")
+
+    # 两个进程（两个队列实例）各两个构建线程，全局上限为 2
+    queues = [IndexJobQueue(path, concurrency=2, lease=60) for _ in range(2)]
+    workers = [IndexBuildWorker(q, run, threads=2, poll=0.05) for q in queues]
+    for worker in workers:
+        worker.start()
+    try:
+        for user in ("u1", "u2", "u3", "u4", "bad"):
+            queues[0].enqueue(user)
+        assert wait_for(lambda: queues[0].stats()[DONE] + queues[0].stats()[FAILED] == 5)
+    finally:
+        for worker in workers:
+            worker.stop()
+
+    assert peak[0] == 2
+    assert queues[1].status("u1")["status"] == DONE
+    assert queues[1].status("u1")["percent"] == 100
+    assert queues[1].status("u1")["chunks_done"] == 1
+    failed = queues[1].status("bad")
+    assert failed["status"] == FAILED and failed["error"] == "bad pdf"
+
+
+
+def test_adds_detail_column_to_existing_table(tmp_path):
+    path = str(tmp_path / "jobs.db")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE index_job ("
+        " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, status TEXT NOT NULL,"
+        " step TEXT NOT NULL DEFAULT '', percent INTEGER NOT NULL DEFAULT 0, error TEXT,"
+        " requests INTEGER NOT NULL DEFAULT 1, worker TEXT, created_at REAL NOT NULL,"
+        " started_at REAL, heartbeat_at REAL, finished_at REAL)"
+    )
+    conn.execute("INSERT INTO index_job (user_id, status, created_at) VALUES (?, ?, ?)", ("u1", QUEUED, time.time()))
+    conn.commit()
+    conn.close()
+
+    queue = IndexJobQueue(path, concurrency=1, lease=60)
+    job_id, _ = queue.claim("w")
+    queue.progress(job_id, "生成嵌入", 40, {"pages_done": 3})
+    assert queue.status("u1")["pages_done"] == 3
+
+
+def test_notifier_wakes_waiters_and_does_not_lose_updates():
+    notifier = ProgressNotifier()
+
+    async def scenario():
+        # 读取之后、等待之前的通知：立即返回
+        seen = notifier.version("u1")
+        notifier.notify("u1")
+        assert await notifier.wait("u1", seen, timeout=5)
+
+        # 其他用户的进度不会唤醒
+        seen = notifier.version("u1")
+        notifier.notify("u2")
+        assert not await notifier.wait("u1", seen, timeout=0.05)
+
+        # 构建线程写入进度后立即唤醒，不等超时
+        seen = notifier.version("u1")
+        threading.Timer(0.05, notifier.notify, args=("u1",)).start()
+        start = time.monotonic()
+        assert await notifier.wait("u1", seen, timeout=5)
+        assert time.monotonic() - start < 1
+
+        # 任务开始或结束时通知所有等待中的用户（排队位置变化）
+        seen = notifier.version("u1")
+        threading.Timer(0.05, notifier.notify).start()
+        assert await notifier.wait("u1", seen, timeout=5)
+
+    asyncio.run(scenario())
+
+
+def test_progress_and_finish_notify_the_user(tmp_path):
+    queue = IndexJobQueue(str(tmp_path / "jobs.db"), concurrency=1, lease=60)
+    seen = queue.updates.version("u1")
+    queue.enqueue("u1")
+    assert queue.updates.version("u1") != seen
+
+    job_id, _ = queue.claim("w")
+    seen = queue.updates.version("u1")
+    queue.progress(job_id, "生成嵌入", 40, {"chunks_done": 8}, user_id="u1")
+    assert queue.updates.version("u1") != seen
+    seen = queue.updates.version("u1")
+    queue.finish(job_id)
+    assert queue.updates.version("u1") != seen
@@ -0,0 +1,93 @@
+import os
+import pytest
+from app.config import settings
+from app.rag import indexer
+from app.rag.indexer import CHECKPOINT_NAME, build_index
+from app.rag.manifest import MANIFEST_NAME
+from app.rag.versions import resolve_index_dir, staging_dir
+from conftest import fake_embeddings
+
+
+class EmbeddingOutage(Exception):
+    pass
+
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(settings, "CHUNK_SIZE", 80)
+    monkeypatch.setattr(settings, "CHUNK_OVERLAP", 10)
+    monkeypatch.setattr(settings, "BUILD_BATCH_CHUNKS", 8)
+    monkeypatch.setattr(settings, "EMBED_CONCURRENCY", 1)
+    # 续建不能依赖分块向量缓存
+    monkeypatch.setattr(settings, "CHUNK_EMBED_CACHE", False)
+
+
+def index_files(index_dir):
+    """当前版本中除清单（含版本号与时间）外的所有文件内容"""
+    path = resolve_index_dir(index_dir)
+    out = {}
+    for fn in sorted(os.listdir(path)):
+        if fn != MANIFEST_NAME:
+            with open(os.path.join(path, fn), "rb") as f:
+                out[fn] = f.read()
+    return out
+
+
+def test_failed_build_resumes_from_checkpoint(tmp_path, monkeypatch, make_pdf, offline_embeddings):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", pages=2, tag="alpha")
+    make_pdf(pdf_dir / "b.pdf", pages=2, tag="beta")
+
+    clean_dir = str(tmp_path / "clean")
+    total = build_index(str(pdf_dir), clean_dir)
+    assert total > 4 * settings.BUILD_BATCH_CHUNKS
+
+    # embedding 接口在处理到一半时故障
+    calls = 0
+
+    def flaky(texts, dimensions=None):
+        nonlocal calls
+        calls += 1
+        if calls > 2:
+            raise EmbeddingOutage("service unavailable")
+        return fake_embeddings(texts, dimensions)
+    monkeypatch.setattr(indexer, "get_embeddings", flaky)
+    index_dir = str(tmp_path / "index")
+    with pytest.raises(EmbeddingOutage):
+        build_index(str(pdf_dir), index_dir)
+    assert os.path.exists(os.path.join(staging_dir(index_dir), CHECKPOINT_NAME))
+    assert not os.path.exists(os.path.join(staging_dir(index_dir), MANIFEST_NAME))
+
+    resumed = []
+
+    def recording(texts, dimensions=None):
+        resumed.extend(texts)
+        return fake_embeddings(texts, dimensions)
+    monkeypatch.setattr(indexer, "get_embeddings", recording)
+    assert build_index(str(pdf_dir), index_dir) == total
+    # 故障前落盘的两批不再 embed
+    assert len(resumed) == total - 2 * settings.BUILD_BATCH_CHUNKS
+    assert index_files(index_dir) == index_files(clean_dir)
+
+
+def test_checkpoint_is_discarded_when_pdfs_change(tmp_path, monkeypatch, make_pdf, offline_embeddings):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", pages=2, tag="alpha")
+
+    def outage(texts, dimensions=None):
+        if any("page 1" in t for t in texts):
+            raise EmbeddingOutage("service unavailable")
+        return fake_embeddings(texts, dimensions)
+    monkeypatch.setattr(indexer, "get_embeddings", outage)
+    index_dir = str(tmp_path / "index")
+    with pytest.raises(EmbeddingOutage):
+        build_index(str(pdf_dir), index_dir)
+
+    monkeypatch.setattr(indexer, "get_embeddings", fake_embeddings)
+    make_pdf(pdf_dir / "a.pdf", pages=2, tag="delta")
+    build_index(str(pdf_dir), index_dir)
+    clean_dir = str(tmp_path / "clean")
+    build_index(str(pdf_dir), clean_dir)
+    assert index_files(index_dir) == index_files(clean_dir)
@@ -0,0 +1,65 @@
+import os, time
+import numpy as np
+from app.config import settings
+from app.rag.chunk_cache import text_hash
+from app.rag.indexer import build_index, _embed_texts
+from app.rag.versions import resolve_index_dir
+from conftest import fake_embeddings
+
+
+def test_get_many_returns_vectors_in_order(chunk_cache):
+    vectors = fake_embeddings(["a", "b"])
+    chunk_cache.put_many("m", 32, ["a", "b"], vectors)
+
+    got = chunk_cache.get_many("m", 32, ["b", "x", "a"])
+    assert got[1] is None
+    np.testing.assert_allclose(got[0], vectors[1], rtol=1e-6)
+    np.testing.assert_allclose(got[2], vectors[0], rtol=1e-6)
+    # 模型或维度不同不命中
+    assert chunk_cache.get_many("m", 64, ["a"]) == [None]
+    assert chunk_cache.get_many("other", 32, ["a"]) == [None]
+    stats = chunk_cache.stats()
+    assert stats["entries"] == 2 and stats["hits"] == 2 and stats["misses"] == 3
+
+
+def test_duplicate_texts_are_embedded_once(offline_embeddings):
+    embs = _embed_texts(["x", "y", "x", "x"])
+    assert offline_embeddings == ["x", "y"]
+    np.testing.assert_array_equal(embs[0], embs[2])
+
+    offline_embeddings.clear()
+    again = _embed_texts(["y", "x", "z"])
+    assert offline_embeddings == ["z"]
+    np.testing.assert_array_equal(again[1], embs[0])
+
+
+def test_rebuild_uses_cached_vectors(tmp_path, make_pdf, offline_embeddings):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf")
+    build_index(str(pdf_dir), str(tmp_path / "first"))
+    assert offline_embeddings
+
+    # 另一个用户上传同一本书：不再调用 embedding 接口，索引内容一致
+    offline_embeddings.clear()
+    build_index(str(pdf_dir), str(tmp_path / "second"))
+    assert offline_embeddings == []
+    first, second = (resolve_index_dir(str(tmp_path / name)) for name in ("first", "second"))
+    np.testing.assert_array_equal(np.load(os.path.join(first, "embeddings.npy")),
+                                  np.load(os.path.join(second, "embeddings.npy")))
+
+
+def test_gc_keeps_referenced_and_recent_entries(chunk_cache):
+    model, dim = settings.EMBED_MODEL, settings.EMBED_DIM
+    chunk_cache.put_many(model, dim, ["keep", "drop"], fake_embeddings(["keep", "drop"]))
+    chunk_cache.put_many("old-model", dim, ["keep"], fake_embeddings(["keep"]))
+
+    # 宽限期内一律保留
+    assert chunk_cache.gc({text_hash("keep")})["deleted"] == 0
+
+    time.sleep(0.01)
+    result = chunk_cache.gc({text_hash("keep")}, grace_seconds=0)
+    assert result["deleted"] == 2
+    assert chunk_cache.get_many(model, dim, ["keep", "drop"])[1] is None
+    assert chunk_cache.get_many(model, dim, ["keep"])[0] is not None
+    assert chunk_cache.stats()["entries"] == 1
@@ -0,0 +1,192 @@
+import os, uuid
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from app.auth import create_token
+from app import models
+from app.config import settings
+from app.db import SessionLocal
+from app.main import app
+from app.rag import build_queue, doc_store
+from app.rag.build_queue import IndexJobQueue, get_index_queue
+from app.rag.indexer import build_index, update_index
+from app.rag.registry import index_registry
+from app.rag.versions import index_exists
+from app.routers import upload_api
+from app.routers.chat_api import get_document_retrievers, get_user_retriever
+from scripts import migrate_user_docs
+from conftest import fake_embeddings
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # 构建由测试直接调用 build_index_for_user，不启动后台构建线程；排队的任务留在本测试自己的队列里
+    monkeypatch.setattr(settings, "INDEX_WORKER_IN_PROCESS", False)
+    monkeypatch.setattr(build_queue, "_queue", IndexJobQueue(str(tmp_path / "jobs.db"), concurrency=1, lease=60))
+    with TestClient(app) as client:
+        yield client
+
+
+def upload(client, user_id, filename, data):
+    r = client.post("/api/upload-pdf", data={"token": create_token(user_id)},
+                    files={"file": (filename, data, "application/pdf")})
+    assert r.status_code == 200
+    return r.json()
+
+
+def no_progress(step, percent, detail=None):
+    pass
+
+
+def test_same_file_is_stored_and_indexed_once(client, tmp_path, make_pdf, offline_embeddings):
+    data = make_pdf(tmp_path / "book.pdf", tag="shared").read_bytes()
+    alice, bob = str(uuid.uuid4()), str(uuid.uuid4())
+
+    first = upload(client, alice, "book.pdf", data)
+    assert first["deduplicated"] is False
+    upload_api.build_index_for_user(alice, no_progress)
+    assert offline_embeddings
+
+    offline_embeddings.clear()
+    second = upload(client, bob, "copy.pdf", data)
+    assert second["deduplicated"] is True and second["sha256"] == first["sha256"]
+    # 分片已经建好：不排队
+    assert second["job_id"] is None and get_index_queue().status(bob) is None
+    upload_api.build_index_for_user(bob, no_progress)
+    assert offline_embeddings == []
+    # 重复上传的临时文件被丢弃，文档库里只有一份
+    assert os.listdir(os.path.join(doc_store.store_root(), "tmp")) == []
+
+    # 两个用户共享同一个分片检索器，命中按各自的文件名显示
+    qv = np.asarray(fake_embeddings(["shared page 0 line 0"]), dtype=np.float32)
+    (a_view,), (b_view,) = get_document_retrievers(alice), get_document_retrievers(bob)
+    assert a_view.retriever is b_view.retriever
+    assert {h["book"] for h in a_view.search_vector("", qv)} == {"book.pdf"}
+    assert {h["book"] for h in b_view.search_vector("", qv)} == {"copy.pdf"}
+
+    # 删除只去掉引用，不需要重建
+    r = client.delete("/api/pdfs/copy.pdf", params={"token": create_token(bob)})
+    assert r.status_code == 200 and "job_id" not in r.json()
+    assert get_document_retrievers(bob) == []
+    assert len(get_document_retrievers(alice)) == 1
+    assert os.path.exists(doc_store.document_pdf(first["sha256"]))
+
+
+def legacy_user(tmp_path, make_pdf, tag):
+    """旧版布局：DATA_DIR/<uid>/pdfs 与私有索引"""
+    user_id = str(uuid.uuid4())
+    user_dir = os.path.join(settings.DATA_DIR, user_id)
+    pdf_dir = os.path.join(user_dir, "pdfs")
+    os.makedirs(pdf_dir)
+    make_pdf(os.path.join(pdf_dir, "notes.pdf"), tag=tag)
+    build_index(pdf_dir, os.path.join(user_dir, "index"))
+    return user_id, user_dir
+
+
+def test_migrate_user_docs_moves_legacy_folder(client, tmp_path, make_pdf):
+    user_id, user_dir = legacy_user(tmp_path, make_pdf, "legacy")
+
+    migrate_user_docs.main()
+    assert get_index_queue().status(user_id)["status"] == "queued"
+
+    upload_api.build_index_for_user(user_id, no_progress)
+    assert not os.path.exists(os.path.join(user_dir, "pdfs"))
+    assert not index_exists(upload_api.legacy_index_dir(user_id))
+    (view,) = get_document_retrievers(user_id)
+    assert view.filename == "notes.pdf"
+    r = client.get("/api/pdfs", params={"token": create_token(user_id)})
+    assert [p["name"] for p in r.json() if p["source"] == "user"] == ["notes.pdf"]
+
+
+def test_legacy_index_is_kept_until_shards_are_built(client, tmp_path, make_pdf, monkeypatch):
+    user_id, user_dir = legacy_user(tmp_path, make_pdf, "pending")
+
+    def failing_build(sha256, progress=None):
+        raise RuntimeError("embedding service unavailable")
+    monkeypatch.setattr(upload_api, "build_shard", failing_build)
+    with pytest.raises(RuntimeError):
+        upload_api.build_index_for_user(user_id, no_progress)
+
+    # PDF 已导入文档库，但分片没有建好：检索仍使用旧的私有索引
+    assert not os.path.exists(os.path.join(user_dir, "pdfs"))
+    assert get_user_retriever(user_id) is not None
+
+    # 迁移脚本会重新排队只剩旧索引的用户
+    migrate_user_docs.main()
+    assert get_index_queue().status(user_id)["status"] == "queued"
+
+    monkeypatch.setattr(upload_api, "build_shard", doc_store.build_shard)
+    upload_api.build_index_for_user(user_id, no_progress)
+    assert not index_exists(upload_api.legacy_index_dir(user_id))
+    assert len(get_document_retrievers(user_id)) == 1
+
+
+def catalog(sha256):
+    with SessionLocal() as db:
+        return db.get(models.Document, sha256)
+
+
+def listed(client, user_id, source):
+    r = client.get("/api/pdfs", params={"token": create_token(user_id)})
+    assert r.status_code == 200
+    return {p["name"]: p for p in r.json() if p["source"] == source}
+
+
+def test_catalog_status_follows_the_build(client, tmp_path, make_pdf, monkeypatch):
+    user_id = str(uuid.uuid4())
+    sha256 = upload(client, user_id, "notes.pdf", make_pdf(tmp_path / "notes.pdf", tag="status").read_bytes())["sha256"]
+    doc = catalog(sha256)
+    assert doc.status == models.Document.PENDING and doc.pages == 2 and doc.chunks is None
+
+    seen = []
+
+    def failing_build(sha256, progress=None):
+        seen.append(catalog(sha256).status)
+        raise RuntimeError("embedding service unavailable")
+    monkeypatch.setattr(upload_api, "build_shard", failing_build)
+    with pytest.raises(RuntimeError):
+        upload_api.build_index_for_user(user_id, no_progress)
+    assert seen == [models.Document.INDEXING]
+    doc = catalog(sha256)
+    assert doc.status == models.Document.FAILED and "embedding service unavailable" in doc.error
+    assert listed(client, user_id, "user")["notes.pdf"]["status"] == models.Document.FAILED
+
+    # 下一个任务重试失败的文档
+    monkeypatch.setattr(upload_api, "build_shard", doc_store.build_shard)
+    upload_api.build_index_for_user(user_id, no_progress)
+    doc = catalog(sha256)
+    assert doc.status == models.Document.READY and doc.error is None
+    assert doc.chunks > 0 and doc.index_version
+    entry = listed(client, user_id, "user")["notes.pdf"]
+    assert (entry["status"], entry["chunks"], entry["pages"]) == (models.Document.READY, doc.chunks, 2)
+
+
+def test_global_documents_are_listed_from_the_catalog(client, tmp_path, make_pdf, monkeypatch):
+    pdf_dir, index_dir = tmp_path / "global", str(tmp_path / "global_index")
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "textbook.pdf", pages=3, tag="textbook")
+    make_pdf(pdf_dir / "handout.pdf", tag="handout")
+    build_index(str(pdf_dir), index_dir)
+    assert upload_api.register_global_documents(index_dir, str(pdf_dir)) == 2
+
+    def no_index(index_dir):
+        raise AssertionError("list_global_pdfs loaded the global index")
+    user_id = str(uuid.uuid4())
+    # 列表不加载全局索引，也不扫描 PDF_DIR
+    with monkeypatch.context() as m:
+        m.setattr(index_registry, "get", no_index)
+        m.setattr(upload_api.os, "listdir", lambda path: [])
+        docs = listed(client, user_id, "global")
+    assert docs["textbook.pdf"]["pages"] == 3 and docs["textbook.pdf"]["status"] == models.Document.READY
+    assert "handout.pdf" in docs
+
+    # 全局文档没有文档库分片：用户上传同一文件时照常排队构建
+    r = upload(client, user_id, "mine.pdf", (pdf_dir / "handout.pdf").read_bytes())
+    assert r["job_id"] is not None
+    assert catalog(r["sha256"]).global_name == "handout.pdf"
+
+    os.remove(pdf_dir / "textbook.pdf")
+    update_index(str(pdf_dir), index_dir)
+    upload_api.register_global_documents(index_dir, str(pdf_dir))
+    docs = listed(client, user_id, "global")
+    assert "textbook.pdf" not in docs and "handout.pdf" in docs
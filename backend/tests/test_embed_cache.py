@@ -0,0 +1,38 @@
+import asyncio
+import numpy as np
+from app.rag.embed_cache import QueryEmbeddingCache, normalize_query
+
+
+def open_cache(path):
+    return QueryEmbeddingCache(str(path), memory_entries=2, max_entries=100, ttl_seconds=3600)
+
+
+def test_queries_are_normalized():
+    assert normalize_query("  什么是\u3000进程  Scheduling ") == normalize_query("什么是 进程 scheduling")
+
+
+def test_sync_put_and_get(tmp_path):
+    cache = open_cache(tmp_path / "q.db")
+    assert cache.get("m", "进程") is None
+    cache.put("m", "进程", [1.0, 2.0])
+    np.testing.assert_array_equal(cache.get("m", " 进程 "), [1.0, 2.0])
+    assert cache.get("other-model", "进程") is None
+
+
+def test_async_path_reads_and_writes_sqlite_in_background(tmp_path):
+    path = tmp_path / "q.db"
+    cache = open_cache(path)
+
+    async def run():
+        assert await cache.aget("m", "进程") is None
+        cache.aput("m", "进程", [1.0, 2.0])
+        # 内存层立即可见
+        return await cache.aget("m", "进程")
+
+    np.testing.assert_array_equal(asyncio.run(run()), [1.0, 2.0])
+    cache._writer.submit(lambda: None).result()  # 等后台写线程完成
+
+    # 另一个进程（新实例）从 SQLite 读到
+    other = open_cache(path)
+    np.testing.assert_array_equal(asyncio.run(other.aget("m", "进程")), [1.0, 2.0])
+    assert other.stats()["disk_hits"] == 1
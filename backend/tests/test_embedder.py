@@ -0,0 +1,144 @@
+import threading, time
+from types import SimpleNamespace
+import pytest
+from openai import APIConnectionError
+from app.rag import embedder
+from app.rag.embedder import BatchEmbedder
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = SimpleNamespace(headers=headers or {})
+
+
+def vec(text):
+    return [float(len(text)), float(ord(text[-1]))]
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """记录退避等待时长而不真的等待；抖动取上限，便于断言"""
+    delays = []
+    monkeypatch.setattr(embedder.time, "sleep", delays.append)
+    monkeypatch.setattr(embedder.random, "uniform", lambda low, high: high)
+    return delays
+
+
+def test_results_keep_input_order_under_concurrency():
+    texts = [f"text-{i}" for i in range(23)]
+    seen = []
+
+    def embed_fn(batch):
+        # 后提交的批次先返回
+        time.sleep(0.02 if batch[0] == "text-0" else 0)
+        return [vec(t) for t in batch]
+
+    result = BatchEmbedder(embed_fn, batch_size=4, concurrency=3).embed(
+        texts, on_batch=lambda batch, vectors: seen.extend(batch))
+    assert result == [vec(t) for t in texts]
+    assert sorted(seen) == sorted(texts)
+
+
+def test_concurrency_is_bounded():
+    active, peak = 0, 0
+    lock = threading.Lock()
+
+    def embed_fn(batch):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.01)
+        with lock:
+            active -= 1
+        return [vec(t) for t in batch]
+
+    BatchEmbedder(embed_fn, batch_size=1, concurrency=2).embed([f"t{i}" for i in range(10)])
+    assert peak == 2
+
+
+def test_transient_errors_are_retried_with_backoff(sleeps):
+    failures = [StatusError(503), APIConnectionError(request=None), StatusError(408)]
+    calls = []
+
+    def embed_fn(batch):
+        calls.append(list(batch))
+        if failures:
+            raise failures.pop(0)
+        return [vec(t) for t in batch]
+
+    e = BatchEmbedder(embed_fn, batch_size=10, concurrency=1, backoff_base=0.5, backoff_max=1.5)
+    assert e.embed(["a", "b"]) == [vec("a"), vec("b")]
+    assert len(calls) == 4
+    # 指数增长，封顶 backoff_max
+    assert sleeps == [0.5, 1.0, 1.5]
+
+
+def test_retry_after_is_honoured_on_429(sleeps):
+    failures = [StatusError(429, {"retry-after": "7"})]
+
+    def embed_fn(batch):
+        if failures:
+            raise failures.pop(0)
+        return [vec(t) for t in batch]
+
+    BatchEmbedder(embed_fn, batch_size=10, concurrency=1).embed(["a"])
+    assert sleeps == [7.0]
+
+
+def test_gives_up_after_max_retries(sleeps):
+    calls = []
+
+    def embed_fn(batch):
+        calls.append(batch)
+        raise StatusError(500)
+
+    with pytest.raises(StatusError):
+        BatchEmbedder(embed_fn, batch_size=10, concurrency=1, max_retries=3).embed(["a"])
+    assert len(calls) == 4 and len(sleeps) == 3
+
+
+def test_non_retryable_errors_fail_fast(sleeps):
+    calls = []
+
+    def embed_fn(batch):
+        calls.append(batch)
+        raise StatusError(401)
+
+    with pytest.raises(StatusError):
+        BatchEmbedder(embed_fn, batch_size=10, concurrency=1).embed(["a", "b"])
+    assert len(calls) == 1 and sleeps == []
+
+
+def test_rejected_batches_are_split(sleeps):
+    sizes = []
+
+    def embed_fn(batch):
+        sizes.append(len(batch))
+        if len(batch) > 2:
+            raise StatusError(400)
+        return [vec(t) for t in batch]
+
+    texts = [f"t{i}" for i in range(11)]
+    e = BatchEmbedder(embed_fn, batch_size=8, concurrency=1)
+    assert e.embed(texts) == [vec(t) for t in texts]
+    # 8 -> 4 -> 2，之后的批次直接按 2 提交
+    assert e.batch_size == 2
+    assert sizes[:3] == [8, 4, 2]
+    assert max(sizes[7:]) <= 2
+    assert sleeps == []
+
+
+def test_single_rejected_text_raises():
+    def embed_fn(batch):
+        raise StatusError(413)
+
+    with pytest.raises(StatusError):
+        BatchEmbedder(embed_fn, batch_size=4, concurrency=1).embed(["a"])
+
+
+def test_wrong_vector_count_raises():
+    with pytest.raises(RuntimeError):
+        BatchEmbedder(lambda batch: [vec("x")], batch_size=4, concurrency=1).embed(["a", "b"])
@@ -0,0 +1,136 @@
+import os
+import numpy as np
+import pytest
+from app.config import settings
+from app.rag.indexer import build_index, update_index
+from app.rag.manifest import read_manifest, live_rows
+from app.rag.metastore import MetaStore
+from app.rag.retriever import Retriever
+from app.rag.versions import resolve_index_dir
+from conftest import fake_embeddings
+
+INDEX_CONFIGS = [
+    ("flat", "none"),
+    ("hnsw", "none"),
+    ("ivf", "none"),
+    ("flat", "int8"),
+    ("flat", "binary"),
+]
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # 小分块让每个文档有几十个向量，IVF 有足够样本训练
+    monkeypatch.setattr(settings, "CHUNK_SIZE", 80)
+    monkeypatch.setattr(settings, "CHUNK_OVERLAP", 10)
+
+
+def live_chunks(index_dir):
+    """当前版本中有效分块的 (文件名, 页码, 文本) 集合"""
+    path = resolve_index_dir(index_dir)
+    metas = MetaStore(path)
+    live = live_rows(read_manifest(path)["documents"], len(metas))
+    return {(m["book"], m["page"], m["text"]) for m in (metas.get(i) for i in np.flatnonzero(live).tolist())}
+
+
+def search_own_text(index_dir, text):
+    r = Retriever(index_dir, top_k=5)
+    r.load()
+    qv = np.array(fake_embeddings([text]), dtype="float32")
+    # 查询文本为空：只看向量检索结果
+    return r.search_vector("", qv)
+
+
+@pytest.mark.parametrize("index_type,quant", INDEX_CONFIGS)
+def test_update_adds_and_removes_documents(tmp_path, monkeypatch, make_pdf, offline_embeddings, index_type, quant):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", index_type)
+    monkeypatch.setattr(settings, "VECTOR_QUANT", quant)
+    # 不压实：删除的文档留作墓碑，检验 remove_ids / 查询过滤
+    monkeypatch.setattr(settings, "INDEX_COMPACT_RATIO", 0.9)
+    pdf_dir, index_dir = tmp_path / "pdfs", str(tmp_path / "index")
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", pages=3, tag="alpha")
+    make_pdf(pdf_dir / "b.pdf", pages=3, tag="beta")
+    build_index(str(pdf_dir), index_dir)
+    assert read_manifest(resolve_index_dir(index_dir))["faiss"]["type"] == ("flat" if quant == "binary" else index_type)
+
+    offline_embeddings.clear()
+    make_pdf(pdf_dir / "c.pdf", pages=2, tag="gamma")
+    update_index(str(pdf_dir), index_dir)
+    # 只 embed 新增文档的分块
+    assert offline_embeddings and all("gamma" in t for t in offline_embeddings)
+
+    os.remove(pdf_dir / "a.pdf")
+    offline_embeddings.clear()
+    chunks = update_index(str(pdf_dir), index_dir)
+    assert offline_embeddings == []
+
+    manifest = read_manifest(resolve_index_dir(index_dir))
+    assert sorted(manifest["documents"]) == ["b.pdf", "c.pdf"]
+    assert manifest["deleted"] > 0 and manifest["chunks"] == chunks
+
+    full_dir = str(tmp_path / "full")
+    assert build_index(str(pdf_dir), full_dir) == chunks
+    expected = live_chunks(full_dir)
+    assert live_chunks(index_dir) == expected
+
+    for book, page, text in sorted(expected)[::7]:
+        hits = search_own_text(index_dir, text)
+        assert (hits[0]["book"], hits[0]["text"]) == (book, text)
+        assert all(h["book"] != "a.pdf" for h in hits)
+    # 删除文档的分块查不到
+    alpha_text = "alpha page 0 line 0 scheduling memory alpha-0-0"
+    assert all(h["book"] != "a.pdf" for h in search_own_text(index_dir, alpha_text))
+
+
+@pytest.mark.parametrize("index_type,quant", INDEX_CONFIGS)
+def test_update_compacts_tombstones(tmp_path, monkeypatch, make_pdf, index_type, quant):
+    monkeypatch.setattr(settings, "FAISS_INDEX_TYPE", index_type)
+    monkeypatch.setattr(settings, "VECTOR_QUANT", quant)
+    monkeypatch.setattr(settings, "INDEX_COMPACT_RATIO", 0.0)
+    pdf_dir, index_dir = tmp_path / "pdfs", str(tmp_path / "index")
+    pdf_dir.mkdir()
+    for tag in ("alpha", "beta", "gamma"):
+        make_pdf(pdf_dir / f"{tag}.pdf", pages=2, tag=tag)
+    build_index(str(pdf_dir), index_dir)
+
+    os.remove(pdf_dir / "beta.pdf")
+    update_index(str(pdf_dir), index_dir)
+
+    manifest = read_manifest(resolve_index_dir(index_dir))
+    assert manifest["deleted"] == 0 and manifest["rows"] == manifest["chunks"]
+    assert manifest["faiss"]["stale"] == 0
+    full_dir = str(tmp_path / "full")
+    build_index(str(pdf_dir), full_dir)
+    assert live_chunks(index_dir) == live_chunks(full_dir)
+    for book, page, text in sorted(live_chunks(index_dir))[::9]:
+        hits = search_own_text(index_dir, text)
+        assert (hits[0]["book"], hits[0]["text"]) == (book, text)
+
+
+def test_changed_document_is_reembedded(tmp_path, make_pdf, offline_embeddings):
+    pdf_dir, index_dir = tmp_path / "pdfs", str(tmp_path / "index")
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", tag="alpha")
+    make_pdf(pdf_dir / "b.pdf", tag="beta")
+    build_index(str(pdf_dir), index_dir)
+
+    offline_embeddings.clear()
+    assert update_index(str(pdf_dir), index_dir) == read_manifest(resolve_index_dir(index_dir))["chunks"]
+    assert offline_embeddings == []
+
+    make_pdf(pdf_dir / "a.pdf", tag="delta")
+    update_index(str(pdf_dir), index_dir)
+    assert offline_embeddings and all("delta" in t for t in offline_embeddings)
+    assert not any("alpha" in t for _, _, t in live_chunks(index_dir))
+
+
+def test_removing_every_document_removes_index(tmp_path, make_pdf):
+    pdf_dir, index_dir = tmp_path / "pdfs", str(tmp_path / "index")
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf")
+    build_index(str(pdf_dir), index_dir)
+
+    os.remove(pdf_dir / "a.pdf")
+    assert update_index(str(pdf_dir), index_dir) == 0
+    assert not os.path.exists(index_dir)
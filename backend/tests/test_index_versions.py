@@ -0,0 +1,154 @@
+import os, time
+import numpy as np
+import pytest
+from app.config import settings
+from app.rag import versions
+from app.rag.indexer import build_index, update_index
+from app.rag.manifest import read_manifest
+from app.rag.registry import IndexRegistry, IndexUnavailable, RetrieverCache
+from app.rag.retriever import Retriever
+from conftest import fake_embeddings
+
+
+def wait_for(condition, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def query_vector(text: str) -> np.ndarray:
+    return np.asarray(fake_embeddings([text]), dtype=np.float32)
+
+
+def documents(retriever: Retriever) -> dict:
+    """检索器加载的版本中的文档表"""
+    return read_manifest(versions.version_dir(retriever.index_dir, retriever.pointer))["documents"]
+
+
+@pytest.fixture
+def library(tmp_path, make_pdf):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", tag="alpha")
+    return str(pdf_dir), str(tmp_path / "index")
+
+
+def test_publish_switches_pointer_and_prunes_old_versions(library, make_pdf, monkeypatch):
+    pdf_dir, index_dir = library
+    monkeypatch.setattr(settings, "INDEX_KEEP_VERSIONS", 2)
+    build_index(pdf_dir, index_dir)
+    first = versions.current_version(index_dir)
+    assert first and versions.resolve_index_dir(index_dir) == os.path.join(index_dir, "versions", first)
+    assert not os.path.exists(versions.staging_dir(index_dir))
+
+    published = [first]
+    for i in range(3):
+        time.sleep(0.01)  # 版本按目录修改时间排序
+        make_pdf(os.path.join(pdf_dir, f"b{i}.pdf"), tag=f"beta{i}")
+        update_index(pdf_dir, index_dir)
+        published.append(versions.current_version(index_dir))
+
+    assert len(set(published)) == 4
+    kept = sorted(os.listdir(os.path.join(index_dir, "versions")))
+    assert kept == sorted(published[-2:])
+    assert versions.index_exists(index_dir)
+
+
+def test_incremental_update_does_not_touch_published_version(library, make_pdf):
+    pdf_dir, index_dir = library
+    build_index(pdf_dir, index_dir)
+    old = Retriever(index_dir, top_k=3)
+    old.load()
+    old_files = {name: os.stat(os.path.join(versions.resolve_index_dir(index_dir), name)).st_size
+                 for name in os.listdir(versions.resolve_index_dir(index_dir))}
+
+    make_pdf(os.path.join(pdf_dir, "b.pdf"), tag="beta")
+    update_index(pdf_dir, index_dir)
+
+    old_dir = versions.version_dir(index_dir, old.pointer)
+    for name, size in old_files.items():
+        if name != "meta_text.bin":  # 只在末尾追加，旧版本只读偏移表范围内的字节
+            assert os.stat(os.path.join(old_dir, name)).st_size == size
+    # 旧实例照常检索，只看到旧版本的文档
+    hits = old.search_vector("alpha", query_vector("alpha page 0"))
+    assert hits and {h["book"] for h in hits} == {"a.pdf"}
+
+
+def test_publish_replaces_flat_layout(library):
+    pdf_dir, index_dir = library
+    os.makedirs(index_dir)
+    with open(os.path.join(index_dir, "faiss.index"), "wb") as f:
+        f.write(b"old")
+    build_index(pdf_dir, index_dir)
+    assert sorted(os.listdir(index_dir)) == ["CURRENT", "versions"]
+
+
+def test_registry_swaps_in_new_version_in_background(library, make_pdf, monkeypatch):
+    pdf_dir, index_dir = library
+    monkeypatch.setattr(settings, "INDEX_RELOAD_INTERVAL", 0)
+    build_index(pdf_dir, index_dir)
+    registry = IndexRegistry(top_k=3)
+    old = registry.get(index_dir)
+    assert registry.get(index_dir) is old
+
+    make_pdf(os.path.join(pdf_dir, "b.pdf"), tag="beta")
+    update_index(pdf_dir, index_dir)
+    # 发布后的第一次请求仍拿到旧实例，新版本在后台加载完成后替换
+    assert registry.get(index_dir) is old
+    assert wait_for(lambda: registry.get(index_dir) is not old)
+    new = registry.get(index_dir)
+    assert new.pointer == versions.current_version(index_dir) != old.pointer
+    assert "b.pdf" in documents(new) and "b.pdf" not in documents(old)
+    assert registry.reloads == 1
+    assert old.search_vector("alpha", query_vector("alpha page 1"))
+
+
+def test_registry_remembers_missing_index_until_published(library, monkeypatch):
+    pdf_dir, index_dir = library
+    monkeypatch.setattr(settings, "INDEX_RELOAD_INTERVAL", 0)
+    registry = IndexRegistry(top_k=3)
+    loads = []
+    load = registry._load
+    monkeypatch.setattr(registry, "_load", lambda d: loads.append(d) or load(d))
+
+    for _ in range(3):
+        with pytest.raises(IndexUnavailable):
+            registry.get(index_dir)
+    assert len(loads) == 1
+
+    build_index(pdf_dir, index_dir)
+    assert registry.get(index_dir).pointer == versions.current_version(index_dir)
+    assert len(loads) == 2
+
+
+def test_retriever_cache_reloads_and_drops_deleted_index(library, make_pdf, monkeypatch):
+    pdf_dir, index_dir = library
+    monkeypatch.setattr(settings, "INDEX_RELOAD_INTERVAL", 0)
+    build_index(pdf_dir, index_dir)
+
+    def loader():
+        if not versions.index_exists(index_dir):
+            return None
+        retriever = Retriever(index_dir, top_k=3)
+        retriever.load()
+        return retriever
+
+    cache = RetrieverCache(max_bytes=1 << 30, max_entries=16)
+    old = cache.get("u1", loader)
+    make_pdf(os.path.join(pdf_dir, "b.pdf"), tag="beta")
+    update_index(pdf_dir, index_dir)
+    assert cache.get("u1", loader) is old
+    assert wait_for(lambda: cache.get("u1", loader) is not old)
+    assert cache.stats()["reloads"] == 1
+
+    # 删除全部文档后索引目录被移除，后台加载返回 None，条目从缓存中去掉
+    for name in os.listdir(pdf_dir):
+        os.remove(os.path.join(pdf_dir, name))
+    update_index(pdf_dir, index_dir)
+    assert not versions.index_exists(index_dir)
+    cache.get("u1", loader)
+    assert wait_for(lambda: cache.stats()["entries"] == 0)
+    assert cache.get("u1", loader) is None
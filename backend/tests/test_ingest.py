@@ -0,0 +1,45 @@
+from app.rag import ingest
+from app.rag.ingest import iter_corpus_chunks
+
+
+def test_process_pool_matches_sequential_extraction(tmp_path, monkeypatch, make_pdf):
+    # 小任务粒度：一本书拆成多个页段任务，在途任务数达到上限
+    monkeypatch.setattr(ingest, "PAGES_PER_TASK", 3)
+    make_pdf(tmp_path / "a.pdf", pages=10, tag="alpha")
+    make_pdf(tmp_path / "b.pdf", pages=2, tag="beta")
+    filenames = ["a.pdf", "b.pdf"]
+
+    sequential = list(iter_corpus_chunks(str(tmp_path), filenames, 120, 20, workers=1))
+    parallel = list(iter_corpus_chunks(str(tmp_path), filenames, 120, 20, workers=2))
+    assert parallel == sequential
+    assert [c[:3] for c in sequential] == sorted(c[:3] for c in sequential)
+    assert {c[1] for c in sequential if c[0] == "a.pdf"} == set(range(1, 11))
+
+
+def test_extraction_cache_skips_parsing(tmp_path, monkeypatch, make_pdf, extract_cache):
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", pages=3, tag="alpha")
+    cold = list(iter_corpus_chunks(str(pdf_dir), ["a.pdf"], 120, 20, workers=1, cache=extract_cache))
+    assert extract_cache.stats()["files"] == 1 and extract_cache.misses == 1
+
+    # 同一文件换个名字放到另一个目录：只计算哈希，不再打开 PDF
+    other = tmp_path / "other"
+    other.mkdir()
+    (other / "copy.pdf").write_bytes((pdf_dir / "a.pdf").read_bytes())
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError("cached PDF was parsed")
+    monkeypatch.setattr(ingest.fitz, "open", no_parsing)
+    warm = list(iter_corpus_chunks(str(other), ["copy.pdf"], 120, 20, workers=2, cache=extract_cache))
+    assert [c[1:] for c in warm] == [c[1:] for c in cold]
+    assert extract_cache.hits == 1
+
+
+def test_extraction_cache_ignores_other_extractors(tmp_path, monkeypatch, make_pdf, extract_cache):
+    make_pdf(tmp_path / "a.pdf", pages=2)
+    list(iter_corpus_chunks(str(tmp_path), ["a.pdf"], 120, 20, workers=1, cache=extract_cache))
+
+    from app.rag import extract_cache as module
+    monkeypatch.setattr(module, "EXTRACTOR", "pymupdf-0.0-text")
+    assert extract_cache.get(module.file_digest(str(tmp_path / "a.pdf"))) is None
@@ -0,0 +1,98 @@
+import json, threading, time, uuid
+from fastapi.testclient import TestClient
+from app.auth import create_token
+from app.config import settings
+from app.main import app
+from app.rag import indexer
+from app.rag import build_queue
+from app.rag.build_queue import IndexJobQueue
+from app.rag.indexer import build_index
+from app.rag.progress import BuildProgress
+from conftest import fake_embeddings
+
+
+def test_embedded_reports_progress_inside_a_batch():
+    reports = []
+    tracker = BuildProgress(lambda step, percent, detail: reports.append((percent, detail)), {"a.pdf": 4, "b.pdf": 4})
+    tracker.start()
+    batch = [("a.pdf", 1, 0, "x"), ("a.pdf", 3, 0, "y"), ("b.pdf", 1, 0, "z"), ("b.pdf", 3, 0, "w")]
+
+    tracker.embedded("生成嵌入", batch, 2)
+    assert reports[-1][1]["chunks_done"] == 2 and reports[-1][1]["pages_done"] == 3
+    # 批内的汇报不计入已落盘的分块数，落盘后由 batch() 校正
+    assert tracker.chunks_done == 0
+    tracker.batch("生成嵌入", len(batch), "b.pdf", 3)
+    assert reports[-1][1]["chunks_done"] == 4 and reports[-1][1]["pages_done"] == 7
+    assert [p for p, _ in reports] == sorted(p for p, _ in reports)
+
+
+def test_build_reports_after_every_embedding_call(tmp_path, make_pdf, monkeypatch):
+    monkeypatch.setattr(settings, "BUILD_BATCH_CHUNKS", 10_000)
+    monkeypatch.setattr(settings, "CHUNK_SIZE", 80)
+    monkeypatch.setattr(settings, "CHUNK_OVERLAP", 10)
+    monkeypatch.setattr(settings, "EMBED_BATCH_SIZE", 4)
+    monkeypatch.setattr(settings, "EMBED_CONCURRENCY", 1)
+    calls = []
+
+    def get_embeddings(texts, dimensions=None):
+        calls.append(len(texts))
+        return fake_embeddings(texts, dimensions)
+    monkeypatch.setattr(indexer, "get_embeddings", get_embeddings)
+
+    pdf_dir = tmp_path / "pdfs"
+    pdf_dir.mkdir()
+    make_pdf(pdf_dir / "a.pdf", pages=3)
+    reports = []
+    build_index(str(pdf_dir), str(tmp_path / "index"), lambda step, percent, detail=None: reports.append(
+        (step, detail["chunks_done"] if detail else None)))
+
+    # 只有一个落盘批次，但每次 embedding 调用返回后都有一条进度
+    embedding = [chunks for step, chunks in reports if step == "生成嵌入"]
+    assert len(calls) > 2 and len(embedding) >= len(calls)
+    assert embedding == sorted(embedding) and embedding[0] < embedding[-1]
+
+
+def read_events(response):
+    events = []
+    for line in response.iter_lines():
+        if line.startswith("data: "):
+            events.append(json.loads(line[len("data: "):]))
+    return events
+
+
+def test_stream_pushes_progress_as_the_builder_reports(tmp_path, monkeypatch):
+    # 轮询间隔设得很长：事件必须由构建线程的通知触发
+    monkeypatch.setattr(settings, "INDEX_PROGRESS_INTERVAL", 30)
+    monkeypatch.setattr(settings, "INDEX_WORKER_IN_PROCESS", False)
+    # 独立的队列，不受其他测试留下的任务与并发上限影响
+    queue = IndexJobQueue(str(tmp_path / "jobs.db"), concurrency=1, lease=60)
+    monkeypatch.setattr(build_queue, "_queue", queue)
+    user_id = str(uuid.uuid4())
+    queue.enqueue(user_id)
+
+    def builder():
+        time.sleep(0.2)
+        job_id, claimed = queue.claim("test")
+        assert claimed == user_id
+        for done in (10, 20, 30):
+            time.sleep(0.05)
+            queue.progress(job_id, "生成嵌入", 10 + done, {"chunks_done": done}, user_id=user_id)
+        queue.finish(job_id)
+
+    start = time.monotonic()
+    with TestClient(app) as client:
+        thread = threading.Thread(target=builder)
+        thread.start()
+        with client.stream("GET", "/api/index-progress/stream", params={"token": create_token(user_id)}) as r:
+            assert r.status_code == 200
+            assert r.headers["content-type"].startswith("text/event-stream")
+            events = read_events(r)
+        thread.join()
+    assert time.monotonic() - start < 10
+
+    assert events[0]["status"] == "queued"
+    assert events[-1]["status"] == "done" and events[-1]["percent"] == 100
+    # 通知可能合并，但进度只增不减，结束事件带着最后一次汇报的数据
+    assert any(e["status"] == "running" for e in events)
+    chunks = [e["chunks_done"] for e in events if "chunks_done" in e]
+    assert chunks == sorted(chunks) and chunks[-1] == 30
@@ -0,0 +1,26 @@
+from app.rag.result_cache import ResultCache
+
+
+def test_key_ignores_query_formatting_and_version_order():
+    a = ResultCache.make_key(" 进程  调度 ", 6, [("/g", "v1"), ("/u", "v2")])
+    b = ResultCache.make_key("进程 调度", 6, [("/u", "v2"), ("/g", "v1")])
+    assert a == b
+    assert a != ResultCache.make_key("进程 调度", 6, [("/u", "v3"), ("/g", "v1")])
+
+
+def test_lru_and_hit_counters():
+    cache = ResultCache(max_entries=2)
+    cache.put("a", [{"text": "a"}])
+    cache.put("b", [{"text": "b"}])
+    assert cache.get("a") == [{"text": "a"}]
+    cache.put("c", [{"text": "c"}])
+    assert cache.get("b") is None
+    assert cache.stats()["entries"] == 2
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_empty_results_are_not_cached():
+    cache = ResultCache(max_entries=10)
+    cache.put("q", [])
+    assert cache.get("q") is None
+    assert cache.stats()["entries"] == 0
@@ -0,0 +1,58 @@
+from app.rag.registry import RetrieverCache
+
+
+class FakeRetriever:
+    def __init__(self, nbytes: int):
+        self.nbytes = nbytes
+
+    def is_stale(self) -> bool:
+        return False
+
+
+def loader(nbytes: int, loads: list = None):
+    def load():
+        if loads is not None:
+            loads.append(nbytes)
+        return FakeRetriever(nbytes)
+    return load
+
+
+def test_evicts_least_recently_used_over_byte_budget():
+    cache = RetrieverCache(max_bytes=300, max_entries=100)
+    a = cache.get("a", loader(100))
+    cache.get("b", loader(100))
+    cache.get("c", loader(100))
+    assert cache.get("a", loader(100)) is a  # a 变为最近使用
+    cache.get("d", loader(100))
+
+    stats = cache.stats()
+    assert stats["entries"] == 3 and stats["resident_bytes"] == 300
+    assert stats["evictions"] == 1
+    loads = []
+    cache.get("b", loader(100, loads))
+    assert loads == [100]  # b 被淘汰，重新加载
+
+
+def test_entry_cap_applies_when_entries_report_few_bytes():
+    cache = RetrieverCache(max_bytes=1 << 30, max_entries=2)
+    for key in "abcd":
+        cache.get(key, loader(1))
+    stats = cache.stats()
+    assert stats["entries"] == 2 and stats["evictions"] == 2
+    loads = []
+    cache.get("a", loader(1, loads))
+    assert loads == [1]
+
+
+def test_keeps_a_single_entry_over_budget():
+    cache = RetrieverCache(max_bytes=100, max_entries=10)
+    cache.get("a", loader(50))
+    big = cache.get("b", loader(500))
+    assert cache.get("b", loader(500)) is big
+    assert cache.stats()["entries"] == 1
+
+
+def test_missing_index_is_not_cached():
+    cache = RetrieverCache(max_bytes=100, max_entries=10)
+    assert cache.get("a", lambda: None) is None
+    assert cache.stats()["entries"] == 0 and cache.stats()["misses"] == 1
@@ -0,0 +1,43 @@
+import json
+import faiss
+import numpy as np
+from app.config import settings
+from app.rag.registry import RetrieverCache
+from app.rag.retriever import Retriever
+
+
+def write_index(index_dir, rows: int = 64, dim: int = 16):
+    """写一个只有 faiss.index、embeddings.npy 与元数据的小索引"""
+    index_dir.mkdir()
+    embs = np.random.default_rng(rows).standard_normal((rows, dim)).astype("float32")
+    faiss.normalize_L2(embs)
+    index = faiss.IndexFlatIP(dim)
+    index.add(embs)
+    faiss.write_index(index, str(index_dir / "faiss.index"))
+    np.save(index_dir / "embeddings.npy", embs)
+    with open(index_dir / "meta.jsonl", "w", encoding="utf-8") as f:
+        for i in range(rows):
+            f.write(json.dumps({"book": "a.pdf", "page": i, "text": f"chunk {i}"}) + "\n")
+    return str(index_dir)
+
+
+def test_mmapped_retrievers_are_still_evicted(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "INDEX_MMAP", True)
+    dirs = [write_index(tmp_path / f"u{i}") for i in range(5)]
+
+    def loader(index_dir):
+        def load():
+            retriever = Retriever(index_dir, top_k=3)
+            retriever.load()
+            return retriever
+        return load
+
+    # 字节预算足够大：mmap 的部分不计入常驻字节，淘汰由条目数上限触发
+    cache = RetrieverCache(max_bytes=1 << 30, max_entries=2)
+    for index_dir in dirs:
+        retriever = cache.get(index_dir, loader(index_dir))
+        assert isinstance(retriever.embeddings, np.memmap)
+
+    stats = cache.stats()
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 3
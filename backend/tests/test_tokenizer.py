@@ -0,0 +1,45 @@
+import pytest
+from app.rag.sparse import BM25Index, load_bm25
+from app.rag.tokenizer import bigram_tokenize, char_tokenize, get_tokenizer
+
+
+def test_cjk_runs_become_bigrams():
+    assert bigram_tokenize("进程调度") == ["进程", "程调", "调度"]
+
+
+def test_stop_chars_split_cjk_runs():
+    # "的" 把片段切开，不产生 "程的"、"的调" 这类跨停用字的二元词
+    assert bigram_tokenize("进程的调度") == ["进程", "调度"]
+    # 切开后只剩一个字时保留单字
+    assert bigram_tokenize("页和表") == ["页", "表"]
+
+
+def test_ascii_words_are_lowercased_without_stopwords():
+    assert bigram_tokenize("The TCP/IP stack and C++ in Linux-5.10") == [
+        "tcp", "ip", "stack", "c++", "linux-5.10"]
+
+
+def test_mixed_text_and_punctuation():
+    assert bigram_tokenize("虚拟内存（Virtual Memory）：页表。") == [
+        "虚拟", "拟内", "内存", "virtual", "memory", "页表"]
+
+
+def test_char_tokenizer_keeps_old_behaviour():
+    assert char_tokenize("进程 A") == ["进", "程", " ", "A"]
+
+
+def test_unknown_tokenizer_is_rejected():
+    with pytest.raises(ValueError):
+        get_tokenizer("nope")
+
+
+def test_index_queries_with_its_own_tokenizer(tmp_path):
+    docs = ["进程调度算法", "虚拟内存管理", "文件系统的目录结构"]
+    index = BM25Index.build([bigram_tokenize(d) for d in docs], tokenizer="bigram")
+    index.save(str(tmp_path))
+    loaded = load_bm25(str(tmp_path))
+    assert loaded.tokenizer == "bigram"
+    ids, _ = loaded.search_text("调度", 3)
+    assert list(ids) == [0]
+    ids, _ = loaded.search_text("目录", 3)
+    assert list(ids) == [2]
@@ -0,0 +1,57 @@
+import os
+import pytest
+from fastapi.testclient import TestClient
+from app.auth import create_token
+from app.config import settings
+from app.main import app
+from app.rag.doc_store import format_size, store_root, upload_stats
+
+
+def multipart(token: str, size: int):
+    yield (b'--x\r\nContent-Disposition: form-data; name="token"\r\n\r\n' + token.encode()
+           + b'\r\n--x\r\nContent-Disposition: form-data; name="file"; filename="big.pdf"\r\n'
+           b'Content-Type: application/pdf\r\n\r\n%PDF-1.4\n')
+    for _ in range(size // (64 * 1024)):
+        yield b"0" * (64 * 1024)
+    yield b"\r\n--x--\r\n"
+
+
+def test_format_size():
+    assert format_size(100 << 20) == "100 MB"
+    assert format_size(1536 << 10) == "1.5 MB"
+    assert format_size(512 << 10) == "512 KB"
+    assert format_size(300) == "300 字节"
+
+
+@pytest.fixture(autouse=True)
+def no_worker(monkeypatch):
+    # 这里的请求都不会入队，不启动后台构建线程
+    monkeypatch.setattr(settings, "INDEX_WORKER_IN_PROCESS", False)
+
+
+def test_oversized_uploads_are_rejected_while_receiving(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_MAX_BYTES", 256 * 1024)
+    token = create_token("u1")
+    with TestClient(app) as client:
+        # 分块传输，没有 Content-Length
+        r = client.post("/api/upload-pdf", content=multipart(token, 1 << 20),
+                        headers={"content-type": "multipart/form-data; boundary=x"})
+        assert r.status_code == 413
+        assert r.json()["detail"] == "文件超过 256 KB 上限"
+
+        r = client.post("/api/upload-pdf", data={"token": token},
+                        files={"file": ("big.pdf", b"%PDF-1.4\n" + b"0" * (1 << 20), "application/pdf")})
+        assert r.status_code == 413
+
+
+def test_invalid_files_are_rejected_and_cleaned_up(tmp_path, make_pdf):
+    token = create_token("u2")
+    pdf = make_pdf(tmp_path / "book.pdf").read_bytes()
+    tmp_dir = os.path.join(store_root(), "tmp")
+    with TestClient(app) as client:
+        for data in (b"plain text, not a pdf\n" * 100, pdf[:200]):
+            r = client.post("/api/upload-pdf", data={"token": token},
+                            files={"file": ("bad.pdf", data, "application/pdf")})
+            assert r.status_code == 400
+        assert os.listdir(tmp_dir) == []
+        assert upload_stats.stats()["rejected_invalid"] >= 2